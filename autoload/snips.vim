@@ -5,6 +5,8 @@ let s:current_line = -1
 let s:expand_end_line = -1
 let s:pos = {}
 let s:completor_callback_set = v:false
+let s:snippets_dirs = []
+let s:snips_imported = v:false
 
 
 func! s:err(message)
@@ -37,35 +39,72 @@ func! snips#import() abort
 endfunc
 
 
-func! s:render(res, lnum) abort
-  if empty(a:res.content)
-    let lines = []
-    let current = ''
-    let remain_lines = []
-  else
-    let lines = split(a:res.content, "\n", v:true)
-    let current = lines[0]
-    let remain_lines = lines[1:]
+func! s:import_snips() abort
+  if s:snips_imported
+    return v:true
+  endif
+
+  try
+    exe s:py 'import vim, snips'
+  catch /^Vim(py\(thon\|3\)):/
+    return v:false
+  endtry
+
+  let s:snips_imported = v:true
+  call s:set_snippets_dirs()
+  return v:true
+endfunc
+
+" Load the snippets of the filetype in background.
+func! snips#prewarm(ft) abort
+  if empty(a:ft)
+        \ || empty(g:snips_snippets_dirs) && empty(get(g:, 'snips_bundle', ''))
+        \ || !s:import_snips()
+    return
+  endif
+
+  exe s:py 'snips.prewarm(vim.eval("a:ft"))'
+endfunc
+
+
+" Load the snippets of every filetype.
+func! snips#preload_all() abort
+  if !s:import_snips()
+    return
+  endif
+
+  exe s:py 'res = snips.preload_all()'
+  echo printf('snips: %d filetypes loaded', len(s:pyeval('res')))
+endfunc
+
+
+" Replace the changed lines of the expansion starting at lnum.
+func! s:apply(res, lnum) abort
+  let first = a:lnum + a:res.first_line
+  let size = a:res.last_line - a:res.first_line
+  let lines = a:res.replacement_lines
+  let n = min([size, len(lines)])
+
+  if n > 0
+    call setline(first, lines[:n-1])
   endif
 
-  call setline(a:lnum, current)
-  if s:expand_end_line >= a:lnum + 1
-    call deletebufline('', a:lnum+1, s:expand_end_line)
+  if size > n
+    call deletebufline('', first + n, first + size - 1)
+  elseif len(lines) > n
+    call append(first + n - 1, lines[n:])
   endif
+endfunc
 
-  call append(a:lnum, remain_lines)
+func! s:render(res, lnum) abort
+  call s:apply(a:res, a:lnum)
 
-  let s:expand_end_line = a:lnum+len(remain_lines)
+  let s:expand_end_line = a:lnum + a:res.line_count - 1
   let s:current_line = a:lnum
 
   if empty(a:res.pos)
     let s:pos = {}
-
-    if len(lines) == 0
-      let s:pos.line = a:lnum
-    else
-      let s:pos.line = a:lnum + len(lines) - 1
-    endif
+    let s:pos.line = s:expand_end_line
 
     if a:res.end_col > 0
       let s:pos.col = a:res.end_col + 1
@@ -294,6 +333,10 @@ func! s:_clear_trigger(length, is_block)
 endfunc
 
 func! s:expand(lnum, column, line) abort
+  if s:snippets_dirs != g:snips_snippets_dirs
+    call s:set_snippets_dirs()
+  endif
+
   let tabstop = &softtabstop
 
   if tabstop == 0
@@ -305,6 +348,7 @@ func! s:expand(lnum, column, line) abort
   let context = #{
         \ fname: expand("%:t"),
         \ fpath: expand("%"),
+        \ snippets_dirs: get(b:, 'snips_snippets_dirs', []),
         \ ftype: &ft,
         \ lnum: a:lnum - 1,
         \ column: a:column - 1,
@@ -321,18 +365,15 @@ func! s:expand(lnum, column, line) abort
 
   let s:context = context
 
-  exe s:py 'res = snips.expand(vim.bindeval("context"))'
-  return s:pyeval('res')
+  return s:pyeval('snips.expand(vim.bindeval("context"))')
 endfunc
 
 func! s:jump(direction) abort
-  exe s:py 'res = snips.jump(vim.eval("&ft"), vim.eval("a:direction"))'
-  return s:pyeval('res')
+  return s:pyeval('snips.jump(vim.eval("&ft"), vim.eval("a:direction"))')
 endfunc
 
 func! s:rerender(content) abort
-  exe s:py 'res = snips.rerender(vim.eval("a:content"))'
-  return s:pyeval('res')
+  return s:pyeval('snips.rerender(vim.eval("a:content"))')
 endfunc
 
 func! s:reset_jump() abort
@@ -340,7 +381,26 @@ func! s:reset_jump() abort
 endfunc
 
 func! s:set_snippets_dirs() abort
+  let s:snippets_dirs = copy(g:snips_snippets_dirs)
   exe s:py 'snips.set_snippets_dirs(vim.eval("g:snips_snippets_dirs"))'
+  if exists('g:snips_cache_dir')
+    exe s:py 'snips.set_cache_dir(vim.eval("g:snips_cache_dir"))'
+  endif
+  if exists('g:snips_bundle')
+    exe s:py 'snips.set_bundle(vim.eval("expand(g:snips_bundle)"))'
+  endif
+  if exists('g:snips_project_dir')
+    exe s:py 'snips.set_project_dir(vim.eval("g:snips_project_dir"))'
+  endif
+  exe s:py printf('snips.set_cache_limit(%d, %d)',
+        \ get(g:, 'snips_cache_max_filetypes', 0),
+        \ get(g:, 'snips_cache_max_bytes', 0))
+  if exists('g:snips_lazy_load')
+    exe s:py 'snips.set_lazy_load(vim.eval("g:snips_lazy_load") != "0")'
+  endif
+  if get(g:, 'snips_watch', 0)
+    exe s:py 'snips.start_watcher()'
+  endif
 endfunc
 
 func! snips#_gen_hi_groups() abort
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Synthetic snippet corpus shared by the benchmarks."""
+
+import os
+import sys
+
+DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Make the pythonx directory importable
+sys.path.append(os.path.join(DIR, 'pythonx'))
+
+BODIES = (
+    'for (${1:int} ${2:i} = 0; $2 < ${3:n}; $2++) {\n\t${0:/* code */}\n}',
+    'def ${1:fname}(`!p snip.rv = "self, " if snip.indent else ""`$2):\n'
+    '\t"""${3:doc for $1}"""\n\t$0',
+    'class ${1:Name}(${2:object}):\n\tdef __init__(self${3:, arg}):\n'
+    '\t\t${4:super(${1/(\\w+)/$1/}, self).__init__()}\n\t\t$0',
+    'if ${1:cond}:\n\t${2:pass}',
+    '<div class="${1:name}">\n\t${VISUAL}$0\n</div>',
+)
+
+
+def snippet_file(count, offset=0):
+    """Generates the content of a snippet file with `count` snippets.
+    """
+    lines = ['# generated', 'priority -50', '']
+    for i in range(count):
+        n = i + offset
+        lines.append('snippet t{} "Snippet {}" b'.format(n, n))
+        lines.append(BODIES[n % len(BODIES)])
+        lines.append('endsnippet')
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def write_corpus(directory, files=50, snippets=200):
+    """Writes `files` snippet files into `directory`.
+
+    :returns: The list of written paths.
+    """
+    paths = []
+    for i in range(files):
+        path = os.path.join(directory, 'ft{}.snippets'.format(i))
+        with open(path, 'w') as w:
+            w.write(snippet_file(snippets, offset=i * snippets))
+        paths.append(path)
+    return paths
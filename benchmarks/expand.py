@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Expand time of the static corpus bodies, rendered every time and reused
+from the render cache.
+
+Usage: python benchmarks/expand.py [rounds]
+"""
+
+import sys
+import time
+
+from corpus import BODIES
+
+from snips.ast import Session, compile_template
+
+CONTEXT = {
+    'fname': 'a.py',
+    'ftype': 'python',
+    'indent': 4,
+    'tabstop': 4,
+    'expandtab': True,
+}
+
+
+def _is_block():
+    return True
+
+
+def _expand(template, rounds, cached):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        session = Session(template, _is_block)
+        if cached:
+            session.expand({}, dict(CONTEXT))
+        else:
+            session.render({}, dict(CONTEXT))
+    return time.perf_counter() - start
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print("{:>6} {:>10} {:>10}".format('body', 'render', 'cached'))
+
+    for i, body in enumerate(BODIES):
+        template = compile_template(body)
+        if not template.is_static():
+            continue
+        template.compiled()
+
+        print("{:>6} {:>9.3f}s {:>9.3f}s".format(
+            i, _expand(template, rounds, False),
+            _expand(template, rounds, True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Cold vs warm load of snippet files through the persistent cache, the
+process pool and the header-only scan used by lazy loading.
+
+Usage: python benchmarks/load.py [files] [snippets-per-file]
+"""
+
+import sys
+import time
+import tempfile
+
+from corpus import write_corpus
+
+from snips.filecache import FileCache, parse_file
+from snips.parser import scan
+from snips.pool import parse_files
+
+
+def _load(paths, file_cache):
+    start = time.perf_counter()
+    for p in paths:
+        parse_file(p, file_cache)
+    return time.perf_counter() - start
+
+
+def _parallel(paths):
+    start = time.perf_counter()
+    parse_files(paths, force=True)
+    return time.perf_counter() - start
+
+
+def _scan(paths):
+    start = time.perf_counter()
+    for p in paths:
+        scan(p)
+    return time.perf_counter() - start
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    snippets = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with tempfile.TemporaryDirectory() as d:
+        paths = write_corpus(d, files, snippets)
+        file_cache = FileCache(tempfile.mkdtemp(dir=d))
+
+        nocache = _load(paths, None)
+        cold = _load(paths, file_cache)
+        warm = _load(paths, file_cache)
+        parallel = _parallel(paths)
+        lazy = _scan(paths)
+
+    print("files={} snippets={}".format(files, files * snippets))
+    print("no cache: {:.3f}s".format(nocache))
+    print("cold:     {:.3f}s".format(cold))
+    print("warm:     {:.3f}s ({:.1f}x)".format(warm, nocache / warm))
+    print("parallel: {:.3f}s ({:.1f}x)".format(parallel,
+                                               nocache / parallel))
+    print("scan:     {:.3f}s ({:.1f}x)".format(lazy, nocache / lazy))
+
+
+if __name__ == '__main__':
+    main()
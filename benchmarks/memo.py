@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Time of a keystroke in the first tabstop of growing snippets, with an
+interpolation documenting the arguments of every tabstop, read through `t.get`,
+run every time and memoized.
+
+Usage: python benchmarks/memo.py [keystrokes]
+"""
+
+import sys
+import time
+
+import corpus  # noqa: F401, makes snips importable
+
+from snips import ast
+from snips.ast import Session, Template
+
+CONTEXT = {
+    'fname': 'a.py',
+    'ftype': 'python',
+    'indent': 4,
+    'tabstop': 4,
+    'expandtab': True,
+}
+
+
+def _is_block():
+    return True
+
+
+def _body(tabstops):
+    lines = []
+    for i in range(1, tabstops + 1):
+        lines.append('\tdef f{0}(${{{0}:a, b, c}}): # `!p snip.rv = " ".join('
+                     '":param {{}}:".format(a.strip()) for a in '
+                     't.get({0}, "").split(",") if a.strip())`'.format(i))
+    return '\n'.join(lines)
+
+
+def _keystrokes(template, count):
+    session = Session(template, _is_block)
+    session.render({}, dict(CONTEXT))
+    start = time.perf_counter()
+    for i in range(count):
+        session.rerender('x' * (i % 20))
+    return (time.perf_counter() - start) / count
+
+
+def _always_impure(code, namespace, seen=None):
+    return True
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    is_impure = ast.is_impure
+
+    print("{:>8} {:>12} {:>12}".format('tabstops', 'run', 'memoized'))
+    for tabstops in (10, 50, 200, 800):
+        template = Template(_body(tabstops))
+        ast.is_impure = _always_impure
+        run = _keystrokes(template, count)
+        ast.is_impure = is_impure
+        print("{:>8} {:>10.3f}ms {:>10.3f}ms".format(
+            tabstops, run * 1e3, _keystrokes(template, count) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
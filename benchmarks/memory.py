@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Memory held by the parsed statements and snippet body trees of a corpus.
+
+Usage: python benchmarks/memory.py [snippets-dir]
+
+The directory defaults to a synthetic corpus, pass the `UltiSnips`
+directory of vim-snippets to measure the real one.
+"""
+
+import os
+import sys
+import glob
+import tempfile
+import tracemalloc
+
+from corpus import write_corpus
+
+from snips.ast import Snippet, parse_snippet_body
+from snips.parser import parse
+
+
+def _load(paths):
+    stmts = []
+    for p in paths:
+        with open(p) as r:
+            stmts.extend(parse(r.read(), filename=p))
+    return stmts
+
+
+def _parse_bodies(stmts):
+    trees = []
+    for s in stmts:
+        if not isinstance(s, Snippet):
+            continue
+        try:
+            trees.append(parse_snippet_body(s.body))
+        except Exception:
+            pass
+    return trees
+
+
+def _measure(func, *args):
+    tracemalloc.start()
+    result = func(*args)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def _report(paths):
+    stmts, stmts_size = _measure(_load, paths)
+    trees, trees_size = _measure(_parse_bodies, stmts)
+    snippets = sum(1 for s in stmts if isinstance(s, Snippet))
+
+    print("files={} snippets={}".format(len(paths), snippets))
+    print("statements: {:8.1f} KB".format(stmts_size / 1024.0))
+    print("body trees: {:8.1f} KB".format(trees_size / 1024.0))
+
+
+def main():
+    if len(sys.argv) > 1:
+        _report(sorted(glob.glob(os.path.join(sys.argv[1], '*.snippets'))))
+        return
+
+    with tempfile.TemporaryDirectory() as d:
+        _report(write_corpus(d, 50, 200))
+
+
+if __name__ == '__main__':
+    main()
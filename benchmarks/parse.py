@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Parse time of growing snippet files, the time per snippet stays flat when
+parsing is linear in the file size.
+
+Usage: python benchmarks/parse.py [snippets]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from corpus import snippet_file
+
+from snips.parser import parse, iter_parse
+
+
+def _parse(data):
+    start = time.perf_counter()
+    parse(data)
+    return time.perf_counter() - start
+
+
+def _iter_parse(path):
+    start = time.perf_counter()
+    with open(path) as r:
+        for _ in iter_parse(r):
+            pass
+    return time.perf_counter() - start
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    print("{:>8} {:>10} {:>10} {:>10}".format(
+        'snippets', 'parse', 'iter_parse', 'us/snippet'))
+
+    with tempfile.TemporaryDirectory() as d:
+        for count in (total // 8, total // 4, total // 2, total):
+            data = snippet_file(count)
+            path = os.path.join(d, 'ft.snippets')
+            with open(path, 'w') as w:
+                w.write(data)
+
+            t = _parse(data)
+            it = _iter_parse(path)
+            print("{:>8} {:>9.3f}s {:>9.3f}s {:>10.2f}".format(
+                count, t, it, t / count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Expand and rerender time of the generic render and of the generated
+render functions.
+
+Usage: python benchmarks/render.py [rounds]
+"""
+
+import sys
+import time
+
+from corpus import BODIES
+
+from snips.ast import Session, compile_template
+
+
+class GenericSession(Session):
+    __slots__ = ()
+
+    _text = Session._render_text
+
+
+CONTEXT = {
+    'fname': 'a.py',
+    'ftype': 'python',
+    'indent': 4,
+    'tabstop': 4,
+    'expandtab': True,
+    'visual': 'selected',
+}
+
+
+def _is_block():
+    return True
+
+
+def _expand(cls, template, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        cls(template, _is_block).render({}, dict(CONTEXT))
+    return time.perf_counter() - start
+
+
+def _rerender(cls, template, rounds):
+    session = cls(template, _is_block)
+    session.render({}, dict(CONTEXT))
+    start = time.perf_counter()
+    for i in range(rounds):
+        session.rerender('x' * (i % 20))
+    return time.perf_counter() - start
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print("{:>6} {:>10} {:>10} {:>10} {:>10}".format(
+        'body', 'expand', 'compiled', 'rerender', 'compiled'))
+
+    for i, body in enumerate(BODIES):
+        template = compile_template(body)
+        template.compiled()
+
+        print("{:>6} {:>9.3f}s {:>9.3f}s {:>9.3f}s {:>9.3f}s".format(
+            i,
+            _expand(GenericSession, template, rounds),
+            _expand(Session, template, rounds),
+            _rerender(GenericSession, template, rounds),
+            _rerender(Session, template, rounds)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Time of a keystroke in the first tabstop of growing snippets, with a
+mirror, a transformation and an interpolation for every tabstop.
+
+Usage: python benchmarks/rerender.py [keystrokes]
+"""
+
+import sys
+import time
+
+import corpus  # noqa: F401, makes snips importable
+
+from snips.ast import Session, Template
+
+
+class GenericSession(Session):
+    __slots__ = ()
+
+    _text = Session._render_text
+
+
+CONTEXT = {
+    'fname': 'a.py',
+    'ftype': 'python',
+    'indent': 4,
+    'tabstop': 4,
+    'expandtab': True,
+}
+
+
+def _is_block():
+    return True
+
+
+def _body(tabstops):
+    lines = []
+    for i in range(1, tabstops + 1):
+        lines.append('\t${{{0}:name{0}}} = $${0} ${{{0}/(\\w+)/\\u$1/}} '
+                     '`!p snip.rv = t[{0}].upper()`'.format(i))
+    return '\n'.join(lines)
+
+
+def _keystrokes(cls, template, count):
+    session = cls(template, _is_block)
+    session.render({}, dict(CONTEXT))
+    start = time.perf_counter()
+    for i in range(count):
+        session.rerender('x' * (i % 20))
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    print("{:>8} {:>12} {:>12}".format('tabstops', 'generic', 'incremental'))
+    for tabstops in (10, 50, 200, 800):
+        template = Template(_body(tabstops))
+        print("{:>8} {:>10.3f}ms {:>10.3f}ms".format(
+            tabstops,
+            _keystrokes(GenericSession, template, count) * 1e3,
+            _keystrokes(Session, template, count) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Expand time of growing generated scaffolds and rerender time of pasting
+a growing block into a placeholder, the time per line stays flat when
+rendering is linear in the output size.
+
+Usage: python benchmarks/scaling.py [lines]
+"""
+
+import sys
+import time
+
+import corpus  # noqa: F401, makes snips importable
+
+from snips.ast import Snippet
+
+CONTEXT = {
+    'fname': 'a.py',
+    'ftype': 'python',
+    'indent': 4,
+    'tabstop': 4,
+    'expandtab': True,
+}
+
+
+def scaffold(lines):
+    """Generates a block snippet body of `lines` lines, with a tabstop and
+    its mirror on every tenth line, and the first tabstop mirrored at the
+    end.
+    """
+    body = ['class ${1:Name}(object):']
+    for i in range(lines - 2):
+        if i % 10 == 0:
+            body.append('\tdef ${{{0}:method{1}}}(self):  # {0} ${0}'.format(
+                i // 10 % 50 + 2, i))
+        else:
+            body.append('\t\tself.attr{0} = {0}'.format(i))
+    body.append('# end of $1')
+    return '\n'.join(body)
+
+
+def _expand(body):
+    snippet = Snippet('t', '', 'b', body)
+    start = time.perf_counter()
+    snippet.render({}, dict(CONTEXT))
+    return snippet, time.perf_counter() - start
+
+
+def _paste(snippet, lines):
+    block = '\n'.join('pasted = {}'.format(i) for i in range(lines))
+    start = time.perf_counter()
+    snippet.rerender(block)
+    return time.perf_counter() - start
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+
+    print("{:>8} {:>10} {:>10} {:>10} {:>10}".format(
+        'lines', 'expand', 'us/line', 'paste', 'us/line'))
+
+    for count in (total // 8, total // 4, total // 2, total):
+        snippet, expand = _expand(scaffold(count))
+        paste = _paste(snippet, count)
+        print("{:>8} {:>9.3f}s {:>10.2f} {:>9.3f}s {:>10.2f}".format(
+            count, expand, expand / count * 1e6, paste,
+            paste / count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
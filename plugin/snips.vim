@@ -36,4 +36,11 @@ augroup completor_snips
   autocmd InsertEnter * call s:enable()
 augroup END
 
+augroup snips_prewarm
+  autocmd!
+  autocmd FileType,BufEnter * call snips#prewarm(&ft)
+augroup END
+
+command! SnipsPreloadAll call snips#preload_all()
+
 let g:snips_snippets_dirs = get(g:, 'snips_snippets_dirs', [])
@@ -2,6 +2,7 @@
 
 import logging
 import snips
+import vim
 from completor import Completor
 
 
@@ -16,7 +17,9 @@ class Snips(Completor):
         if not base or base.endswith((' ', '\t')):
             return []
         token = base.split()[-1]
-        items = snips.get(self.ft_orig, token)
+        buf = vim.current.buffer
+        items = snips.get(self.ft_orig, token, path=buf.name,
+                          local_dirs=buf.vars.get('snips_snippets_dirs'))
 
         logger.info("items %r", items)
 
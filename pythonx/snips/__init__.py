@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from .snippets import get, expand, jump, reset_jump, rerender, \
-    set_snippets_dirs
+from .snippets import get, expand, prewarm, preload_all, jump, reset_jump, \
+    rerender, set_snippets_dirs, set_cache_dir, set_bundle, set_project_dir, \
+    set_cache_limit, set_lazy_load, start_watcher, stop_watcher, stats
 
 from .parser import gen_highlight_groups
 
-__all__ = ('get', 'expand', 'jump', 'reset_jump', 'rerender',
-           'set_snippets_dirs', 'gen_highlight_groups')
+__all__ = ('get', 'expand', 'prewarm', 'preload_all', 'jump', 'reset_jump',
+           'rerender', 'set_snippets_dirs', 'set_cache_dir', 'set_bundle',
+           'set_project_dir', 'set_cache_limit', 'set_lazy_load',
+           'start_watcher', 'stop_watcher', 'stats', 'gen_highlight_groups')
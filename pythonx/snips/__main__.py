@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import argparse
+
+from .bundle import compile_bundle
+from .check import check, format_problem
+
+
+def _compile(args):
+    start = time.time()
+    count = compile_bundle(args.dirs, args.output, workers=args.jobs)
+    print("compiled {} snippets into {} in {:.2f}s".format(
+        count, args.output, time.time() - start))
+    return 0
+
+
+def _check(args):
+    problems = check(args.paths, workers=args.jobs)
+    for p in problems:
+        print(format_problem(p))
+
+    if problems:
+        files = len(set(p.path for p in problems))
+        sys.stderr.write("{} problem(s) in {} file(s)\n".format(
+            len(problems), files))
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m snips')
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser(
+        'compile', help='compile snippets directories into a bundle')
+    p.add_argument('dirs', nargs='+', help='snippets directories')
+    p.add_argument('-o', '--output', default='snippets.snipc',
+                   help='bundle path (default: %(default)s)')
+    p.add_argument('-j', '--jobs', type=int, default=None,
+                   help='number of parser processes')
+    p.set_defaults(func=_compile)
+
+    p = commands.add_parser(
+        'check', help='check snippet files for errors, exit 1 if any')
+    p.add_argument('paths', nargs='+',
+                   help='snippets directories or files')
+    p.add_argument('-j', '--jobs', type=int, default=None,
+                   help='number of checker processes')
+    p.set_defaults(func=_check)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import re
+import sys
 import string
 import logging
 import collections
-from .interpolation import SnippetUtil, tab_indent
+from .interpolation import (_MISSING, Memo, SnippetUtil, Tabstops, is_impure,
+                            lookup_names, read_names, same_names, tab_indent,
+                            unchanged)
 from .highlight import hi
+from .lru import LRUCache
 
 escape_chars = {
     'n': '\\n',
@@ -16,18 +20,29 @@ logger = logging.getLogger("completor")
 
 VISUAL_NUM = 9999
 
+# Shared by the nodes until they need a container of their own.
+_EMPTY = ()
+
 
 class Base(object):
-    fname = '<unknown>'
-    line = -1
-    column = -1
+    # The nodes are created for every statement of every loaded file, slots
+    # keep them small.
+    __slots__ = ('fname', 'line', 'column')
+
+    def __init__(self):
+        self.fname = '<unknown>'
+        self.line = -1
+        self.column = -1
 
     def gen_hi_groups(self):
         return []
 
 
 class Comment(Base):
+    __slots__ = ('content',)
+
     def __init__(self, content):
+        Base.__init__(self)
         self.content = content
 
     def gen_hi_groups(self):
@@ -35,7 +50,10 @@ class Comment(Base):
 
 
 class Extends(Base):
+    __slots__ = ('types',)
+
     def __init__(self, types):
+        Base.__init__(self)
         self.types = types
 
     def __repr__(self):
@@ -43,7 +61,10 @@ class Extends(Base):
 
 
 class Priority(Base):
+    __slots__ = ('priority',)
+
     def __init__(self, priority):
+        Base.__init__(self)
         self.priority = priority
 
     def gen_hi_groups(self):
@@ -54,9 +75,11 @@ class Priority(Base):
 
 
 class _ExpandAction(Base):
+    __slots__ = ('body',)
     name = "unknown"
 
     def __init__(self, body):
+        Base.__init__(self)
         self.body = body
 
     def __repr__(self):
@@ -64,27 +87,23 @@ class _ExpandAction(Base):
 
 
 class PreExpand(_ExpandAction):
+    __slots__ = ()
     name = "pre_expand"
 
 
 class PostExpand(_ExpandAction):
+    __slots__ = ()
     name = "post_expand"
 
 
 class PostJump(_ExpandAction):
+    __slots__ = ()
     name = "post_jump"
 
 
-class _Location(object):
-    def __init__(self):
-        self.line = -1
-        self.column = -1
-
-    def __repr__(self):
-        return "{}:{}".format(self.line, self.column)
-
-
 class _Transformation(object):
+    __slots__ = ('regex', 'replacement', 'options', 'reference')
+
     def __init__(self, regex, replacement, options):
         self.regex = regex
         self.replacement = replacement
@@ -106,6 +125,8 @@ class _ReplacementState(object):
     TILL_OP = list(UPPER_TILL + LOWER_TILL)
     OP = list(UPPER_NEXT + LOWER_NEXT) + TILL_OP
 
+    __slots__ = ('state',)
+
     def __init__(self):
         self.state = ''
 
@@ -148,42 +169,21 @@ class _SnippetPart(object):
     INTERPOLATION = 'interp'
     PLACEHOLDER = 'ph'
 
+    # Parts are shared by all the expansions of a template and never modified
+    # once parsed, the rendering state lives in the Session.
+    __slots__ = ('type', 'start_offset', 'end_offset', 'literal', 'number',
+                 'default', 'nest_level', 'transformation')
+
     def __init__(self, t=None, start_offset=0, end_offset=0):
         self.type = t
         self.start_offset = start_offset
         self.end_offset = end_offset
         self.literal = ''
         self.number = None
-        self.default = []
-        self.editted = False
-        self.ph_text = ''
+        self.default = _EMPTY
         self.nest_level = 0
-        self.placeholders = {}
         self.transformation = None
 
-        self.lnum = -1
-        self.col = -1
-
-        self.start = _Location()
-        self.end = _Location()
-
-    def _adjust_location(self, p, line, column):
-        for d in p.default:
-            start_line = d.start.line
-            end_line = d.end.line
-
-            d.start.line += line
-            d.end.line += line
-
-            if start_line == 0:
-                d.start.column += column
-
-            if end_line == 0:
-                d.end.column += column
-
-            if d.type == self.PLACEHOLDER:
-                self._adjust_location(d, d.start.line, d.start.column)
-
     def _try_apply_transformation(self, text):
         tran = self.transformation
 
@@ -253,234 +253,673 @@ class _SnippetPart(object):
 
         return res
 
-    def render(self, g, context, ph, is_nested=False, cache=None):
+    def append_literal(self, literal):
+        if self.type is None:
+            self.type = self.TEXT
+
+        self.literal += literal
+
+    def __repr__(self):
+        if self.type == self.PLACEHOLDER:
+            v = 'number={}'.format(self.number)
+        else:
+            v = 'content={!r}'.format(self.literal)
+
+        return "<SnippetPart type={} offset={} {}>".format(
+            self.type, (self.start_offset, self.end_offset), v)
+
+
+def _advance(text, line, column):
+    """Gets the position after `text` rendered at `line` and `column`.
+    """
+    i = text.rfind('\n')
+    if i < 0:
+        return line, column + len(text)
+    return line + text.count('\n'), len(text) - i - 1
+
+
+class Template(object):
+    """Compiled snippet body.
+
+    A template is shared by all the expansions of the snippets with the same
+    body, rendering never modifies it.
+    """
+
+    __slots__ = ('body', 'parts', 'placeholders', 'ph_list', 'origin',
+                 '_compiled', '_interpolated', '_static', '_interpolations')
+
+    def __init__(self, body, origin=None):
+        self.body = body
+        placeholders = {}
+        if body:
+            self.parts, _ = parse_snippet_body(body, placeholders)
+        else:
+            self.parts = []
+        # number -> placeholder
+        self.placeholders = placeholders
+        # The placeholders in jump order.
+        self.ph_list = tuple(sorted(placeholders.values(),
+                                    key=lambda x: x.number))
+        # The file and the line of the body, for the interpolation
+        # tracebacks.
+        self.origin = origin
+        self._compiled = None
+        self._interpolated = None
+        self._static = None
+        self._interpolations = None
+
+    def has_interpolations(self):
+        """Whether the body has interpolations, they can read the placeholder
+        texts while they are rendered.
+        """
+        if self._interpolated is None:
+            parts = list(self.parts)
+            self._interpolated = False
+            while parts:
+                part = parts.pop()
+                if part.type == part.INTERPOLATION:
+                    self._interpolated = True
+                    break
+                parts.extend(part.default)
+        return self._interpolated
+
+    def is_static(self):
+        """Whether the body always renders the same text for the same
+        indentation, without interpolations, transformations, visual or nested
+        placeholders.
+        """
+        if self._static is None:
+            self._static = not self.has_interpolations() and all(
+                _is_plain(part) for part in self.parts)
+        return self._static
+
+    def interpolation(self, part):
+        """Gets the interpolation of a part, created once so that its code
+        is only compiled once.
+        """
+        interpolations = self._interpolations
+        if interpolations is None:
+            interpolations = self._interpolations = {}
+
+        interp = interpolations.get(part)
+        if interp is None:
+            interp = interpolations[part] = Interpolation(part.literal)
+            if self.origin is not None:
+                interp.fname, line = self.origin
+                interp.line = line + self.body.count('\n', 0,
+                                                     part.start_offset)
+        return interp
+
+    def compiled(self):
+        """Gets the render functions and the dependency graph of the body,
+        generated on first use.
+        """
+        if self._compiled is None:
+            from .codegen import compile_template_code
+            self._compiled = compile_template_code(self)
+        return self._compiled
+
+    def __getstate__(self):
+        # Generated functions can't be pickled.
+        return self.body, self.parts, self.placeholders, self.ph_list
+
+    def __setstate__(self, state):
+        self.body, self.parts, self.placeholders, self.ph_list = state
+        self.origin = None
+        self._compiled = None
+        self._interpolated = None
+        self._static = None
+        self._interpolations = None
+
+
+def _is_plain(part):
+    if part.type != part.PLACEHOLDER:
+        return True
+    return part.number != VISUAL_NUM and part.transformation is None and \
+        all(d.type is None or d.type == d.TEXT for d in part.default)
+
+
+# Compiled templates by body, the least recently used are evicted.
+_templates = LRUCache(max_entries=512)
+
+# Renders of the static templates by template and indentation.
+_rendered = LRUCache(max_entries=256)
+
+
+def compile_template(body, template=None, origin=None):
+    """Gets the compiled template of a snippet body.
+
+    :param template: A precompiled template of the body, shared when the body
+        has no template yet.
+    :param origin: The file and the line of the body, kept by the template
+        shared first.
+    :raises BaseParseError: The body is invalid.
+    """
+    shared = _templates.lookup(body)
+    if shared is None:
+        shared = template if template is not None else Template(body)
+        if shared.origin is None:
+            shared.origin = origin
+        _templates.put(body, shared)
+    return shared
+
+
+class Session(object):
+    """The rendering state of one expansion of a template.
+    """
+
+    __slots__ = ('template', 'placeholders', 'ph_list', 'ph_text',
+                 'locations', 'defaults', 'editted', 'current_jump', 'g',
+                 'context', 'is_block', 'texts', 'values', 'lines',
+                 'indented', 'offsets', 'plain', 'lazy')
+
+    def __init__(self, template, is_block):
+        self.template = template
+        # number -> placeholder, editing a placeholder removes the nested
+        # ones.
+        self.placeholders = dict(template.placeholders)
+        self.ph_list = list(template.ph_list)
+        # part -> rendered text
+        self.ph_text = {}
+        # part -> [start line, start column, end line, end column]
+        self.locations = {}
+        # placeholder -> default replaced by the edited text
+        self.defaults = {}
+        self.editted = set([])
+
+        self.current_jump = None
+        self.g = None
+        self.context = None
+        self.is_block = is_block
+
+        # The prefix and the text of every unit of the compiled template, as
+        # last rendered, None when they must all be rendered again.
+        self.texts = None
+        # number -> placeholder text, as last rendered
+        self.values = {}
+        # The lines as last rendered, before and after indenting, and their
+        # indent offsets.
+        self.lines = []
+        self.indented = []
+        self.offsets = []
+        # Whether every placeholder has a literal text and is never nested,
+        # the edits then only render the units depending on them.
+        self.plain = False
+        # Whether the locations are computed from the unit texts when used.
+        self.lazy = False
+
+    def _location(self, part):
+        loc = self.locations.get(part)
+        if loc is None:
+            if self.lazy:
+                loc = self._unit_location(part)
+            else:
+                loc = [-1, -1, -1, -1]
+            self.locations[part] = loc
+        return loc
+
+    def _unit_location(self, part):
+        """Gets the indented location of a placeholder of the body from the
+        texts of the units.
+        """
+        i = self.template.compiled().index.get(part)
+        if i is None:
+            return [-1, -1, -1, -1]
+
+        before = ''.join(self.texts[:i + 1])
+        line = before.count('\n')
+        column = len(before) - before.rfind('\n') - 1
+        end_line, end_column = _advance(self.texts[i + 1], line, column)
+        offsets = self.offsets
+        return [line, column + offsets[line], end_line,
+                end_column + offsets[end_line]]
+
+    def _default(self, p):
+        return self.defaults.get(p, p.default)
+
+    def _adjust_location(self, p, line, column):
+        for d in self._default(p):
+            loc = self._location(d)
+            start_line = loc[0]
+            end_line = loc[2]
+
+            loc[0] += line
+            loc[2] += line
+
+            if start_line == 0:
+                loc[1] += column
+
+            if end_line == 0:
+                loc[3] += column
+
+            if d.type == d.PLACEHOLDER:
+                self._adjust_location(d, loc[0], loc[1])
+
+    def _render_part(self, part, g, context, ph, is_nested=False,
+                     cache=None):
         if cache is None:
             cache = {}
 
         text = ''
 
         if not is_nested:
-            self.start.line = line = context['_line']
-            self.start.column = column = context['_column']
-
-        if self.type == self.TEXT:
-            text = self.literal
-        elif self.type == self.PLACEHOLDER:
-            if self.number == VISUAL_NUM:
+            loc = self._location(part)
+            loc[0] = line = context['_line']
+            loc[1] = column = context['_column']
+
+        if part.type == part.TEXT:
+            text = part.literal
+        elif part.type == part.PLACEHOLDER:
+            if part.number == VISUAL_NUM:
                 visual = context.get('visual', '').strip()
                 if visual:
                     cache[VISUAL_NUM] = visual
 
-            t = cache.get(self.number)
+            t = cache.get(part.number)
             if t is not None:
-                v = self._try_apply_transformation(t)
+                v = part._try_apply_transformation(t)
             elif is_nested:
-                p = ph.get(self.number)
+                p = ph.get(part.number)
                 if p is None:
                     raise BaseParseError(
-                        "placeholder {} not found".format(self.numbder))
+                        "placeholder {} not found".format(part.number))
 
                 v = cache.get(p.number)
 
                 if v is None:
-                    v = ''
-                    for d in p.default:
-                        v += d.render(g, context, is_nested=True,
-                                      ph=ph, cache=cache)
+                    v = ''.join([
+                        self._render_part(d, g, context, ph, is_nested=True,
+                                          cache=cache)
+                        for d in self._default(p)])
 
-                v = self._try_apply_transformation(v)
-                cache[self.number] = v
+                v = part._try_apply_transformation(v)
+                cache[part.number] = v
             else:
-                v = self.ph_text
-                p = ph.get(self.number)
+                v = self.ph_text.get(part, '')
+                p = ph.get(part.number)
                 if p:
-                    v = p.ph_text
+                    v = self.ph_text.get(p, '')
                     # Only non-ref placeholder should adjust location.
-                    if p is self:
-                        self._adjust_location(p, p.start.line, p.start.column)
+                    if p is part:
+                        self._adjust_location(p, loc[0], loc[1])
 
-                v = self._try_apply_transformation(v)
-                cache[self.number] = v
+                v = part._try_apply_transformation(v)
+                cache[part.number] = v
 
             text = v
-        elif self.type == self.INTERPOLATION:
-            phs = {p.number: p.ph_text for p in ph.values()}
-            interp = Interpolation(self.literal)
+        elif part.type == part.INTERPOLATION:
+            phs = {p.number: self.ph_text.get(p, '') for p in ph.values()}
+            interp = self.template.interpolation(part)
             text = interp.gen_text(g, context, phs)
 
-        tmp = text
-
-        # \nhello\n\t\t
-        # hello
-        while not is_nested:
-            i = tmp.find('\n')
-            if i < 0:
-                context['_column'] = column + len(tmp)
-                break
-
-            line = context['_line'] = line + 1
-            context['_column'] = column = 0
-            tmp = tmp[i+1:]
-
         if not is_nested:
-            self.end.line = context['_line']
-            self.end.column = context['_column']
+            # \nhello\n\t\t
+            # hello
+            line, column = _advance(text, line, column)
+            loc[2] = context['_line'] = line
+            loc[3] = context['_column'] = column
 
         return text
 
-    def append_literal(self, literal):
-        if self.type is None:
-            self.type = self.TEXT
-
-        self.literal += literal
+    def _render_default(self, p, g, context, cache):
+        ph_text = self.ph_text
+        ph_text[p] = ''
+        observed = self.template.has_interpolations()
 
-    def __repr__(self):
-        if self.type == self.PLACEHOLDER:
-            v = 'number={}'.format(self.number)
-        else:
-            v = 'content={!r}'.format(self.literal)
-
-        return "<SnippetPart type={} loc={} {}>".format(
-            self.type, (self.start, self.end), v)
-
-
-class Snippet(Base):
-    def __init__(self, trigger, description, options, body):
-        self.trigger = trigger
-        self.description = description
-        self.options = options
-        self.body = body
-        self.body_parts = []
-        self.ph_list = []
-        self.placeholders = {}
+        line = column = 0
 
-        self.current_jump = None
-        self.current_g = None
-        self.current_context = None
+        texts = []
+        for d in self._default(p):
+            loc = self._location(d)
+            loc[0] = line
+            loc[1] = column
 
-        self.hi_groups = []
+            if observed and d.type != d.TEXT:
+                # The interpolations see the text rendered so far.
+                ph_text[p] = ''.join(texts)
 
-    def is_inline(self):
-        return 'b' not in self.options
+            text = self._render_part(
+                d, g, context, self.placeholders, is_nested=True,
+                cache=cache)
+            line, column = _advance(text, line, column)
 
-    def is_block(self):
-        return not self.options or 'b' in self.options
+            loc[2] = line
+            loc[3] = column
 
-    def clone(self):
-        """Clone the snippet object.
-        """
-        return self.__class__(self.trigger, self.description, self.options,
-                              self.body)
+            texts.append(text)
+        ph_text[p] = ''.join(texts)
+        cache[p.number] = ph_text[p]
 
     def _render_placeholders(self, g, context):
         cache = {}
+        ph_text = self.ph_text
 
         for p in self.placeholders.values():
             text = cache.get(p.number)
             if text is not None:
-                p.ph_text = text
+                ph_text[p] = text
                 continue
 
-            p.ph_text = ''
+            self._render_default(p, g, context, cache)
 
-            line = column = 0
+    def _render_text(self, g, context):
+        """Renders the body, the generic version of the compiled template
+        render function.
+        """
+        prefix = context.get('_prefix', '')
 
-            for d in p.default:
-                d.start.line = line
-                d.start.column = column
+        context['_line'] = 0
+        context['_column'] = 0
 
-                tmp = text = d.render(g, context, is_nested=True,
-                                      ph=self.placeholders, cache=cache)
+        self._render_placeholders(g, context)
 
-                while True:
-                    i = tmp.find('\n')
-                    if i < 0:
-                        column += len(tmp)
-                        break
+        context['_line'] = 0
+        context['_column'] = len(prefix)
 
-                    line += 1
-                    column = 0
-                    tmp = tmp[i+1:]
+        texts = [prefix]
+        for part in self.template.parts:
+            if part.type is None:
+                continue
 
-                d.end.line = line
-                d.end.column = column
+            texts.append(
+                self._render_part(part, g, context, self.placeholders))
 
-                p.ph_text += text
-            cache[p.number] = p.ph_text
+        return ''.join(texts)
 
-    def render(self, g, context):
-        self.current_g = g
-        self.current_context = context
+    def _text(self, g, context):
+        self.lazy = False
+        text = self.template.compiled().render(self, g, context)
+        self.values = self._values()
+        return text
 
-        text = context.get('_prefix', '')
+    def _values(self):
+        return {n: self.ph_text.get(p, '')
+                for n, p in self.placeholders.items()}
 
-        if self.body and not self.body_parts:
-            try:
-                self.body_parts, _ = parse_snippet_body(
-                    self.body, self.placeholders)
-            except BaseParseError:
-                raise InvalidTabstop(self.fname, self.line)
-            self.ph_list = sorted(self.placeholders.values(),
-                                  key=lambda x: x.number)
+    def _placeholder_text(self, part, context):
+        """Renders a placeholder of the body, the locations aside.
+        """
+        if part.number == VISUAL_NUM:
+            visual = context.get('visual', '').strip()
+            if visual:
+                return part._try_apply_transformation(visual)
+
+        p = self.placeholders.get(part.number)
+        if p is None:
+            v = self.ph_text.get(part, '')
+        else:
+            v = self.ph_text.get(p, '')
+        return part._try_apply_transformation(v)
 
-        context['_line'] = 0
-        context['_column'] = 0
+    def _update(self, g, context):
+        """Renders the body again, only the units depending on the changed
+        placeholders are rendered, the others are kept from the last render.
+        """
+        texts = self.texts
+        if texts is None:
+            return self._text(g, context)
+
+        self.lazy = False
+        compiled = self.template.compiled()
+        compiled.render_placeholders(self, g, context)
+
+        values = self._values()
+        old = self.values
+        changed = [n for n in set(values).union(old)
+                   if values.get(n) != old.get(n)]
+
+        # The units which may read anything, the snip attributes assigned by
+        # the others for instance, are always rendered again.
+        dependents = compiled.dependents
+        dirty = set(dependents.get(None, ()))
+        for n in changed:
+            dirty.update(dependents.get(n, ()))
+
+        placeholders = self.placeholders
+        locations = self.locations
+
+        self.texts = None
+        prefix = texts[0] = context.get('_prefix', '')
+        line = 0
+        column = len(prefix)
+        for i, unit in enumerate(compiled.units):
+            if unit.kind == _SnippetPart.TEXT:
+                if unit.lines:
+                    line += unit.lines
+                    column = unit.column
+                else:
+                    column += unit.column
+                continue
 
-        self._render_placeholders(g, context)
+            part = unit.part
+            start_line = line
+            start_column = column
+            if unit.kind == _SnippetPart.PLACEHOLDER:
+                if i in dirty:
+                    texts[i + 1] = self._placeholder_text(part, context)
+
+                # The locations of the nested placeholders are relative to
+                # the placeholder until adjusted.
+                if unit.nested and part not in self.defaults and \
+                        placeholders.get(part.number) is part and not (
+                            part.number == VISUAL_NUM and
+                            context.get('visual', '').strip()):
+                    self._adjust_location(part, start_line, start_column)
+            elif i in dirty:
+                texts[i + 1] = self.template.interpolation(part).gen_text(
+                    g, context, values)
+
+            line, column = _advance(texts[i + 1], line, column)
+            if unit.registered:
+                locations[part] = [start_line, start_column, line, column]
+
+        context['_line'] = line
+        context['_column'] = column
+        self.texts = texts
+        self.values = values
+        return ''.join(texts)
+
+    def _is_plain(self):
+        """Whether every placeholder has a literal text, its default or the
+        edited text, and is never nested.
+
+        Placeholders are only edited and removed, a session stays plain once
+        it is.
+        """
+        if not self.plain and self.texts is not None:
+            compiled = self.template.compiled()
+            self.plain = all(
+                n in compiled.plain or
+                (p in self.defaults and n not in compiled.nested)
+                for n, p in self.placeholders.items())
+        return self.plain
+
+    def _update_plain(self, p, context):
+        """Renders the body again after an edit of the placeholder `p` of a
+        plain session.
+
+        Only the units depending on `p` are rendered and only the lines they
+        span are indented again. The locations are computed when used.
+        """
+        text = ''.join(d.literal for d in self._default(p))
+        self.ph_text[p] = text
+        self.locations = {}
+        self.lazy = True
+
+        # The units which may read anything are always rendered again.
+        dependents = self.template.compiled().dependents
+        dirty = set(dependents.get(None, ()))
+
+        values = self.values
+        if values.get(p.number) != text:
+            values = self.values = dict(values)
+            values[p.number] = text
+            dirty.update(dependents.get(p.number, ()))
+
+        if dirty:
+            self._render_units(sorted(dirty), values, context)
+        return self._result(context)
+
+    def _render_units(self, dirty, values, context):
+        """Renders the units `dirty` again, in order, and the lines they
+        span.
+        """
+        units = self.template.compiled().units
+        texts = self.texts
+        first = last = None
+        for i in dirty:
+            unit = units[i]
+            if unit.kind == _SnippetPart.PLACEHOLDER:
+                text = self._placeholder_text(unit.part, context)
+            else:
+                text = self.template.interpolation(unit.part).gen_text(
+                    self.g, context, values)
 
-        context['_line'] = 0
-        context['_column'] = len(text)
+            if text != texts[i + 1]:
+                texts[i + 1] = text
+                if first is None:
+                    first = i
+                last = i
 
-        for part in self.body_parts:
-            if part.type is None:
-                continue
+        if first is None:
+            return
 
-            text += part.render(g, context, self.placeholders)
+        # The lines before the first changed unit and after the last one are
+        # the same.
+        head = ''.join(texts[:first + 1]).count('\n')
+        tail = ''.join(texts[last + 2:]).count('\n')
+        lines = ''.join(texts).split('\n')
 
-        line_map = collections.defaultdict(list)
+        indented = []
+        offsets = []
+        for line in lines[head:len(lines) - tail]:
+            line, offset = tab_indent(context, line, is_block=self.is_block)
+            indented.append(line)
+            offsets.append(offset)
 
-        for p in self.placeholders.values():
-            start_line = p.start.line
-            end_line = p.end.line
+        end = len(self.lines) - tail
+        self.indented[head:end] = indented
+        self.offsets[head:end] = offsets
+        self.lines = lines
 
-            if start_line == end_line:
-                line_map[start_line].append(p)
-            else:
-                line_map[start_line].append(p)
-                line_map[end_line].append(p)
+        context['_line'] = len(lines) - 1
+        context['_column'] = len(lines[-1])
 
-        lines = 0
-        end_pos = 0
+    def _result(self, context):
+        indented = self.indented
+        return '\n'.join(indented) + context.get('_suffix', ''), \
+            len(indented[-1])
 
-        res = ''
-        while True:
-            i = text.find('\n')
+    def render(self, g, context):
+        self.g = g
+        self.context = context
 
-            if i < 0:
-                line = text
-            else:
-                line = text[:i]
+        return self._indent(self._text(g, context), context)
+
+    def _render_key(self, context):
+        """Gets the key of the cached render of the expansion, None when it
+        can't be cached.
+        """
+        if self.current_jump is not None or not self.template.is_static():
+            return None
+
+        if not self.is_block():
+            # Not indented, the prefix is only prepended.
+            return self.template, False
+        if context.get('_prefix'):
+            # The prefix is part of the indented first line.
+            return None
+        return (self.template, True, context.get('indent'),
+                context.get('tabstop'), bool(context.get('expandtab')))
+
+    def expand(self, g, context):
+        """Renders the body for a new expansion, static templates are only
+        rendered once for the same indentation.
+        """
+        key = self._render_key(context)
+        if key is None:
+            return self.render(g, context)
+
+        state = _rendered.lookup(key)
+        if state is None:
+            base = dict(context, _prefix='', _suffix='')
+            text, end_pos = self.render(g, base)
+            state = (text, end_pos, dict(self.ph_text),
+                     {p: tuple(loc) for p, loc in self.locations.items()},
+                     tuple(self.texts), self.values, tuple(self.lines),
+                     tuple(self.indented), tuple(self.offsets),
+                     self.current_jump, base['_line'], base['_column'])
+            _rendered.put(key, state)
+
+        (text, end_pos, ph_text, locations, texts, self.values, lines,
+         indented, offsets, self.current_jump, line, column) = state
+
+        self.g = g
+        self.context = context
+        self.ph_text = dict(ph_text)
+        self.texts = list(texts)
+        self.lines = list(lines)
+        self.indented = list(indented)
+        self.offsets = list(offsets)
+        self.lazy = False
+
+        prefix = self.texts[0] = context.get('_prefix', '')
+        if prefix:
+            # Not indented, the prefix is only prepended.
+            self.lines[0] = prefix + self.lines[0]
+            self.indented[0] = prefix + self.indented[0]
+        shift = len(prefix)
+        self.locations = {}
+        for part, loc in locations.items():
+            loc = self.locations[part] = list(loc)
+            if loc[0] == 0:
+                loc[1] += shift
+            if loc[2] == 0:
+                loc[3] += shift
+
+        if line == 0:
+            column += shift
+            end_pos += shift
+        context['_line'] = line
+        context['_column'] = column
+
+        return prefix + text + context.get('_suffix', ''), end_pos
+
+    def _indent(self, text, context):
+        line_map = collections.defaultdict(list)
+
+        for p in self.placeholders.values():
+            loc = self._location(p)
+            start_line = loc[0]
+            end_line = loc[2]
 
-            indented, offset = tab_indent(
-                context, line, is_block=self.is_block)
+            if start_line == end_line:
+                line_map[start_line].append(loc)
+            else:
+                line_map[start_line].append(loc)
+                line_map[end_line].append(loc)
 
-            for p in line_map.get(lines, []):
-                if p.start.line == lines:
-                    p.start.column += offset
+        # Only the indents of the current lines are kept.
+        known = dict(zip(self.lines, zip(self.indented, self.offsets)))
+        self.lines = text.split('\n')
+        res = self.indented = []
+        offsets = self.offsets = []
 
-                if p.end.line == lines:
-                    p.end.column += offset
+        for lines, line in enumerate(self.lines):
+            indented = known.get(line)
+            if indented is None:
+                indented = tab_indent(context, line, is_block=self.is_block)
+            indented, offset = indented
 
-            if i < 0:
-                res += indented
-                end_pos = len(indented)
-                break
+            for loc in line_map.get(lines, ()):
+                if loc[0] == lines:
+                    loc[1] += offset
 
-            res += indented + '\n'
-            text = text[i+1:]
-            lines += 1
+                if loc[2] == lines:
+                    loc[3] += offset
 
-        res += context.get('_suffix', '')
+            res.append(indented)
+            offsets.append(offset)
 
         if self.current_jump is None:
             if self.ph_list and self.ph_list[0].number != 0:
@@ -489,7 +928,7 @@ class Snippet(Base):
                 pos = 1
             self.current_jump = self._find_jump_position(pos)
 
-        return res, end_pos
+        return self._result(context)
 
     def rerender(self, content):
         d = _SnippetPart()
@@ -509,13 +948,17 @@ class Snippet(Base):
                     if e.number in numbers:
                         self.ph_list[i] = None
 
-            p.default = [d]
-            p.editted = True
+            self.defaults[p] = [d]
+            self.editted.add(p)
+
+            # The removed placeholders change the texts of their numbers.
+            if not numbers and self._is_plain():
+                return self._update_plain(p, self.context)
 
-        return self.render(self.current_g, self.current_context)
+        return self._indent(self._update(self.g, self.context), self.context)
 
     def _remove_ph(self, p, numbers):
-        for s in p.default:
+        for s in self._default(p):
             if s.type != _SnippetPart.PLACEHOLDER:
                 continue
 
@@ -526,9 +969,6 @@ class Snippet(Base):
 
                 self._remove_ph(s, numbers)
 
-    def reset(self):
-        pass
-
     def _find_jump_position(self, start):
         total = len(self.ph_list)
 
@@ -570,21 +1010,18 @@ class Snippet(Base):
 
             p = self.ph_list[self.current_jump]
 
-        # if p.end.line != p.start.line:
-        #     return
+        start_line, start_column, end_line, end_column = self._location(p)
 
-        column = p.start.column
-        length = p.end.column - p.start.column
-        if p.editted:
-            column += len(p.ph_text)
-            length = 0
+        column = start_column
+        if p in self.editted:
+            column += len(self.ph_text.get(p, ''))
 
         return {
-            "start_line": p.start.line,
-            "start_column": p.start.column,
+            "start_line": start_line,
+            "start_column": start_column,
             "edit_column": column,
-            "end_line": p.end.line,
-            "end_column": p.end.column,
+            "end_line": end_line,
+            "end_column": end_column,
         }
 
     def jump(self, direction):
@@ -604,26 +1041,173 @@ class Snippet(Base):
 
         return self.jump_position()
 
+
+class Snippet(Base):
+    __slots__ = ('trigger', 'description', 'options', 'body', 'template',
+                 'session', 'hi_groups')
+
+    def __init__(self, trigger, description, options, body):
+        Base.__init__(self)
+        self.trigger = trigger
+        self.description = description
+        self.options = options
+        self.body = body
+        # Precompiled template, else the body is compiled when rendered.
+        self.template = None
+        # The state of the expansion, created when rendered.
+        self.session = None
+
+        self.hi_groups = _EMPTY
+
+    def is_inline(self):
+        return 'b' not in self.options
+
+    def is_block(self):
+        return not self.options or 'b' in self.options
+
+    def clone(self):
+        """Clone the snippet object.
+        """
+        s = self.__class__(self.trigger, self.description, self.options,
+                           self.body)
+        s.fname = self.fname
+        s.line = self.line
+        s.template = self.template
+        return s
+
+    def compile(self):
+        """Gets the compiled template of the snippet, shared with the other
+        snippets of the same body.
+        """
+        origin = None
+        if self.line >= 0:
+            # The body starts on the line after the snippet statement.
+            origin = self.fname, self.line + 1
+        try:
+            return compile_template(self.body, self.template, origin)
+        except BaseParseError:
+            raise InvalidTabstop(self.fname, self.line)
+
+    def render(self, g, context):
+        if self.session is None:
+            self.session = Session(self.compile(), self.is_block)
+        return self.session.expand(g, context)
+
+    def rerender(self, content):
+        return self.session.rerender(content)
+
+    def reset(self):
+        self.session = None
+
+    def jump_position(self):
+        if self.session is None:
+            return
+        return self.session.jump_position()
+
+    def jump(self, direction):
+        if self.session is None:
+            return -1, -1, -1
+        return self.session.jump(direction)
+
     def gen_hi_groups(self):
-        return [hi.keyword(self.line, self.column, 7)] + self.hi_groups
+        return [hi.keyword(self.line, self.column, 7)] + list(self.hi_groups)
 
     def __repr__(self):
         return "<Snippet trigger={}>".format(self.trigger)
 
 
+class LazySnippet(Snippet):
+    """Snippet whose body is loaded on first use.
+
+    `loader` is called without arguments and returns the body.
+    """
+
+    __slots__ = ('_body', 'loader', 'priority')
+
+    def __init__(self, trigger, description, options, loader):
+        Snippet.__init__(self, trigger, description, options, None)
+        self.loader = loader
+        self.priority = 0
+
+    @property
+    def body(self):
+        if self._body is None:
+            # Shared with the identical bodies of the other snippets.
+            self._body = sys.intern(self.loader())
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+
+    def clone(self):
+        s = Snippet(self.trigger, self.description, self.options, self.body)
+        s.fname = self.fname
+        s.line = self.line
+        s.template = self.template
+        return s
+
+
 class Global(Base):
+    __slots__ = ('tp', 'body', 'hi_groups')
+
     def __init__(self, tp, body):
+        Base.__init__(self)
         self.tp = tp
         self.body = body
-        self.hi_groups = []
+        self.hi_groups = _EMPTY
 
     def gen_hi_groups(self):
-        return [hi.keyword(self.line, self.column, 6)] + self.hi_groups
+        return [hi.keyword(self.line, self.column, 6)] + list(self.hi_groups)
+
+
+class LazyGlobal(Global):
+    """Global whose body is loaded on first use.
+    """
+
+    __slots__ = ('_body', 'loader')
+
+    def __init__(self, tp, loader):
+        Global.__init__(self, tp, None)
+        self.loader = loader
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = self.loader()
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
 
 
 class Interpolation(Base):
+    __slots__ = ('value', 'code', 'reads')
+
     def __init__(self, value):
+        Base.__init__(self)
         self.value = value
+        # The code object of a python interpolation and what it reads,
+        # compiled on first use.
+        self.code = None
+        self.reads = None
+
+    def compile(self, codes):
+        """Gets the code object of a python interpolation.
+
+        The code is compiled once, with the line numbers of the snippets file.
+        """
+        if self.code is None:
+            line = self.line
+            if line >= 0:
+                # The lines of the `!p` prefix.
+                line += self.value.count('\n', 0,
+                                         len(self.value) - len(codes))
+            self.code = compile('\n' * max(line, 0) + codes, self.fname,
+                                'exec')
+            self.reads = read_names(codes)
+        return self.code
 
     def gen_text(self, g, context, phs):
         content = self.value
@@ -645,17 +1229,54 @@ class Interpolation(Base):
             }
             snip.c = ''
 
-        snip._local['t'] = phs
+        code = self.compile(codes)
+        local = snip._local
+
+        # The result is reused while the tabstops, the snip attributes and
+        # the names read by the last run are the same, the names and the
+        # attributes it assigned are assigned again.
+        memo = snip._memo
+        if self not in memo:
+            memo[self] = None if self.reads is None or \
+                is_impure(code, g) else ()
+        last = memo[self]
+        if last and unchanged(last.texts, phs) and \
+                snip.unchanged(last.attrs) and \
+                same_names(last.names, local, g):
+            for name, value in last.stores.items():
+                if value is _MISSING:
+                    local.pop(name, None)
+                else:
+                    local[name] = value
+            for name, value in last.writes.items():
+                setattr(snip, name, value)
+            snip.rv = last.rv
+            snip.c = codes
+            return last.rv
+
+        names = None
+        if last is not None:
+            memo[self] = ()
+            names = lookup_names(self.reads.names, local, g)
+
+        t = local['t'] = Tabstops(phs)
         snip.reset_indent()
         snip.rv = ''
 
         try:
             g['snip'] = snip
-            exec(codes, g, snip._local)
+            snip.track()
+            exec(code, g, local)
         finally:
+            attrs, writes = snip.untrack()
             g.pop('snip')
             snip.c = codes
 
+        if names is not None:
+            stores = lookup_names(self.reads.stores, local, {})
+            if stores is not None:
+                memo[self] = Memo(t.inputs(), attrs, names, stores, writes,
+                                  snip.rv)
         return snip.rv
 
     def render_vim(self, codes):
@@ -687,12 +1308,19 @@ class InvalidTabstop(ParseError):
         ParseError.__init__(self, file, line, "invalid tabstop")
 
 
+# The characters the snippet body scanner stops at, everything else is
+# sliced as literal runs.
+_BODY_SPECIAL = re.compile(r'[\\$`]')
+_PLACEHOLDER_SPECIAL = re.compile(r'[\\$`}]')
+_INTERPOLATION_SPECIAL = re.compile(r'[\\`]')
+_TRANSFORMATION_SPECIAL = re.compile(r'[\\/}]')
+_NUMBER = re.compile(r'[0-9]*')
+_TABSTOP_START = string.digits + '{'
+
+
 def _parse_number(data, i):
-    n = ''
-    while i < len(data) and data[i] in string.digits:
-        n += data[i]
-        i += 1
-    return n, i
+    m = _NUMBER.match(data, i)
+    return m.group(), m.end()
 
 
 def _match_conditional_replacement(text, i, groups):
@@ -784,28 +1412,57 @@ def _escape(c):
     return escape_chars.get(c, c)
 
 
+def _end_part(part, chunks, parts):
+    if chunks:
+        part.append_literal(''.join(chunks))
+    parts.append(part)
+
+
 def parse_snippet_body(body, phs=None, start=0, in_placeholder=False, nest=0):
     if phs is None:
         phs = {}
 
+    if in_placeholder:
+        search = _PLACEHOLDER_SPECIAL.search
+    else:
+        search = _BODY_SPECIAL.search
+
     i = start
+    size = len(body)
 
     parts = []
 
     current = _SnippetPart()
-    while i < len(body):
+    # The literal of the current part.
+    chunks = []
+    while i < size:
+        m = search(body, i)
+        if m is None:
+            chunks.append(body[i:])
+            i = size
+            break
+
+        j = m.start()
+        if j > i:
+            chunks.append(body[i:j])
+        i = j
         c = body[i]
 
         # Escape.
         if c == '\\':
-            current.append_literal(_escape(body[i+1]))
+            chunks.append(_escape(body[i+1]))
             i += 2
             continue
 
         # Placeholder.
-        if c == '$' and body[i+1] in string.digits+'{':
+        if c == '$':
+            if body[i+1] not in _TABSTOP_START:
+                chunks.append(c)
+                i += 1
+                continue
+
             current.end_offset = i
-            parts.append(current)
+            _end_part(current, chunks, parts)
 
             p, j = _parse_tabstop(body, phs, i + 1, i, nest)
 
@@ -816,54 +1473,66 @@ def parse_snippet_body(body, phs=None, start=0, in_placeholder=False, nest=0):
 
             parts.append(p)
             current = _SnippetPart(start_offset=j)
+            chunks = []
             i = j
             continue
 
         # Interpolation.
         if c == '`':
+            j = _find_interpolation_end(body, i + 1)
             current.end_offset = i
-            parts.append(current)
-            current = _SnippetPart(
-                _SnippetPart.INTERPOLATION, start_offset=i)
+            _end_part(current, chunks, parts)
 
-            j = i + 1
+            if j < 0:
+                current = _SnippetPart(start_offset=i)
+                chunks = [c]
+                i += 1
+                continue
 
-            matched = False
+            interp = _SnippetPart(_SnippetPart.INTERPOLATION, start_offset=i)
+            interp.literal = _unescape_interpolation(body, i + 1, j)
+            i = interp.end_offset = j + 1
+            parts.append(interp)
+            current = _SnippetPart(start_offset=i)
+            chunks = []
+            continue
 
-            while j < len(body):
-                d = body[j]
-                if d == '\\' and len(body) > j + 1:
-                    current.append_literal(_escape(body[j+1]))
-                    j += 2
-                    continue
+        # The end of the placeholder.
+        current.end_offset = i
+        _end_part(current, chunks, parts)
+        return parts, i + 1
 
-                if d == '`':
-                    matched = True
-                    i = current.end_offset = j + 1
-                    parts.append(current)
-                    current = _SnippetPart(start_offset=j+1)
-                    break
+    current.end_offset = i
+    _end_part(current, chunks, parts)
+    return parts, i
 
-                current.append_literal(d)
-                j += 1
 
-            if not matched:
-                current = _SnippetPart(start_offset=i)
-                current.append_literal(c)
-                i += 1
-            continue
+def _find_interpolation_end(body, i):
+    """Finds the backtick closing the interpolation starting at `i`.
 
-        if c == '}' and in_placeholder:
-            current.end_offset = i
-            parts.append(current)
-            return parts, i + 1
+    :returns: The offset of the backtick or -1.
+    """
+    size = len(body)
+    while True:
+        m = _INTERPOLATION_SPECIAL.search(body, i)
+        if m is None:
+            return -1
+        i = m.start()
+        if body[i] == '`':
+            return i
+        i += 2 if size > i + 1 else 1
 
-        current.append_literal(c)
-        i += 1
 
-    current.end_offset = i
-    parts.append(current)
-    return parts, i
+def _unescape_interpolation(body, i, end):
+    chunks = []
+    while True:
+        j = body.find('\\', i, end)
+        if j < 0:
+            chunks.append(body[i:end])
+            return ''.join(chunks)
+        chunks.append(body[i:j])
+        chunks.append(_escape(body[j+1]))
+        i = j + 2
 
 
 # $12
@@ -888,7 +1557,7 @@ def _parse_tabstop(data, phs, i, start, nest):
 
     i += 1
 
-    if data[i:].startswith('VISUAL'):
+    if data.startswith('VISUAL', i):
         n = VISUAL_NUM
         j = i + 6  # i + len('VISUAL')
     else:
@@ -920,16 +1589,27 @@ def _parse_tabstop(data, phs, i, start, nest):
 
 
 def _parse_transformation(data, i):
-    parts = ['', '', '']
+    parts = [[], [], []]
     current = 0
 
-    while len(data) > i:
+    while True:
+        m = _TRANSFORMATION_SPECIAL.search(data, i)
+        if m is None:
+            if len(data) > i:
+                parts[current].append(data[i:])
+            break
+
+        j = m.start()
+        if j > i:
+            parts[current].append(data[i:j])
+        i = j
         c = data[i]
+
         if c == '\\':
             n = data[i+1]
             if n == 'n':
                 n = '\n'
-            parts[current] += c + n
+            parts[current].append(c + n)
             i += 2
             continue
 
@@ -942,10 +1622,10 @@ def _parse_transformation(data, i):
             i += 1
             continue
 
-        if current == 2 and c == '}':
-            return _Transformation(*parts), i+1
+        if current == 2:
+            return _Transformation(*[''.join(p) for p in parts]), i+1
 
-        parts[current] += c
+        parts[current].append(c)
         i += 1
 
     raise BaseParseError
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import pickle
+import struct
+import tempfile
+import collections
+
+from .ast import Snippet, Global, Comment, LazySnippet, LazyGlobal, \
+    BaseParseError, Template
+from .finder import find_files, list_filetypes
+from .pool import parse_files
+
+# Layout of a bundle:
+#
+#   header   magic, version, offset of the string table and of the index
+#   entries  the pickled statements, snippets with their parsed bodies
+#   strings  the pickled string table, triggers, descriptions and options
+#   index    the pickled index, the entry records of every source file and
+#            the source files of every filetype in load order
+MAGIC = b'SNIPC\0\0\0'
+VERSION = 4
+
+_HEADER = struct.Struct('<8sIQQ')
+
+# Record kinds.
+_SNIPPET = 0
+_GLOBAL = 1
+_STATEMENT = 2
+
+
+class InvalidBundle(Exception):
+    pass
+
+
+def compile_bundle(dirs, output, workers=None):
+    """Compiles the snippet files of the directories into one bundle.
+
+    :dirs: The snippets directories.
+    :output: The bundle path.
+    :workers: The number of parser processes.
+    :returns: The number of compiled snippets.
+    """
+    filetypes = collections.OrderedDict()
+    paths = collections.OrderedDict()
+    for ft in list_filetypes(dirs):
+        files = filetypes[ft] = []
+        for d in dirs:
+            files.extend(find_files(ft, d))
+        paths.update((f, None) for f in files)
+
+    paths = list(paths)
+    parsed = parse_files(paths, workers=workers, parallel=True)
+
+    directory = os.path.dirname(os.path.abspath(output))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as w:
+            writer = _Writer(w)
+            count = writer.write(filetypes, paths, parsed)
+        os.replace(tmp, output)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+    return count
+
+
+def _compile_snippet(s):
+    try:
+        s.template = Template(s.body)
+    except BaseParseError:
+        # Reported as InvalidTabstop when expanded.
+        pass
+
+
+class _Writer(object):
+    def __init__(self, w):
+        self.w = w
+        self.strings = []
+        self._ids = {}
+
+    def _string(self, s):
+        i = self._ids.get(s)
+        if i is None:
+            i = self._ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def _entry(self, obj):
+        offset = self.w.tell()
+        self.w.write(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+        return offset, self.w.tell() - offset
+
+    def write(self, filetypes, paths, parsed):
+        w = self.w
+        w.write(b'\0' * _HEADER.size)
+
+        count = 0
+        files = []
+        for path, stmts in zip(paths, parsed):
+            records = []
+            for s in stmts:
+                if isinstance(s, Comment):
+                    continue
+
+                if isinstance(s, Snippet):
+                    _compile_snippet(s)
+                    records.append((_SNIPPET, self._string(s.trigger),
+                                    self._string(s.description),
+                                    self._string(s.options)) +
+                                   self._entry(s))
+                    count += 1
+                elif isinstance(s, Global):
+                    records.append((_GLOBAL, self._string(s.tp)) +
+                                   self._entry(s))
+                else:
+                    records.append((_STATEMENT,) + self._entry(s))
+            files.append((path, records))
+
+        ids = dict((p, i) for i, p in enumerate(paths))
+        index = {
+            'files': files,
+            'filetypes': dict((ft, [ids[f] for f in fs])
+                              for ft, fs in filetypes.items()),
+        }
+
+        strings = w.tell()
+        w.write(pickle.dumps(self.strings, pickle.HIGHEST_PROTOCOL))
+        index_offset = w.tell()
+        w.write(pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+
+        w.seek(0)
+        w.write(_HEADER.pack(MAGIC, VERSION, strings, index_offset))
+        return count
+
+
+class _Entry(object):
+    """Decodes an entry of the bundle on demand.
+    """
+
+    def __init__(self, mm, offset, length):
+        self.mm = mm
+        self.offset = offset
+        self.length = length
+
+    def decode(self):
+        return pickle.loads(self.mm[self.offset:self.offset+self.length])
+
+    def __call__(self):
+        return self.decode().body
+
+
+class BundleSnippet(LazySnippet):
+    """Snippet of a bundle, the body is decoded when the snippet is used.
+    """
+
+    def clone(self):
+        # Every decoding creates a new snippet with its parsed body, so
+        # expanding never parses the body.
+        return self.loader.decode()
+
+
+class Bundle(object):
+    """Memory-mapped snippets bundle.
+
+    Only the string table and the index are decoded when the bundle is
+    opened, the statements are decoded when a filetype is loaded and the
+    snippet bodies when they are expanded.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+        with open(self.path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self.sig = st.st_mtime_ns, st.st_size
+            if st.st_size < _HEADER.size:
+                raise InvalidBundle("{}: invalid bundle".format(path))
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, strings, index = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise InvalidBundle("{}: invalid bundle".format(path))
+
+        self._strings = pickle.loads(self._mm[strings:index])
+        self._index = pickle.loads(self._mm[index:])
+
+    def close(self):
+        self._mm.close()
+
+    def filetypes(self):
+        return sorted(self._index['filetypes'])
+
+    def file_keys(self, ft):
+        """Gets the keys of the source files of a filetype, in load order.
+        """
+        return ['{}:{}'.format(self.path, i)
+                for i in self._index['filetypes'].get(ft, [])]
+
+    def statements(self, key):
+        """Gets the statements compiled from a source file.
+        """
+        i = int(key.rsplit(':', 1)[1])
+        path, records = self._index['files'][i]
+        strings = self._strings
+        mm = self._mm
+
+        stmts = []
+        for r in records:
+            kind = r[0]
+            if kind == _SNIPPET:
+                s = BundleSnippet(strings[r[1]], strings[r[2]],
+                                  strings[r[3]], _Entry(mm, r[4], r[5]))
+                s.fname = path
+            elif kind == _GLOBAL:
+                s = LazyGlobal(strings[r[1]], _Entry(mm, r[2], r[3]))
+                s.fname = path
+            else:
+                s = _Entry(mm, r[1], r[2]).decode()
+            stmts.append(s)
+        return stmts
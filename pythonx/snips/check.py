@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import os
+import collections
+
+from .ast import Snippet, Global, BaseParseError, parse_snippet_body
+from .finder import find_files, list_filetypes
+from .parser import parse
+from .pool import map_files
+
+# `line` is 1-based, or None for the errors of the whole file.
+Problem = collections.namedtuple('Problem', ('path', 'line', 'message'))
+
+
+def format_problem(p):
+    if p.line is None:
+        return "{}: {}".format(p.path, p.message)
+    return "{}:{}: {}".format(p.path, p.line, p.message)
+
+
+def find_snippet_files(paths):
+    """Finds the snippet files of directories, recursively.
+
+    The directories given and the ones with `.snippets` files are searched
+    like snippets directories, with the rules of the editor, so the files of
+    the `<ft>` sub directories are found whatever their names.
+
+    Files are returned as is, so that a pre-commit hook can pass the changed
+    files.
+    """
+    files = collections.OrderedDict()
+    for path in paths:
+        if not os.path.isdir(path):
+            files[path] = None
+            continue
+
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            if root != path and \
+                    not any(name.endswith('.snippets') for name in names):
+                continue
+            for ft in list_filetypes([root]):
+                if ft.startswith('.'):
+                    continue
+                files.update((f, None) for f in sorted(find_files(ft, root)))
+    return list(files)
+
+
+def check_file(path):
+    """Checks a snippet file, the statements and the snippet bodies.
+
+    :returns: All the problems found, sorted by line.
+    """
+    try:
+        with open(path) as r:
+            data = r.read()
+    except (OSError, ValueError) as e:
+        return [Problem(path, None, str(e))]
+
+    errors = []
+    stmts = parse(data, filename=path, errors=errors)
+    problems = [Problem(path, e.line + 1, e.msg) for e in errors]
+
+    for s in stmts:
+        if isinstance(s, Snippet):
+            problems.extend(_check_snippet(path, s))
+        elif isinstance(s, Global) and s.tp == '!p':
+            problems.extend(_check_python(path, s.line + 1, s.body))
+
+    problems.sort(key=lambda p: p.line or 0)
+    return problems
+
+
+def _check_snippet(path, s):
+    try:
+        parts, _ = parse_snippet_body(s.body)
+    except (BaseParseError, IndexError):
+        return [Problem(path, s.line + 1, "invalid tabstop")]
+
+    problems = []
+    for part in _iter_interpolations(parts):
+        code = part.literal
+        if not code.startswith('!p'):
+            continue
+
+        # The code is run from its first non blank character.
+        code = code[2:]
+        stripped = code.lstrip()
+        skipped = code[:len(code) - len(stripped)].count('\n')
+
+        # 0-based line of the code, the body starts after the header.
+        line = s.line + 1 + s.body.count('\n', 0, part.start_offset) + skipped
+        problems.extend(_check_python(path, line, stripped))
+    return problems
+
+
+def _iter_interpolations(parts):
+    for part in parts:
+        if part.type == part.INTERPOLATION:
+            yield part
+        elif part.type == part.PLACEHOLDER:
+            for p in _iter_interpolations(part.default):
+                yield p
+
+
+def _check_python(path, line, code):
+    """Compiles python code starting at the 0-based `line`.
+    """
+    try:
+        compile(code, path, 'exec')
+    except (SyntaxError, ValueError) as e:
+        lineno = getattr(e, 'lineno', None) or 1
+        msg = getattr(e, 'msg', None) or str(e)
+        return [Problem(path, line + lineno, "invalid python: " + msg)]
+    return []
+
+
+def check(paths, workers=None):
+    """Checks the snippet files of `paths` in parallel.
+
+    :paths: Snippets directories or files.
+    :workers: The number of checker processes.
+    :returns: The problems of all the files, in order.
+    """
+    files = find_snippet_files(paths)
+    problems = []
+    for found in map_files(check_file, files, workers=workers,
+                           parallel=True):
+        problems.extend(found)
+    return problems
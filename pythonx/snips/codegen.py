@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""Generates the python render function of a template.
+
+The generated function does what `Session._render_text` does for any body,
+specialized for one body: the literal texts and their line and column moves
+are computed when generating, the part types are only checked once and the
+locations are only recorded for the placeholders.  Anything depending on the
+state of the expansion (edited placeholders, nested references, interpolations)
+calls back into the session.
+
+The body is rendered as a list of units, the merged literal texts, the
+placeholders and the interpolations, together with the tabstops every unit
+depends on, so that a rerender only recomputes the units of the edited
+tabstops.
+"""
+
+import collections
+
+from .ast import VISUAL_NUM, _SnippetPart, _advance
+from .interpolation import PURE_BUILTINS, read_names
+
+# A part of the body as rendered, `deps` are the tabstop numbers the text
+# depends on, None for all of them, `lines` and `column` the moves of the
+# literal texts. `registered` placeholders have a location, `nested` ones
+# placeholders in their default.
+Unit = collections.namedtuple(
+    'Unit', ('kind', 'part', 'literal', 'deps', 'lines', 'column',
+             'registered', 'nested'))
+
+# The units and the generated functions of a template, `dependents` maps the
+# tabstop numbers to the indexes of the units depending on them, None to the
+# ones depending on every tabstop. `index` maps the registered placeholders
+# of the body to the indexes of their units, `nested` holds the numbers of
+# the placeholders in the defaults and `plain` the numbers of the
+# placeholders with a literal default which are never nested.
+Compiled = collections.namedtuple(
+    'Compiled', ('units', 'dependents', 'render', 'render_placeholders',
+                 'index', 'nested', 'plain'))
+
+# Unit kinds, the types of their parts.
+TEXT = _SnippetPart.TEXT
+PLACEHOLDER = _SnippetPart.PLACEHOLDER
+INTERPOLATION = _SnippetPart.INTERPOLATION
+
+
+def _moves(text):
+    """Gets the number of lines and the column after `text`, the column is
+    relative when there is no new line.
+    """
+    i = text.rfind('\n')
+    if i < 0:
+        return 0, len(text)
+    return text.count('\n'), len(text) - i - 1
+
+
+class _Writer(object):
+    def __init__(self):
+        self.lines = []
+        self.names = {}
+        self.namespace = {
+            'VISUAL_NUM': VISUAL_NUM,
+            '_advance': _advance,
+        }
+
+    def name(self, obj):
+        """Gets the global name of an object used by the generated code.
+        """
+        key = id(obj)
+        name = self.names.get(key)
+        if name is None:
+            name = self.names[key] = '_p{}'.format(len(self.names))
+            self.namespace[name] = obj
+        return name
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def source(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def interpolation_deps(code):
+    """Gets the tabstop numbers read by an interpolation.
+
+    :returns: The numbers of the `t[n]` items, None when the interpolation may
+        read anything else: `t` used any other way, the names assigned by the
+        other interpolations, the globals, vim or the shell.
+    """
+    if not code.startswith('!p'):
+        return None
+
+    reads = read_names(code[2:].lstrip())
+    if reads is None or reads.whole or reads.snip or reads.stores or \
+            not reads.names <= PURE_BUILTINS:
+        # Assigned names are read by the interpolations after this one.
+        return None
+    return tuple(sorted(reads.items))
+
+
+def build_units(template):
+    """Splits the body of a template into units.
+    """
+    units = []
+    pending = []
+
+    def flush():
+        if pending:
+            literal = ''.join(pending)
+            lines, column = _moves(literal)
+            units.append(Unit(TEXT, None, literal, (), lines, column,
+                              False, False))
+            del pending[:]
+
+    for part in template.parts:
+        if part.type is None:
+            continue
+
+        if part.type == part.TEXT:
+            pending.append(part.literal)
+            continue
+
+        flush()
+        if part.type == part.PLACEHOLDER:
+            registered = template.placeholders.get(part.number) is part
+            nested = any(d.type == d.PLACEHOLDER for d in part.default)
+            units.append(Unit(PLACEHOLDER, part, '', (part.number,), 0, 0,
+                              registered, nested))
+        elif part.type == part.INTERPOLATION:
+            units.append(Unit(INTERPOLATION, part, part.literal,
+                              interpolation_deps(part.literal), 0, 0,
+                              False, False))
+    flush()
+    return units
+
+
+def build_dependents(units):
+    """Maps the tabstop numbers to the indexes of their dependent units.
+    """
+    dependents = collections.defaultdict(list)
+    for i, unit in enumerate(units):
+        if unit.deps is None:
+            dependents[None].append(i)
+            continue
+        for n in unit.deps:
+            dependents[n].append(i)
+    return dict(dependents)
+
+
+def nested_numbers(template):
+    """Gets the numbers of the placeholders in the placeholder defaults.
+    """
+    numbers = set()
+    parts = [d for p in template.parts if p.type == p.PLACEHOLDER
+             for d in p.default]
+    while parts:
+        part = parts.pop()
+        if part.type == part.PLACEHOLDER:
+            numbers.add(part.number)
+            parts.extend(part.default)
+    return frozenset(numbers)
+
+
+def _is_static(part):
+    return part.type is None or part.type == part.TEXT
+
+
+def _gen_default(w, indent, template, p):
+    """Renders the default value of the placeholder `p`, from its parts.
+    """
+    name = w.name(p)
+    observed = template.has_interpolations()
+
+    if all(_is_static(d) for d in p.default):
+        # Nothing can see the text being built.
+        w.emit(indent, 'ph_text[{0}] = cache[{1!r}] = {2!r}'.format(
+            name, p.number, ''.join(d.literal for d in p.default)))
+        return
+
+    w.emit(indent, 'ph_text[{}] = ""'.format(name))
+    w.emit(indent, 'texts = []')
+    # The position is known until the first dynamic part.
+    line = column = 0
+    for d in p.default:
+        if _is_static(d):
+            if not d.literal:
+                continue
+            w.emit(indent, 'texts.append({!r})'.format(d.literal))
+
+            lines, col = _moves(d.literal)
+            if line is None:
+                if lines:
+                    w.emit(indent, 'line += {}'.format(lines))
+                    w.emit(indent, 'column = {}'.format(col))
+                else:
+                    w.emit(indent, 'column += {}'.format(col))
+            elif lines:
+                line += lines
+                column = col
+            else:
+                column += col
+            continue
+
+        if line is not None:
+            w.emit(indent, 'line = {}'.format(line))
+            w.emit(indent, 'column = {}'.format(column))
+            line = column = None
+
+        if observed:
+            # The interpolations see the text rendered so far.
+            w.emit(indent, 'ph_text[{}] = "".join(texts)'.format(name))
+        w.emit(indent, 'start_line = line')
+        w.emit(indent, 'start_column = column')
+        w.emit(indent,
+               'text = S._render_part({}, g, context, placeholders, True, '
+               'cache)'.format(w.name(d)))
+        w.emit(indent, 'line, column = _advance(text, line, column)')
+        if d.type == d.PLACEHOLDER:
+            w.emit(indent,
+                   'locations[{}] = [start_line, start_column, line, '
+                   'column]'.format(w.name(d)))
+        w.emit(indent, 'texts.append(text)')
+
+    w.emit(indent, 'ph_text[{0}] = cache[{1!r}] = "".join(texts)'.format(
+        name, p.number))
+
+
+def _gen_placeholders(w, template):
+    for p in template.placeholders.values():
+        name = w.name(p)
+        w.emit(1, 'if {!r} in placeholders:'.format(p.number))
+        w.emit(2, 't = cache.get({!r})'.format(p.number))
+        w.emit(2, 'if t is not None:')
+        w.emit(3, 'ph_text[{}] = t'.format(name))
+        w.emit(2, 'elif {} in defaults:'.format(name))
+        w.emit(3, 'S._render_default({}, g, context, cache)'.format(name))
+        w.emit(2, 'else:')
+        _gen_default(w, 3, template, p)
+
+
+def _gen_text(w, unit):
+    w.emit(1, 'out.append({!r})'.format(unit.literal))
+    if unit.lines:
+        w.emit(1, 'line += {}'.format(unit.lines))
+        w.emit(1, 'column = {}'.format(unit.column))
+    else:
+        w.emit(1, 'column += {}'.format(unit.column))
+
+
+def _gen_placeholder(w, unit):
+    part = unit.part
+    name = w.name(part)
+    registered = unit.registered
+
+    w.emit(1, 'start_line = line')
+    w.emit(1, 'start_column = column')
+
+    indent = 1
+    if part.number == VISUAL_NUM:
+        w.emit(1, 'v = context.get("visual", "").strip()')
+        w.emit(1, 'if not v:')
+        indent = 2
+
+    w.emit(indent, 'p = placeholders.get({!r})'.format(part.number))
+    w.emit(indent, 'if p is None:')
+    w.emit(indent + 1, 'v = ph_text.get({}, "")'.format(name))
+    w.emit(indent, 'else:')
+    w.emit(indent + 1, 'v = ph_text.get(p, "")')
+    if registered:
+        # Only non-ref placeholder should adjust location.
+        w.emit(indent + 1, 'if p is {}:'.format(name))
+        w.emit(indent + 2,
+               'S._adjust_location(p, start_line, start_column)')
+
+    if part.transformation is not None:
+        w.emit(1, 'v = {}._try_apply_transformation(v)'.format(name))
+    w.emit(1, 'out.append(v)')
+    w.emit(1, 'line, column = _advance(v, line, column)')
+    if registered:
+        w.emit(1, 'locations[{}] = [start_line, start_column, line, '
+               'column]'.format(name))
+
+
+def _gen_units(w, template, units):
+    for unit in units:
+        if unit.kind == TEXT:
+            _gen_text(w, unit)
+        elif unit.kind == PLACEHOLDER:
+            _gen_placeholder(w, unit)
+        else:
+            w.emit(1, 'v = {}.gen_text(g, context, '
+                   '{{p.number: ph_text.get(p, "") '
+                   'for p in placeholders.values()}})'.format(
+                       w.name(template.interpolation(unit.part))))
+            w.emit(1, 'out.append(v)')
+            w.emit(1, 'line, column = _advance(v, line, column)')
+
+
+def generate(template, units=None):
+    """Generates the source of the render functions of a template.
+
+    `render_placeholders` renders the placeholders, `render` the whole body
+    into `S.texts`, one text per unit after the prefix.
+
+    :returns: The source and the globals of the functions.
+    """
+    if units is None:
+        units = build_units(template)
+
+    w = _Writer()
+    w.emit(0, 'def render_placeholders(S, g, context):')
+    w.emit(1, 'ph_text = S.ph_text')
+    w.emit(1, 'placeholders = S.placeholders')
+    w.emit(1, 'locations = S.locations')
+    w.emit(1, 'defaults = S.defaults')
+    w.emit(1, 'cache = {}')
+    _gen_placeholders(w, template)
+
+    w.emit(0, '')
+    w.emit(0, '')
+    w.emit(0, 'def render(S, g, context):')
+    w.emit(1, 'render_placeholders(S, g, context)')
+    w.emit(1, 'ph_text = S.ph_text')
+    w.emit(1, 'placeholders = S.placeholders')
+    w.emit(1, 'locations = S.locations')
+    w.emit(1, 'prefix = context.get("_prefix", "")')
+    w.emit(1, 'out = [prefix]')
+    w.emit(1, 'line = 0')
+    w.emit(1, 'column = len(prefix)')
+
+    _gen_units(w, template, units)
+
+    w.emit(1, 'context["_line"] = line')
+    w.emit(1, 'context["_column"] = column')
+    w.emit(1, 'S.texts = out')
+    w.emit(1, 'return "".join(out)')
+    return w.source(), w.namespace
+
+
+def compile_template_code(template):
+    """Compiles the render functions of a template.
+
+    The functions take the session, the snippets globals and the expansion
+    context, `render` returns the rendered text, before indenting.
+    """
+    units = build_units(template)
+    source, namespace = generate(template, units)
+    exec(compile(source, '<template>', 'exec'), namespace)
+
+    index = {unit.part: i for i, unit in enumerate(units)
+             if unit.registered}
+    nested = nested_numbers(template)
+    plain = frozenset(n for n, p in template.placeholders.items()
+                      if n not in nested and
+                      all(_is_static(d) for d in p.default))
+    return Compiled(units, build_dependents(units), namespace['render'],
+                    namespace['render_placeholders'], index, nested, plain)
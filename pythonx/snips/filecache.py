@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+import hashlib
+import logging
+import tempfile
+
+from .parser import parse
+
+logger = logging.getLogger("completor")
+
+# Bump this whenever the parser output or the ast classes change, so that
+# entries written by an older snips are never loaded.
+FORMAT_VERSION = 4
+
+
+def default_cache_dir():
+    """Gets the default cache directory, `$XDG_CACHE_HOME/snips`.
+    """
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'snips')
+
+
+def signature(st):
+    """Gets the validation signature of a stat result.
+    """
+    return st.st_mtime_ns, st.st_size
+
+
+class FileCache(object):
+    """Persistent cache of the statements parsed from snippet files.
+
+    Every snippet file maps to one entry in the cache directory. An entry is
+    only used when the path, mtime, size and format version all match.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = default_cache_dir()
+        self.directory = directory
+
+    def _entry_path(self, path):
+        key = hashlib.sha1(path.encode('utf-8', 'surrogateescape'))
+        return os.path.join(self.directory, key.hexdigest() + '.pickle')
+
+    def load(self, path, sig):
+        """Loads the statements of `path` if the cached entry is valid.
+
+        :path: The absolute path of the snippet file.
+        :sig: The current signature of the file.
+        :returns: The statement list or None.
+        """
+        try:
+            with open(self._entry_path(path), 'rb') as r:
+                entry = pickle.load(r)
+        except Exception:
+            return
+
+        try:
+            version, entry_path, entry_sig, stmts = entry
+        except (TypeError, ValueError):
+            return
+
+        if version != FORMAT_VERSION or entry_path != path or \
+                tuple(entry_sig) != tuple(sig):
+            return
+
+        return stmts
+
+    def store(self, path, sig, stmts):
+        """Stores the statements parsed from `path`.
+        """
+        entry = (FORMAT_VERSION, path, sig, stmts)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as w:
+                    pickle.dump(entry, w, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, self._entry_path(path))
+            except Exception:
+                os.unlink(tmp)
+                raise
+        except Exception as e:
+            # The cache is only an optimization, never fail the load.
+            logger.warning("failed to store snippets cache of %s: %s",
+                           path, e)
+
+    def clear(self):
+        """Removes all entries of the cache.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                os.unlink(os.path.join(self.directory, name))
+
+
+def parse_file(path, file_cache=None):
+    """Parses a snippet file, using the persistent cache when possible.
+
+    :path: The snippet file path.
+    :file_cache: A FileCache object or None to always parse.
+    :returns: The statement list.
+    """
+    path = os.path.abspath(path)
+
+    sig = None
+    if file_cache is not None:
+        sig = signature(os.stat(path))
+        stmts = file_cache.load(path, sig)
+        if stmts is not None:
+            return stmts
+
+    with open(path) as r:
+        data = r.read()
+    stmts = parse(data, filename=path)
+
+    if file_cache is not None:
+        file_cache.store(path, sig, stmts)
+
+    return stmts
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+
+
+def find_files(ft, d):
+    """Finds the snippet files of a filetype in a directory, in load order.
+
+    These are `<ft>.snippets`, `<ft>_*.snippets` and the files of the
+    `<ft>` sub directory.
+    """
+    files = glob.glob(os.path.join(d, '{}.snippets'.format(ft)))
+    files.extend(glob.glob(os.path.join(d, '{}_*.snippets'.format(ft))))
+    files.extend(glob.glob(os.path.join(d, ft, '*')))
+    return [os.path.abspath(f) for f in files if os.path.isfile(f)]
+
+
+def list_filetypes(dirs):
+    """Lists the filetypes having snippet files in the directories.
+    """
+    fts = set([])
+    for d in dirs:
+        try:
+            names = os.listdir(d)
+        except OSError:
+            continue
+
+        for name in names:
+            if os.path.isdir(os.path.join(d, name)):
+                fts.add(name)
+                continue
+
+            stem, ext = os.path.splitext(name)
+            if ext == '.snippets':
+                fts.add(stem.split('_', 1)[0])
+    return sorted(fts)
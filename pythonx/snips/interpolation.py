@@ -1,6 +1,22 @@
 # -*- coding: utf-8 -*-
 
 import os
+import ast
+import types
+import collections
+import collections.abc
+
+# The names of the modules and of the snip attributes an interpolation can't
+# be memoized with, their results can change without any tabstop change.
+IMPURE_NAMES = frozenset([
+    'vim', 'os', 'posixpath', 'ntpath', 'sys', 'time', 'datetime', 'random',
+    'uuid', 'subprocess', 'opt',
+])
+
+# Snip attributes reset before every interpolation.
+_VOLATILE = frozenset(['rv', 'relative_indent'])
+
+_MISSING = object()
 
 
 def tab_indent(context, line, is_block=None):
@@ -29,8 +45,409 @@ def tab_indent(context, line, is_block=None):
     return indent * c + line[tabs:], indent - tabs
 
 
+# What a python interpolation reads and writes: `items` the numbers of the
+# `t[n]` items, `whole` whether `t` is used any other way, `names` the names
+# read before being assigned, `stores` the names assigned and `snip` whether
+# the snip attributes which can change during the expansion are used.
+Reads = collections.namedtuple(
+    'Reads', ('items', 'whole', 'names', 'stores', 'snip'))
+
+# The builtins with results depending only on their arguments.
+PURE_BUILTINS = frozenset([
+    'abs', 'all', 'any', 'bool', 'chr', 'dict', 'divmod', 'enumerate',
+    'filter', 'float', 'format', 'frozenset', 'hex', 'int', 'isinstance',
+    'len', 'list', 'map', 'max', 'min', 'oct', 'ord', 'range', 'repr',
+    'reversed', 'round', 'set', 'sorted', 'str', 'sum', 'tuple', 'zip',
+])
+
+# The snip attributes staying the same during the expansion, the result
+# is reset before every interpolation.
+_SNIP_LOADS = frozenset([
+    'rv', 'fn', 'ft', 'basename', 'indent', 'mkline', 'shift', 'unshift',
+    'reset_indent',
+])
+_SNIP_STORES = frozenset(['rv'])
+
+
+class _Dynamic(Exception):
+    pass
+
+
+def _is_name(node, name):
+    return isinstance(node, ast.Name) and node.id == name
+
+
+def _item(node):
+    """Gets the number of a `t[n]` subscript, None for any other one.
+    """
+    index = node.slice
+    if hasattr(ast, 'Index') and isinstance(index, ast.Index):
+        index = index.value
+    try:
+        n = ast.literal_eval(index)
+    except ValueError:
+        return None
+    return n if isinstance(n, int) else None
+
+
+class _ReadsVisitor(ast.NodeVisitor):
+    """Collects the reads of the interpolation code, in execution order.
+    """
+
+    def __init__(self):
+        self.items = set()
+        self.whole = False
+        self.names = set()
+        self.stores = set()
+        self.snip = False
+        # The names surely assigned at this point.
+        self.assigned = set()
+        # The depth of the nested scopes, their names aren't stored.
+        self.scopes = 0
+
+    def dynamic(self, node):
+        raise _Dynamic()
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = dynamic
+    visit_Import = visit_ImportFrom = visit_Global = visit_Nonlocal = dynamic
+    visit_Yield = visit_YieldFrom = visit_Await = dynamic
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            if node.id == 't':
+                self.whole = True
+            elif node.id == 'snip':
+                self.snip = True
+            elif node.id not in self.assigned:
+                self.names.add(node.id)
+            return
+
+        if node.id in ('t', 'snip'):
+            self.whole = self.snip = True
+        self.assigned.add(node.id)
+        if not self.scopes:
+            self.stores.add(node.id)
+
+    def visit_Subscript(self, node):
+        if _is_name(node.value, 't') and isinstance(node.ctx, ast.Load):
+            n = _item(node)
+            if n is not None:
+                self.items.add(n)
+                return
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        if _is_name(node.value, 'snip'):
+            if isinstance(node.ctx, ast.Load):
+                self.snip |= node.attr not in _SNIP_LOADS
+            else:
+                self.snip |= node.attr not in _SNIP_STORES
+            return
+        self.generic_visit(node)
+
+    def visit_Assign(self, node):
+        self.visit(node.value)
+        for target in node.targets:
+            self.visit(target)
+
+    def visit_AnnAssign(self, node):
+        if node.value is not None:
+            self.visit(node.value)
+        self.visit(node.target)
+
+    def visit_AugAssign(self, node):
+        self.visit(node.value)
+        target = node.target
+        if _is_name(target, 'snip'):
+            # snip += line
+            return
+        if isinstance(target, ast.Name):
+            self.visit(ast.Name(id=target.id, ctx=ast.Load()))
+        self.visit(target)
+
+    def branch(self, nodes):
+        """Visits nodes which may not run, their names may not be assigned.
+        """
+        assigned = set(self.assigned)
+        for node in nodes:
+            self.visit(node)
+        self.assigned = assigned
+
+    def visit_If(self, node):
+        self.visit(node.test)
+        self.branch(node.body)
+        self.branch(node.orelse)
+
+    def visit_IfExp(self, node):
+        self.visit(node.test)
+        self.branch([node.body])
+        self.branch([node.orelse])
+
+    def visit_NamedExpr(self, node):
+        self.visit(node.value)
+        self.visit(node.target)
+
+    def visit_While(self, node):
+        self.visit(node.test)
+        self.branch(node.body)
+        self.branch(node.orelse)
+
+    def visit_For(self, node):
+        self.visit(node.iter)
+        self.branch([node.target] + node.body)
+        self.branch(node.orelse)
+
+    visit_AsyncFor = visit_For
+
+    def visit_Try(self, node):
+        self.branch(node.body)
+        for handler in node.handlers:
+            if handler.type is not None:
+                self.visit(handler.type)
+            if handler.name:
+                self.branch([ast.Name(id=handler.name, ctx=ast.Store())] +
+                            handler.body)
+            else:
+                self.branch(handler.body)
+        self.branch(node.orelse)
+        self.branch(node.finalbody)
+
+    visit_TryStar = visit_Try
+
+    def visit_BoolOp(self, node):
+        self.visit(node.values[0])
+        self.branch(node.values[1:])
+
+    def scope(self, names, nodes):
+        """Visits the nodes of a nested scope, where `names` are assigned.
+        """
+        self.scopes += 1
+        assigned = set(self.assigned)
+        self.assigned.update(names)
+        for node in nodes:
+            self.visit(node)
+        self.assigned = assigned
+        self.scopes -= 1
+
+    def _comprehension(self, node, *elts):
+        nodes = []
+        for g in node.generators:
+            nodes.append(g.iter)
+            nodes.append(g.target)
+            nodes.extend(g.ifs)
+        self.scope((), nodes + list(elts))
+
+    def visit_ListComp(self, node):
+        self._comprehension(node, node.elt)
+
+    visit_SetComp = visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self._comprehension(node, node.key, node.value)
+
+    def visit_Lambda(self, node):
+        args = node.args
+        for default in args.defaults + args.kw_defaults:
+            if default is not None:
+                self.visit(default)
+        names = [a.arg for a in args.args + args.kwonlyargs +
+                 getattr(args, 'posonlyargs', [])]
+        names.extend(a.arg for a in (args.vararg, args.kwarg) if a)
+        self.scope(names, [node.body])
+
+
+def read_names(codes):
+    """Gets what the code of a python interpolation reads and writes.
+
+    :returns: The Reads, None when it can't be known, for code which doesn't
+        compile or defines functions, classes, or imports modules.
+    """
+    try:
+        tree = ast.parse(codes)
+    except (SyntaxError, ValueError):
+        return None
+
+    visitor = _ReadsVisitor()
+    try:
+        visitor.visit(tree)
+    except _Dynamic:
+        return None
+    return Reads(frozenset(visitor.items), visitor.whole,
+                 frozenset(visitor.names), frozenset(visitor.stores),
+                 visitor.snip)
+
+
+def _impure_module(name):
+    return bool(name) and name.partition('.')[0] in IMPURE_NAMES
+
+
+def _impure_callable(value):
+    """Whether a callable without code, a builtin, a method of a builtin
+    object or a class, comes from the impure modules or is bound to an
+    object with a state.
+    """
+    if _impure_module(getattr(value, '__module__', None)):
+        return True
+
+    owner = getattr(value, '__self__', None)
+    if owner is None or isinstance(owner, _VALUES):
+        return False
+    if isinstance(owner, types.ModuleType):
+        return _impure_module(owner.__name__)
+    return True
+
+
+def is_impure(code, namespace, seen=None):
+    """Whether a code object reads the impure names or the mutable objects of
+    `namespace`, or calls functions doing so.
+    """
+    if seen is None:
+        seen = set()
+    if code in seen:
+        return False
+    seen.add(code)
+
+    if any(name in IMPURE_NAMES for name in code.co_freevars):
+        return True
+
+    for name in code.co_names:
+        if name in IMPURE_NAMES:
+            return True
+
+        value = namespace.get(name, _MISSING)
+        if value is _MISSING or isinstance(value, _VALUES):
+            continue
+        if isinstance(value, types.ModuleType):
+            if _impure_module(value.__name__):
+                return True
+            continue
+        if not isinstance(value, _OBJECTS):
+            # A mutable object, like an iterator advanced by a helper.
+            return True
+
+        func = getattr(value, '__code__', None)
+        if not isinstance(func, types.CodeType):
+            if _impure_callable(value):
+                return True
+        elif isinstance(value, types.MethodType) and \
+                not isinstance(value.__self__, (_VALUES, type)):
+            return True
+        elif is_impure(func, getattr(value, '__globals__', {}), seen):
+            return True
+
+    return any(isinstance(c, types.CodeType) and is_impure(c, namespace, seen)
+               for c in code.co_consts)
+
+
+class Tabstops(collections.abc.MutableMapping):
+    """The `t` of a python interpolation, records the tabstop texts read.
+    """
+
+    __slots__ = ('texts', 'read', 'copied')
+
+    def __init__(self, texts):
+        self.texts = texts
+        # number -> text read, None when read as a whole.
+        self.read = {}
+        # The texts are shared until written.
+        self.copied = False
+
+    def _write(self):
+        if not self.copied:
+            self.texts = dict(self.texts)
+            self.copied = True
+        return self.texts
+
+    def __getitem__(self, key):
+        read = self.read
+        if read is not None and key not in read:
+            read[key] = self.texts.get(key)
+        return self.texts[key]
+
+    def __setitem__(self, key, value):
+        self._write()[key] = value
+
+    def __delitem__(self, key):
+        del self._write()[key]
+
+    def __iter__(self):
+        self.read = None
+        return iter(self.texts)
+
+    def __len__(self):
+        self.read = None
+        return len(self.texts)
+
+    def __repr__(self):
+        self.read = None
+        return repr(self.texts)
+
+    def inputs(self):
+        """Gets the texts the interpolation depends on, for `unchanged`.
+        """
+        if self.read is None:
+            return None, dict(self.texts)
+        return dict(self.read), None
+
+
+def unchanged(inputs, texts):
+    """Whether the tabstop texts read by an interpolation are the same.
+    """
+    read, whole = inputs
+    if read is None:
+        return whole == texts
+    return all(texts.get(n) == v for n, v in read.items())
+
+
+# The last run of a memoized interpolation: the tabstop texts, the snip
+# attributes and the names it read, the names and the snip attributes it
+# assigned and its result.
+Memo = collections.namedtuple(
+    'Memo', ('texts', 'attrs', 'names', 'stores', 'writes', 'rv'))
+
+# Values compared by equality, the others must be the same objects.
+_VALUES = (str, bytes, int, float, bool, type(None))
+_OBJECTS = (types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+            types.ModuleType, type)
+
+
+def lookup_names(names, local, g):
+    """Gets the values of the names read by an interpolation, from the
+    locals shared by the interpolations and from the globals.
+
+    :returns: name -> value, None when a value can be changed in place.
+    """
+    values = {}
+    for name in names:
+        value = local.get(name, _MISSING)
+        if value is _MISSING:
+            value = g.get(name, _MISSING)
+        if value is not _MISSING and not isinstance(value, _VALUES) and \
+                not isinstance(value, _OBJECTS):
+            return None
+        values[name] = value
+    return values
+
+
+def same_names(values, local, g):
+    """Whether the names read have the values of `lookup_names`.
+    """
+    for name, value in values.items():
+        current = local.get(name, _MISSING)
+        if current is _MISSING:
+            current = g.get(name, _MISSING)
+        if current is not value and (not isinstance(value, _VALUES) or
+                                     type(current) is not type(value) or
+                                     current != value):
+            return False
+    return True
+
+
 class SnippetUtil(object):
     def __init__(self, context):
+        # attribute -> value read and assigned by the interpolation being run
+        self._reads = None
+        self._writes = None
         self.rv = ''
         self.c = ''
         self.v = None
@@ -42,6 +459,51 @@ class SnippetUtil(object):
 
         self._orig_indent = self.indent
         self._context = context
+        # interpolation -> the inputs and the result of its last run, None
+        # when it can't be memoized.
+        self._memo = {}
+
+    def __getattribute__(self, name):
+        if name[0] == '_' or name in _VOLATILE:
+            return object.__getattribute__(self, name)
+
+        reads = object.__getattribute__(self, '_reads')
+        try:
+            value = object.__getattribute__(self, name)
+        except AttributeError:
+            if reads is not None:
+                reads.setdefault(name, _MISSING)
+            raise
+        if reads is not None and name not in reads and not callable(value):
+            reads[name] = value
+        return value
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name[0] != '_' and name not in _VOLATILE:
+            writes = object.__getattribute__(self, '_writes')
+            if writes is not None:
+                writes[name] = value
+
+    def track(self):
+        """Records the attributes read and assigned, until `untrack` is
+        called.
+        """
+        self._reads = {}
+        self._writes = {}
+
+    def untrack(self):
+        """Gets the attributes read and assigned since `track`.
+        """
+        reads, writes = self._reads, self._writes
+        self._reads = self._writes = None
+        return reads, writes
+
+    def unchanged(self, reads):
+        """Whether the attributes read are the same.
+        """
+        return all(getattr(self, name, _MISSING) == value
+                   for name, value in reads.items())
 
     def mkline(self, line='', indent=None):
         if not line:
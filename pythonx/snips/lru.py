@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import collections
+
+
+class LRUCache(collections.OrderedDict):
+    """Dict evicting the least recently used entries over a budget.
+
+    Entries are only marked as used by `touch()` and `lookup()`, plain dict
+    access leaves the order untouched.
+    """
+
+    def __init__(self, max_entries=0, max_size=0, sizeof=None):
+        """
+        :max_entries: The maximum number of entries, 0 for no limit.
+        :max_size: The maximum total size of the values, 0 for no limit.
+        :sizeof: Gets the size of a value, required by `max_size`.
+        """
+        collections.OrderedDict.__init__(self)
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.sizeof = sizeof
+
+    def touch(self, key):
+        if key in self:
+            self.move_to_end(key)
+
+    def lookup(self, key, default=None):
+        """Gets a value and marks it as the most recently used.
+        """
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        self.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Adds a value and evicts the entries over the budget.
+        """
+        self[key] = value
+        self.move_to_end(key)
+        self.evict(protected=(key,))
+
+    def size(self):
+        if self.sizeof is None:
+            return 0
+        return sum(self.sizeof(v) for v in list(self.values()))
+
+    def _over_budget(self, size):
+        if self.max_entries and len(self) > self.max_entries:
+            return True
+        return bool(self.max_size) and size > self.max_size
+
+    def evict(self, protected=()):
+        """Evicts the least recently used entries until within the budget.
+
+        :protected: The keys never evicted.
+        :returns: The evicted keys.
+        """
+        size = self.size() if self.max_size else 0
+        if not self._over_budget(size):
+            return []
+
+        evicted = []
+        for key in list(self.keys()):
+            if not self._over_budget(size):
+                break
+
+            if key in protected:
+                continue
+
+            value = self.pop(key)
+            if self.max_size:
+                size -= self.sizeof(value)
+            evicted.append(key)
+
+        return evicted
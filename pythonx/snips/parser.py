@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import os
+import mmap
 import logging
 import string
+import functools
 from .ast import ParseError, Extends, Priority, Snippet, Global, \
-    PreExpand, PostJump, Comment, parse_snippet_body
+    PreExpand, PostJump, Comment, LazySnippet, LazyGlobal, \
+    parse_snippet_body
 from .highlight import hi
 
 logger = logging.getLogger('completor')
@@ -12,23 +16,21 @@ logger = logging.getLogger('completor')
 class Doc(object):
     def __init__(self, fname):
         self.parse_body = False
+        # Whether to generate the highlight groups of the statements, only
+        # used to display a snippets file.
+        self.highlight = False
         self.ignore_error = False
         self.fname = fname
         self.stmts = []
 
-    def parse_comment(self, lines, i):
-        line = lines[i]
-
+    def parse_comment(self, i, line):
         pos = _nonempty(line)
         c = Comment(line[pos+1:])
         c.line = i
         c.column = pos
         self.stmts.append(c)
 
-        return i + 1
-
-    def parse_priority(self, lines, i):
-        line = lines[i]
+    def parse_priority(self, i, line):
         parts = line.split()
 
         try:
@@ -39,17 +41,13 @@ class Doc(object):
         except Exception:
             raise ParseError(self.fname, i, line)
 
-        return i + 1
-
-    def parse_extends(self, lines, i):
-        line = lines[i]
+    def parse_extends(self, i, line):
         parts = line.split(maxsplit=1)
 
         if len(parts) != 2:
             raise ParseError(self.fname, i, "invalid extends")
 
         self.stmts.append(Extends([t.strip() for t in parts[1].split(',')]))
-        return i + 1
 
     @staticmethod
     def _parse_snippet_description(text, remain):
@@ -101,11 +99,16 @@ class Doc(object):
 
         return trigger, description, options
 
-    def parse_global(self, lines, i):
-        line = lines[i]
+    def parse_global(self, i, line, lines):
+        """Parses a global block.
+
+        :lines: Iterator of the following (number, line) pairs, consumed up
+            to the endglobal line.
+        """
         parts = line.split()
 
         g = Global("unknown", "")
+        g.fname = self.fname
         g.line = i
         g.column = _nonempty(line)
 
@@ -114,21 +117,25 @@ class Doc(object):
 
         items = []
 
-        for j, line in enumerate(lines[i+1:]):
+        for j, line in lines:
             if line.rstrip().startswith("endglobal"):
-                g.hi_groups.append(hi.keyword(j+i+1, _nonempty(line), 9))
+                if self.highlight:
+                    g.hi_groups = [hi.keyword(j, _nonempty(line), 9)]
 
                 g.body = "\n".join(items)
                 self.stmts.append(g)
-                return i + j + 2
+                return
 
             items.append(line)
 
         raise ParseError(self.fname, i, "no endglobal found")
 
-    def parse_snippet(self, lines, i):
-        line = lines[i]
+    def parse_snippet(self, i, line, lines):
+        """Parses a snippet block.
 
+        :lines: Iterator of the following (number, line) pairs, consumed up
+            to the endsnippet line.
+        """
         trigger, desc, opts = self._parse_snippet_start(i, line)
 
         s = Snippet(trigger, desc, opts, "")
@@ -136,41 +143,46 @@ class Doc(object):
         s.line = i
         s.column = _nonempty(line)
 
-        trigger_pos = line.find(trigger)
-        s.hi_groups.append(hi.trigger(i, trigger_pos, len(trigger)))
-
-        desc_pos = trigger_pos
-        if desc:
-            desc_pos = line.find(desc, trigger_pos + len(trigger))
-            s.hi_groups.append(hi.description(i, desc_pos, len(desc)))
-
-        if opts:
-            pos = line.find(opts, desc_pos + len(desc))
-            s.hi_groups.append(hi.option(i, pos, len(opts)))
+        if self.highlight:
+            self._highlight_snippet_start(s, i, line)
 
         items = []
 
-        for j, line in enumerate(lines[i+1:]):
+        for j, line in lines:
             if line.rstrip().startswith("endsnippet"):
-                s.hi_groups.append(hi.keyword(j+i+1, _nonempty(line), 10))
+                if self.highlight:
+                    s.hi_groups.append(hi.keyword(j, _nonempty(line), 10))
                 s.body = "\n".join(items)
 
-                if self.parse_body:
+                if self.highlight and self.parse_body:
                     _gen_snippets_highlight(s, i)
 
                 self.stmts.append(s)
-                return i + j + 2
+                return
 
             items.append(line)
 
         if not self.ignore_error:
             raise ParseError(self.fname, i, "no endsnippet found")
 
-        return len(lines)
+    @staticmethod
+    def _highlight_snippet_start(s, i, line):
+        trigger, desc, opts = s.trigger, s.description, s.options
+        s.hi_groups = []
+
+        trigger_pos = line.find(trigger)
+        s.hi_groups.append(hi.trigger(i, trigger_pos, len(trigger)))
+
+        desc_pos = trigger_pos
+        if desc:
+            desc_pos = line.find(desc, trigger_pos + len(trigger))
+            s.hi_groups.append(hi.description(i, desc_pos, len(desc)))
 
-    def parse_expand_action(self, lines, i, action):
-        line = lines[i]
+        if opts:
+            pos = line.find(opts, desc_pos + len(desc))
+            s.hi_groups.append(hi.option(i, pos, len(opts)))
 
+    def parse_expand_action(self, i, line, action):
         parts = line.split(maxsplit=1)
 
         if len(parts) != 2:
@@ -183,12 +195,12 @@ class Doc(object):
                              "invalid {} definition".format(action.name))
 
         self.stmts.append(action(content[1:-1]))
-        return i + 1
 
 
 def gen_highlight_groups(data):
     try:
-        stmts = parse(data, is_lines=True, parse_body=True, ignore_error=True)
+        stmts = parse(data, is_lines=True, parse_body=True, highlight=True,
+                      ignore_error=True)
     except ParseError:
         stmts = []
 
@@ -203,61 +215,270 @@ def gen_highlight_groups(data):
 
 
 def parse(data, filename="<unknown>", is_lines=False, parse_body=False,
-          ignore_error=False):
+          highlight=False, ignore_error=False, errors=None):
+    """Parses the statements of a snippet file.
+
+    :parse_body: Also generates the highlight groups of the snippet bodies.
+    :highlight: Generates the highlight groups of the statements, only
+        needed to display the file.
+    :errors: A list collecting the ParseErrors, the parsing then resumes
+        after the failing statement instead of raising.
+    """
     if is_lines:
         lines = data
     else:
         lines = data.splitlines()
 
-    i = 0
+    return list(_iter_stmts(lines, filename, parse_body, highlight,
+                            ignore_error, errors))
 
+
+def iter_parse(fileobj, filename=None, parse_body=False, highlight=False,
+               ignore_error=False, errors=None):
+    """Parses the statements of a snippet file as it is read.
+
+    The statements are yielded as soon as they are complete, so the memory
+    used does not depend on the size of the file.
+
+    :fileobj: A file object opened in text mode.
+    :filename: The file name of the errors, default to `fileobj.name`.
+    """
+    if filename is None:
+        filename = getattr(fileobj, 'name', '<unknown>')
+
+    return _iter_stmts(_iter_lines(fileobj), filename, parse_body, highlight,
+                       ignore_error, errors)
+
+
+def _iter_lines(fileobj):
+    for data in fileobj:
+        # Splits like str.splitlines() does on the whole content.
+        for line in data.splitlines():
+            yield line
+
+
+def _iter_stmts(lines, filename, parse_body, highlight, ignore_error,
+                errors=None):
     doc = Doc(filename)
     doc.parse_body = parse_body
+    doc.highlight = highlight
     doc.ignore_error = ignore_error
+    stmts = doc.stmts
 
-    while i < len(lines):
-        line = lines[i]
+    # The block parsers consume the body lines from the same iterator, so
+    # every line is visited once.
+    lines = enumerate(lines)
 
+    for i, line in lines:
         stripped = line.strip()
 
         if not stripped:
-            i += 1
             continue
 
-        if stripped[0] == '#':
-            i = doc.parse_comment(lines, i)
-            continue
+        try:
+            if stripped[0] == '#':
+                doc.parse_comment(i, line)
+            elif stripped.startswith('priority'):
+                doc.parse_priority(i, line)
+            elif stripped.startswith('global'):
+                doc.parse_global(i, line, lines)
+            elif stripped.startswith('snippet'):
+                doc.parse_snippet(i, line, lines)
+            elif stripped.startswith('extends'):
+                doc.parse_extends(i, line)
+            elif stripped.startswith(PreExpand.name):
+                doc.parse_expand_action(i, line, PreExpand)
+            elif stripped.startswith(PostJump.name):
+                doc.parse_expand_action(i, line, PostJump)
+            elif not ignore_error:
+                raise ParseError(filename, i, "unknown syntax")
+        except ParseError as e:
+            if errors is None:
+                raise
+            errors.append(e)
+            # Skips the body of a block with an invalid header.
+            for keyword in ('global', 'snippet'):
+                if stripped.startswith(keyword):
+                    _skip_block(lines, 'end' + keyword)
+
+        if stmts:
+            for s in stmts:
+                yield s
+            del stmts[:]
+
+
+def _skip_block(lines, keyword):
+    for _, line in lines:
+        if line.rstrip().startswith(keyword):
+            return
+
+
+def scan(filename):
+    """Scans the headers of a snippet file without parsing the bodies.
+
+    The file is memory-mapped and only the lines outside of the snippet and
+    global bodies are decoded. Snippets and globals are returned as lazy
+    statements recording the byte range of their bodies, which are read
+    from the file on first use.
+
+    :filename: The snippet file path.
+    :returns: The statement list.
+    """
+    with open(filename, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if not st.st_size:
+            return []
+
+        sig = st.st_mtime_ns, st.st_size
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-        if stripped.startswith('priority'):
-            i = doc.parse_priority(lines, i)
-            continue
+    try:
+        return _Scanner(filename, mm, sig).scan()
+    finally:
+        mm.close()
 
-        if stripped.startswith('global'):
-            i = doc.parse_global(lines, i)
-            continue
 
-        if stripped.startswith('snippet'):
-            i = doc.parse_snippet(lines, i)
-            continue
+class _Scanner(object):
+    def __init__(self, fname, mm, sig):
+        self.doc = Doc(fname)
+        self.fname = fname
+        self.mm = mm
+        self.sig = sig
+        self.globals = 0
+        # trigger -> number of the snippets scanned with it
+        self.triggers = {}
+
+    def _find_end(self, keyword, i, pos):
+        """Finds the line starting with `keyword` from the body at `pos`.
+
+        :returns: The end offset of the body, the number of the line
+            following the keyword line and its offset.
+        """
+        mm = self.mm
+        end = mm.find(b'\n' + keyword, pos - 1)
+        if end < 0:
+            raise ParseError(self.fname, i, "no {} found".format(
+                keyword.decode()))
+
+        if end < pos:
+            # Empty body.
+            end = pos
+            i += 2
+        else:
+            i += 3 + mm[pos:end].count(b'\n')
+
+        nxt = mm.find(b'\n', end + 1)
+        return end, i, len(mm) if nxt < 0 else nxt + 1
+
+    def scan(self):
+        mm = self.mm
+        size = len(mm)
+        doc = self.doc
+        stmts = doc.stmts
+        fname = self.fname
+
+        priority = 0
+        pos = i = 0
+
+        while pos < size:
+            end = mm.find(b'\n', pos)
+            if end < 0:
+                end = size
+            line = mm[pos:end].decode('utf-8')
+            start = end + 1
+            stripped = line.strip()
+
+            if not stripped or stripped[0] == '#':
+                pass
+            elif stripped.startswith('priority'):
+                doc.parse_priority(i, line)
+                priority = stmts[-1].priority
+            elif stripped.startswith('global'):
+                parts = line.split()
+                tp = parts[1] if len(parts) == 2 else 'unknown'
+                body_end, j, pos = self._find_end(b'endglobal', i, start)
+                g = LazyGlobal(tp, functools.partial(
+                    _load_global_body, fname, start, body_end, self.sig,
+                    self.globals))
+                g.fname = fname
+                g.line = i
+                g.column = _nonempty(line)
+                stmts.append(g)
+                self.globals += 1
+                i = j
+                continue
+            elif stripped.startswith('snippet'):
+                trigger, desc, opts = doc._parse_snippet_start(i, line)
+                body_end, j, pos = self._find_end(b'endsnippet', i, start)
+                nth = self.triggers.get(trigger, 0)
+                self.triggers[trigger] = nth + 1
+                s = LazySnippet(trigger, desc, opts, functools.partial(
+                    _load_snippet_body, fname, start, body_end, self.sig,
+                    trigger, i, nth))
+                s.fname = fname
+                s.line = i
+                s.column = _nonempty(line)
+                s.priority = priority
+                stmts.append(s)
+                i = j
+                continue
+            elif stripped.startswith('extends'):
+                doc.parse_extends(i, line)
+            elif stripped.startswith(PreExpand.name):
+                doc.parse_expand_action(i, line, PreExpand)
+            elif stripped.startswith(PostJump.name):
+                doc.parse_expand_action(i, line, PostJump)
+            else:
+                raise ParseError(fname, i, "unknown syntax")
 
-        if stripped.startswith('extends'):
-            i = doc.parse_extends(lines, i)
-            continue
+            pos = start
+            i += 1
 
-        if stripped.startswith(PreExpand.name):
-            i = doc.parse_expand_action(lines, i, PreExpand)
-            continue
+        return stmts
 
-        if stripped.startswith(PostJump.name):
-            i = doc.parse_expand_action(lines, i, PostJump)
-            continue
 
-        if not ignore_error:
-            raise ParseError(filename, i, "unknown syntax")
+def _read_range(fname, start, end, sig):
+    with open(fname, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if (st.st_mtime_ns, st.st_size) != sig:
+            return
+        f.seek(start)
+        data = f.read(end - start)
+    return '\n'.join(data.decode('utf-8').splitlines())
 
-        i += 1
 
-    return doc.stmts
+def _reparse(fname):
+    with open(fname) as r:
+        return parse(r.read(), filename=fname)
+
+
+def _load_snippet_body(fname, start, end, sig, trigger, line, nth):
+    body = _read_range(fname, start, end, sig)
+    if body is not None:
+        return body
+
+    # The file changed since it was scanned. Several snippets may share the
+    # trigger, take the one at the same line, else the nth one with it.
+    stmts = [s for s in _reparse(fname)
+             if isinstance(s, Snippet) and s.trigger == trigger]
+    for s in stmts:
+        if s.line == line:
+            return s.body
+    if nth < len(stmts):
+        return stmts[nth].body
+    return ''
+
+
+def _load_global_body(fname, start, end, sig, index):
+    body = _read_range(fname, start, end, sig)
+    if body is not None:
+        return body
+
+    # The file changed since it was scanned.
+    stmts = [s for s in _reparse(fname) if isinstance(s, Global)]
+    if index < len(stmts):
+        return stmts[index].body
+    return ''
 
 
 def _nonempty(text):
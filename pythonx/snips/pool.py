@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .filecache import parse_file
+
+logger = logging.getLogger("completor")
+
+# Below these sizes starting the worker processes costs more than parsing.
+MIN_FILES = 8
+MIN_BYTES = 512 * 1024
+
+
+def _total_size(paths):
+    size = 0
+    for p in paths:
+        try:
+            size += os.stat(p).st_size
+        except OSError:
+            pass
+    return size
+
+
+def _mp_context():
+    # Inside Vim `sys.executable` is the editor, so the worker processes
+    # can only be forked.
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return
+    return multiprocessing.get_context('fork')
+
+
+def should_parallelize(paths):
+    """Checks whether parsing `paths` is worth a process pool.
+    """
+    if len(paths) < MIN_FILES or (os.cpu_count() or 1) < 2:
+        return False
+    if _mp_context() is None:
+        return False
+    return _total_size(paths) >= MIN_BYTES
+
+
+def create_executor(workers=None):
+    """Creates a process pool executor of forked workers.
+    """
+    ctx = _mp_context()
+    try:
+        return ProcessPoolExecutor(workers, mp_context=ctx)
+    except TypeError:
+        # Python < 3.7, fork is the default on posix anyway.
+        return ProcessPoolExecutor(workers)
+
+
+def map_files(func, paths, workers=None, parallel=False, force=False):
+    """Calls `func(path)` for every path, in worker processes when asked to
+    and it pays.
+
+    The results are returned in the order of `paths`, whether they were
+    computed by the pool or serially. Forking a multithreaded editor from a
+    background thread isn't safe, so the pool is only used by the bulk loads
+    run from the main thread or a command line process.
+
+    :func: A module level function, so that it can be sent to the workers.
+    :paths: The file paths.
+    :workers: The number of worker processes, default to the cpu count.
+    :parallel: Uses the pool for large inputs.
+    :force: Uses the pool even for small inputs.
+    """
+    paths = list(paths)
+
+    if not paths:
+        return []
+
+    if not force and not (parallel and should_parallelize(paths)):
+        return [func(p) for p in paths]
+
+    if workers is None:
+        workers = min(len(paths), os.cpu_count() or 1)
+
+    chunksize = max(1, len(paths) // (workers * 4))
+    try:
+        with create_executor(workers) as executor:
+            return list(executor.map(func, paths, chunksize=chunksize))
+    except (OSError, RuntimeError) as e:
+        # E.g. the process limit is reached, fallback to the serial path.
+        logger.warning("parse pool failed, parsing serially: %s", e)
+        return [func(p) for p in paths]
+
+
+class _Parse(object):
+    def __init__(self, file_cache):
+        self.file_cache = file_cache
+
+    def __call__(self, path):
+        return parse_file(path, self.file_cache)
+
+
+def parse_files(paths, file_cache=None, workers=None, parallel=False,
+                force=False):
+    """Parses snippet files, fanning the work out to a process pool for the
+    bulk loads.
+
+    :returns: The statement lists, in the order of `paths`.
+    """
+    return map_files(_Parse(file_cache), paths, workers=workers,
+                     parallel=parallel, force=force)
@@ -1,23 +1,56 @@
 # -*- coding: utf-8 -*-
 
-import glob
 import os
+import sys
+import collections
 import logging
 import string
+import time
+import copy
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
 try:
     import builtins
 except ImportError:
     import future_builtins as builtins
 
-from .parser import parse
-from .ast import Extends, Priority, Global, Snippet
+from . import pool, watcher
+from .bundle import Bundle
+from .filecache import FileCache, signature
+from .finder import find_files, list_filetypes
+from .lru import LRUCache
+from .parser import scan
+from .ast import Extends, Priority, Global, Snippet, LazySnippet
 
 _ALL = 'all'
 
-# Global snips cache.
+# Directories modified in the last 2 seconds are always rescanned.
+_RACY_NS = 2 * 10**9
+
+# Namespaces of the evaluated `global !p` blocks, shared by every SnipInfo
+# evaluating the same blocks in the same order, the least recently used are
+# evicted.
+# chained digest of the global bodies -> namespace
+_global_namespaces = LRUCache(max_entries=256)
+
+# Compiled `global !p` bodies, the least recently used are evicted.
+# digest of a global body -> code object
+_global_codes = LRUCache(max_entries=256)
+
+# Global snips cache, the least recently used filetypes are evicted when
+# over the budget set by set_cache_limit().
 # ft -> SnipInfo
-cache = {}
+cache = LRUCache(sizeof=lambda snips: snips.footprint())
+
+# Project and buffer local snips, layered over the global cache.
+# overlay dirs -> ft -> SnipInfo
+overlays = LRUCache(max_entries=32)
+
+# directory -> (mtime of the directory, the project snippets directory in it
+# or None)
+_project_dirs = {}
 
 ident_chars = string.ascii_letters + string.digits
 
@@ -26,45 +59,423 @@ logger = logging.getLogger("completor")
 # Global state recorder.
 g = type('_g', (object,), {})
 g.current_snippet = None
+# The lines of the current expansion as last sent to vim.
+g.rendered_lines = []
 g.snippets_dirs = []
+g.file_cache = FileCache()
+g.watcher = None
+g.lazy_load = False
+g.bundle = None
+g.project_dir = '.snippets'
+
+# Serializes the background refreshes.
+_refresh_lock = threading.Lock()
+
+# Guards inserting, reordering and evicting the entries of the cache.
+_cache_lock = threading.Lock()
+
+# ft -> names of the filetypes searched for the snippets of ft, in order.
+_chains = {}
+
+# ft -> Future of the load in progress.
+_loading = {}
+_loading_lock = threading.Lock()
+_executor = None
 
 
 def set_snippets_dirs(dirs):
     """Sets the snippets directory.
+
+    The loaded filetypes are refreshed on their next use, only the files of
+    added directories are parsed and the files of removed ones dropped.
+    """
+    g.snippets_dirs = list(dirs)
+    _project_dirs.clear()
+
+    if g.watcher is not None:
+        g.watcher.set_dirs(g.snippets_dirs)
+        t = threading.Thread(target=_on_snippets_changed, args=(None,))
+        t.daemon = True
+        t.start()
+
+
+def set_cache_dir(directory):
+    """Sets the directory of the persistent parse cache.
+
+    :directory: The cache directory. An empty value disables the cache.
+    """
+    if directory:
+        g.file_cache = FileCache(directory)
+    else:
+        g.file_cache = None
+
+
+def set_bundle(path):
+    """Sets the precompiled snippets bundle.
+
+    The snippets of the bundle are loaded before the ones of the snippets
+    directories, which take precedence at equal priority.
+
+    :path: The bundle path, see `python -m snips compile`. An empty value
+        unsets the bundle.
     """
-    g.snippets_dirs = dirs
+    g.bundle = Bundle(path) if path else None
+
+
+def set_project_dir(name):
+    """Sets the name of the project snippets directory.
+
+    The directory is searched from the directory of the buffer upwards, its
+    snippets override the ones of the snippets directories. An empty name
+    disables project snippets.
+    """
+    g.project_dir = name
+    _project_dirs.clear()
+
+
+def set_cache_limit(max_filetypes=0, max_bytes=0):
+    """Sets the budget of the snips cache.
+
+    The least recently used filetypes are evicted when the cache holds more
+    than `max_filetypes` filetypes or more than about `max_bytes` bytes of
+    snippets. `all` and the filetypes in use are never evicted. 0 means no
+    limit.
+    """
+    cache.max_entries = int(max_filetypes)
+    cache.max_size = int(max_bytes)
+
+
+def stats():
+    """Reports the approximate footprint of the cached filetypes.
+
+    `shared_bytes` is the size of the strings shared with the snippets of the
+    filetype itself or of a filetype reported before, which deduplication
+    saves.
+
+    :returns: ft -> {'snippets': count, 'files': count, 'bytes': size,
+        'shared_bytes': size}
+    """
+    seen = set([])
+    return dict((ft, snips.stats(seen))
+                for ft, snips in list(cache.items()))
+
+
+def set_lazy_load(enabled):
+    """Sets whether to only scan the snippet headers when loading.
+
+    The bodies and globals are then read from the files when a snippet is
+    expanded, which reduces the load time and memory of large collections.
+    """
+    g.lazy_load = bool(enabled)
+
+
+def _parse_files(files, parallel=False):
+    if g.lazy_load:
+        return [scan(f) for f in files]
+    return pool.parse_files(files, g.file_cache, parallel=parallel)
+
+
+def start_watcher():
+    """Starts watching the snippets directories in a background thread.
+
+    Edited files are parsed by the watcher thread and the updated SnipInfo
+    objects are swapped into the cache, get() and expand() then no longer
+    check the loaded files for changes.
+    """
+    if g.watcher is not None:
+        return
+    w = watcher.create(_on_snippets_changed)
+    w.start(g.snippets_dirs)
+    g.watcher = w
+
+
+def stop_watcher():
+    """Stops watching the snippets directories.
+    """
+    w, g.watcher = g.watcher, None
+    if w is not None:
+        w.stop()
+
+
+def _on_snippets_changed(paths):
+    _project_dirs.clear()
+    with _refresh_lock:
+        dirs = g.snippets_dirs
+        for ft, snips in list(cache.items()):
+            if paths is not None and not any(snips.covers(p) for p in paths):
+                continue
+
+            # Refresh a copy so that the editor thread never sees a
+            # partially updated SnipInfo.
+            new = snips.copy()
+            if not new.refresh(dirs):
+                continue
+
+            with _cache_lock:
+                # The filetype may have been evicted meanwhile.
+                if cache.get(ft) is snips:
+                    cache[ft] = new
 
 
 def _try_init_snippets(ft):
+    """Loads the snippets of a filetype and of the filetypes it extends.
+
+    :returns: The SnipInfo layers to search, in lookup order.
+    """
     dirs = g.snippets_dirs
-    if not dirs:
+    if not dirs and g.bundle is None and not cache:
+        return []
+
+    chain = _chains.get(ft)
+    if chain is not None:
+        for t in chain:
+            _load(t, dirs)
+        # A refresh changing the extends invalidates the chains.
+        chain = _chains.get(ft)
+
+    if chain is None:
+        chain = _resolve_chain(ft, dirs, _load)
+
+    layers = []
+    for t in chain:
+        snips = cache.get(t)
+        if snips is not None:
+            with _cache_lock:
+                cache.touch(t)
+            layers.append(snips)
+
+    if cache.max_entries or cache.max_size:
+        with _cache_lock:
+            cache.evict(protected=set(chain))
+
+    return layers
+
+
+def _resolve_chain(ft, dirs, load):
+    """Resolves the filetypes searched for the snippets of `ft`.
+
+    The parts of a compound filetype like `javascript.jsx` come first, each
+    followed by the filetypes it extends, depth first, and `all` last. Each
+    filetype is only searched once, so cyclic extends are harmless.
+    """
+    chain = []
+    seen = set([])
+
+    def visit(t):
+        if not t or t in seen:
+            return
+        seen.add(t)
+        chain.append(t)
+        for e in load(t, dirs).extends:
+            visit(e)
+
+    for t in ft.split('.'):
+        visit(t)
+    visit(_ALL)
+
+    _chains[ft] = chain
+    return chain
+
+
+def _invalidate_chains():
+    _chains.clear()
+
+
+def prewarm(ft):
+    """Loads the snippets of `ft` and `all` in a background thread.
+
+    A later get() or expand() waits for the load in progress instead of
+    loading the filetype again.
+    """
+    global _executor
+
+    dirs = g.snippets_dirs
+    if not dirs and g.bundle is None:
         return
 
-    _try_init_all(dirs)
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1)
+
+    if ft not in _chains:
+        _executor.submit(_try_prewarm, ft, dirs)
+
+
+def preload_all():
+    """Loads the snippets of every filetype in the snippets directories.
+
+    The files of all the filetypes are parsed in one batch, by a process
+    pool for large collections.
+
+    :returns: The list of filetypes.
+    """
+    dirs = g.snippets_dirs
+    fts = list_filetypes(dirs)
+    if g.bundle is not None:
+        fts = sorted(set(fts).union(g.bundle.filetypes()))
+
+    infos = []
+    files = collections.OrderedDict()
+    for ft in fts:
+        if ft in cache:
+            continue
+        snips = SnipInfo()
+        snips.ft = ft
+        infos.append(snips)
+        for d in dirs:
+            files.update((f, None) for f in snips._find_files(d))
+
+    files = list(files)
+    parsed = dict(zip(files, _parse_files(files, parallel=True)))
+
+    for snips in infos:
+        snips.load(snips.ft, dirs, parsed)
+        with _cache_lock:
+            cache.setdefault(snips.ft, snips)
+
+    return fts
 
+
+def _try_prewarm(ft, dirs):
+    try:
+        _resolve_chain(ft, dirs, _ensure_loaded)
+    except Exception as e:
+        logger.exception(e)
+
+
+def _load(ft, dirs):
     snips = cache.get(ft)
     if snips is None:
+        return _ensure_loaded(ft, dirs)
+
+    if g.watcher is None:
+        snips.refresh(dirs)
+    return snips
+
+
+def _ensure_loaded(ft, dirs):
+    with _loading_lock:
+        snips = cache.get(ft)
+        if snips is not None:
+            return snips
+
+        future = _loading.get(ft)
+        if future is not None:
+            loading = False
+        else:
+            loading = True
+            future = _loading[ft] = Future()
+
+    if not loading:
+        return future.result()
+
+    try:
         snips = SnipInfo()
         snips.load(ft, dirs)
-        cache[ft] = snips
+        with _cache_lock:
+            cache[ft] = snips
+        future.set_result(snips)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _loading_lock:
+            _loading.pop(ft, None)
 
+    return snips
 
-def get(ft, token):
-    """Gets all snips contain the token.
-    """
-    _try_init_snippets(ft)
 
-    snips = cache.get(ft)
-    if snips is None:
+def _find_project_dir(path):
+    name = g.project_dir
+    if not name or not path:
+        return
+
+    d = os.path.dirname(os.path.abspath(path))
+    while True:
+        # Creating or removing the project directory changes the mtime of
+        # its parent, every directory walked is checked against its memo.
+        mtime = _mtime(d)
+        memo = _project_dirs.get(d)
+        if memo is not None and memo[0] == mtime:
+            found = memo[1]
+        else:
+            found = os.path.join(d, name)
+            if not os.path.isdir(found):
+                found = None
+            _project_dirs[d] = mtime, found
+        if found is not None:
+            return found
+
+        parent = os.path.dirname(d)
+        if parent == d:
+            return
+        d = parent
+
+
+def _overlay_dirs(path, local_dirs):
+    dirs = _str_list(local_dirs)
+    project = _find_project_dir(path)
+    if project is not None and project not in dirs:
+        dirs.append(project)
+    return dirs
+
+
+def _str_list(items):
+    if not items:
         return []
+    return [v.decode() if isinstance(v, bytes) else v for v in items]
+
 
+def _layers(ft, path=None, local_dirs=None):
+    """Gets the SnipInfo layers to search for a buffer.
+
+    The overlays of the buffer local directories and of the project come
+    first, followed by the layers of the global cache.
+    """
+    layers = _try_init_snippets(ft)
+
+    dirs = _overlay_dirs(path, local_dirs)
+    if not dirs:
+        return layers
+
+    key = tuple(dirs)
+    infos = overlays.lookup(key)
+    if infos is None:
+        infos = {}
+        overlays.put(key, infos)
+    chain = _chains.get(ft) or ft.split('.') + [_ALL]
+
+    local = []
+    for t in chain:
+        if not t:
+            continue
+        snips = infos.get(t)
+        if snips is None:
+            snips = infos[t] = SnipInfo(overlay=True)
+            snips.load(t, dirs)
+        else:
+            # Overlays are small and not watched, always check them.
+            snips.refresh(dirs)
+        if snips.snippets:
+            local.append(snips)
+    return local + layers
+
+
+def get(ft, token, path=None, local_dirs=None):
+    """Gets all snips contain the token.
+
+    :ft: The filetype.
+    :token: The text to match.
+    :path: The buffer path, to find the project snippets.
+    :local_dirs: The buffer local snippets directories.
+    """
+    seen = set([])
     ret = []
-    for k, (_, s) in snips.snippets.items():
-        if token in k:
-            ret.append(s)
-    for k, (_, s) in cache['all'].snippets.items():
-        if token in k:
-            ret.append(s)
+    for snips in _layers(ft, path, local_dirs):
+        for k, (_, s) in snips.snippets.items():
+            # Snippets of the earlier layers shadow the later ones.
+            if token in k and k not in seen:
+                seen.add(k)
+                ret.append(s)
     ret.sort(key=lambda x: x.trigger)
     return ret
 
@@ -133,7 +544,8 @@ def expand(context):
         return {}
 
     ftype = context['ftype']
-    _try_init_snippets(ftype)
+    layers = _layers(ftype, context.get('fpath'),
+                     context.get('snippets_dirs'))
 
     trigger = text.lstrip()
     column = context['column']
@@ -142,13 +554,10 @@ def expand(context):
     s = None
 
     try:
-        snips = cache.get(ftype)
-        if snips:
-            s = _get_snip(snips, trigger, ident_trigger, index, text, context)
-
-        if s is None:
-            snips = cache.get(_ALL, {})
+        for snips in layers:
             s = _get_snip(snips, trigger, ident_trigger, index, text, context)
+            if s is not None:
+                break
 
         if s is None:
             return {}
@@ -158,13 +567,14 @@ def expand(context):
         snippet = s.clone()
         g.current_snippet = snippet
         g.current_snips_info = snips
+        if _has_python(snippet):
+            snips.eval_pending_globals()
         content, end = snippet.render(snips.globals, context)
-        pos = snippet.jump_position()
-        return {
-            'content': content,
-            'end_col': end,
-            'pos': pos or {},
-        }
+
+        # The expansion replaces the trigger line, whatever its content.
+        g.rendered_lines = [text]
+        return _render_result(content, end, snippet.jump_position(),
+                              edited=0)
     except Exception as e:
         logger.exception(e)
         raise
@@ -175,15 +585,58 @@ def rerender(content):
     if snippet is None:
         return {}
 
-    content, end = snippet.rerender(content)
+    # The line being edited differs from the last render in the buffer.
     pos = snippet.jump_position()
+    content, end = snippet.rerender(content)
+    return _render_result(content, end, snippet.jump_position(),
+                          edited=pos and pos['start_line'])
+
+
+def _render_result(content, end, pos, edited=None):
+    """Gets the lines to change in the buffer for the rendered content.
+
+    The lines from `first_line` to `last_line` (excluded) of the last render,
+    relative to the first line of the expansion, are replaced by
+    `replacement_lines`, the expansion has `line_count` lines afterwards.
+    """
+    lines = content.split('\n')
+    first, last, replacement = diff_lines(g.rendered_lines, lines, edited)
+    g.rendered_lines = lines
     return {
-        'content': content,
-        'pos': pos or {},
+        'first_line': first,
+        'last_line': last,
+        'replacement_lines': replacement,
+        'line_count': len(lines),
         'end_col': end,
+        'pos': pos or {},
     }
 
 
+def diff_lines(old, new, keep=None):
+    """Finds the smallest range of lines to replace in `old` to get `new`.
+
+    :keep: The index of a line of `old` always replaced.
+    :returns: The first and the last (excluded) lines of `old` to replace and
+        the replacement lines.
+    """
+    size = min(len(old), len(new))
+    first = 0
+    while first < size and old[first] == new[first]:
+        first += 1
+
+    end = 0
+    while end < size - first and old[-1 - end] == new[-1 - end]:
+        end += 1
+
+    last = len(old) - end
+    if keep is not None and 0 <= keep < len(old):
+        first = min(first, keep)
+        last = max(last, keep + 1)
+        end = len(old) - last
+
+    return first, last, new[first:len(new) - end]
+
+
 def jump(ft, direction):
     snippet = g.current_snippet
     if snippet is None:
@@ -200,47 +653,162 @@ def reset_jump(ft):
         return
     snip.reset()
     g.current_snippet = None
+    g.rendered_lines = []
     g.current_snips_info = None
 
 
-def _try_init_all(dirs):
-    if _ALL not in cache:
-        snips = SnipInfo()
-        snips.load(_ALL, dirs)
-        cache[_ALL] = snips
+def _has_python(snippet):
+    return '`!p' in snippet.body
+
+
+def _digest(data):
+    return hashlib.sha1(data.encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+def _compile_global(g, body):
+    key = _digest(body)
+    code = _global_codes.lookup(key)
+    if code is None:
+        fname = getattr(g, 'fname', None) or '<global>'
+        line = getattr(g, 'line', -1)
+        # The body starts on the line after the global statement, the
+        # tracebacks give the lines of the file it was first compiled from.
+        code = compile('\n' * (line + 1) + body, fname, 'exec')
+        _global_codes.put(key, code)
+    return code
 
 
 def _dumb_print(*args, **kwargs):
     pass
 
 
+# The builtins of the snippets globals, shared by all SnipInfo objects and
+# never modified.
+_builtins = dict(builtins.__dict__)
+_builtins['print'] = _dumb_print
+
+
 class SnipInfo(object):
-    def __init__(self):
+    def __init__(self, overlay=False):
         import vim
         import os
         import re
-        bs = dict(builtins.__dict__)
-        bs['print'] = _dumb_print
-        self.globals = {'__builtins__': bs, 'vim': vim, 'os': os, 're': re}
-        self.extends = set([])
+        self.globals = {'__builtins__': _builtins, 'vim': vim, 'os': os,
+                        're': re}
+        self.extends = []
         self.snippets = {}
+        self._pending_globals = []
+        # Chained digest of the globals evaluated into `self.globals`.
+        self._globals_key = ''
+        self._footprint = None
+
+        self.ft = None
+        self.overlay = overlay
+        self.dirs = []
+        # path -> (signature, statements), in load order.
+        self.files = collections.OrderedDict()
+        # dir -> (signature, files)
+        self._dir_files = {}
 
     def _eval_global(self, g):
-        if g.tp != '!p':
+        # Evaluated on the first expansion of a python interpolation.
+        if g.tp == '!p':
+            self._pending_globals.append(g)
+
+    def eval_pending_globals(self):
+        """Evaluates the pending globals.
+
+        The pending bodies run in one scope, so the functions of a body see
+        the names defined by the later ones. The resulting namespace is shared
+        with every SnipInfo evaluating the same global bodies in the same
+        order, so each sequence of globals is only executed once per process.
+        """
+        if not self._pending_globals:
             return
-        exec(g.body, self.globals)
+
+        pending, self._pending_globals = self._pending_globals, []
+        bodies = [g.body for g in pending]
+
+        key = self._globals_key
+        for body in bodies:
+            key = _digest(key + _digest(body))
+
+        namespace = _global_namespaces.lookup(key)
+        if namespace is None:
+            # Never modify a namespace which may be shared.
+            namespace = dict(self.globals)
+            for g, body in zip(pending, bodies):
+                exec(_compile_global(g, body), namespace)
+            _global_namespaces.put(key, namespace)
+
+        self.globals = namespace
+        self._globals_key = key
 
     def get(self, key, default=(0, None)):
         return self.snippets.get(key, default)
 
-    def add_items(self, items):
-        priority = 0
-        for item in items:
-            if not isinstance(item, Priority):
-                continue
-            priority = item.priority
-            break
+    def copy(self):
+        """Copies the SnipInfo, sharing the parsed statements of the files.
+        """
+        snips = copy.copy(self)
+        snips.extends = list(self.extends)
+        snips.snippets = dict(self.snippets)
+        snips.files = collections.OrderedDict(self.files)
+        snips._pending_globals = list(self._pending_globals)
+        snips._dir_files = dict(self._dir_files)
+        return snips
+
+    def _measure(self, seen):
+        size = sys.getsizeof(self.snippets)
+        shared = 0
+        for _, s in self.snippets.values():
+            n, m = _snippet_size(s, seen)
+            size += n
+            shared += m
+        return size, shared
+
+    def footprint(self):
+        """Gets the approximate memory used by the snippets, in bytes.
+
+        Strings shared by several snippets are only counted once.
+        """
+        if self._footprint is None:
+            self._footprint, _ = self._measure(set([]))
+        return self._footprint
+
+    def stats(self, seen=None):
+        """Reports the footprint of the snippets.
 
+        :seen: The ids of the strings already counted.
+        """
+        if seen is None:
+            seen = set([])
+        size, shared = self._measure(seen)
+        return {
+            'snippets': len(self.snippets),
+            'files': len(self.files),
+            'bytes': size,
+            'shared_bytes': shared,
+        }
+
+    def covers(self, path):
+        """Checks whether a changed path may affect the snippets.
+        """
+        if path in self.files:
+            return True
+
+        ft = self.ft
+        name = os.path.basename(path)
+        if name == ft or os.path.basename(os.path.dirname(path)) == ft:
+            return True
+
+        if not name.endswith('.snippets'):
+            return False
+
+        return name == '{}.snippets'.format(ft) or \
+            name.startswith('{}_'.format(ft))
+
+    def add_items(self, items, eval_globals=True):
         priority = 0
 
         for item in items:
@@ -249,11 +817,14 @@ class SnipInfo(object):
                 continue
 
             if isinstance(item, Extends):
-                self.extends.update(item.types)
+                for t in item.types:
+                    if t not in self.extends:
+                        self.extends.append(t)
                 continue
 
             if isinstance(item, Global):
-                self._eval_global(item)
+                if eval_globals:
+                    self._eval_global(item)
                 continue
 
             if not isinstance(item, Snippet) or 'r' in item.options:
@@ -263,25 +834,157 @@ class SnipInfo(object):
             if s is not None and s[0] > priority:
                 continue
 
+            _intern_snippet(item)
             self.snippets[item.trigger] = priority, item
 
-    def load(self, ft, dirs):
-        for d in dirs:
-            self._load_in_dir(ft, d)
-
-    def _load_in_dir(self, ft, d):
+    def load(self, ft, dirs, parsed=None):
         if not ft:
-            ft = 'all'
+            ft = _ALL
+        self.ft = ft
+        self.refresh(dirs, parsed)
+
+    def refresh(self, dirs, parsed=None):
+        """Reloads the snippet files changed since the last load.
 
-        files = glob.glob(os.path.join(d, '{}.snippets'.format(ft)))
-        files.extend(glob.glob(os.path.join(d, '{}_*.snippets'.format(ft))))
-        files.extend(glob.glob(os.path.join(d, ft, '*')))
+        Only the files changed, added or deleted are parsed, the snippets
+        table is then rebuilt from the statements of every file in load
+        order so that priorities are resolved as on the initial load.
+
+        :dirs: The snippets directories.
+        :parsed: Optional mapping of path to statements already parsed.
+        :returns: Whether the snippets changed.
+        """
+        files = collections.OrderedDict()
+        reloaded = []
+        stale = []
+
+        bundle = None if self.overlay else g.bundle
+        if bundle is not None:
+            for key in bundle.file_keys(self.ft):
+                entry = self.files.get(key)
+                if entry is None or entry[0] != bundle.sig:
+                    entry = bundle.sig, bundle.statements(key)
+                    reloaded.append(entry[1])
+                files[key] = entry
+
+        for d in dirs:
+            for f in self._find_files(d):
+                try:
+                    sig = signature(os.stat(f))
+                except OSError:
+                    continue
+
+                entry = self.files.get(f)
+                if entry is None or entry[0] != sig:
+                    entry = sig, None
+                    stale.append(f)
+                files[f] = entry
+
+        if parsed is None:
+            parsed = {}
+        missing = [f for f in stale if f not in parsed]
 
         try:
-            for f in files:
-                with open(f) as r:
-                    data = r.read()
-                self.add_items(parse(data, filename=f))
+            for f, items in zip(missing, _parse_files(missing)):
+                parsed[f] = items
         except Exception as e:
             logger.exception(e)
             raise
+
+        for f in stale:
+            files[f] = files[f][0], parsed[f]
+            reloaded.append(parsed[f])
+
+        changed = bool(reloaded) or list(files) != list(self.files)
+
+        self.dirs = list(dirs)
+        self.files = files
+        for d in list(self._dir_files):
+            if d not in self.dirs:
+                del self._dir_files[d]
+
+        if changed:
+            self._rebuild(reloaded)
+
+        return changed
+
+    def _rebuild(self, reloaded):
+        for items in reloaded:
+            for item in items:
+                if isinstance(item, Global):
+                    self._eval_global(item)
+
+        extends = self.extends
+        self.extends = []
+        self.snippets = {}
+        self._footprint = None
+        for _, items in self.files.values():
+            self.add_items(items, eval_globals=False)
+
+        if self.extends != extends:
+            _invalidate_chains()
+
+    def _find_files(self, d):
+        ft = self.ft
+        sub = os.path.join(d, ft)
+
+        try:
+            sig = os.stat(d).st_mtime_ns, _mtime(sub)
+        except OSError:
+            return []
+
+        # Adding or removing files changes the mtime of the directory, so
+        # the glob result is reused until one of them changes.
+        entry = self._dir_files.get(d)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+
+        files = find_files(ft, d)
+
+        # A directory changed within the mtime granularity may change again
+        # without its mtime changing, don't trust the listing yet.
+        now = time.time() * 10**9
+        if all(m is None or now - m > _RACY_NS for m in sig):
+            self._dir_files[d] = sig, files
+        return files
+
+
+def _intern_snippet(s):
+    # Identical strings of the snippets of every filetype share one object.
+    # The bodies of lazy snippets are interned when loaded.
+    s.description = sys.intern(s.description)
+    s.options = sys.intern(s.options)
+    if not isinstance(s, LazySnippet) and s.body:
+        s.body = sys.intern(s.body)
+
+
+def _snippet_size(s, seen):
+    """Gets the size of a snippet and of its strings not in `seen`.
+
+    :returns: The size and the size of the strings already seen.
+    """
+    size = sys.getsizeof(s)
+
+    if isinstance(s, LazySnippet):
+        body = s._body
+    else:
+        body = s.body
+
+    shared = 0
+    for v in (s.trigger, s.description, s.options, body):
+        if v is None:
+            continue
+        n = sys.getsizeof(v)
+        if id(v) in seen:
+            shared += n
+        else:
+            seen.add(id(v))
+            size += n
+    return size, shared
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
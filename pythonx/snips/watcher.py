@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import errno
+import struct
+import select
+import logging
+import threading
+
+logger = logging.getLogger("completor")
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+_EVENT = struct.Struct('iIII')
+
+
+class Watcher(object):
+    """Watches the snippets directories in a daemon thread.
+
+    `callback` is called from the watcher thread with the list of changed
+    paths, or None when the changed paths are unknown.
+    """
+
+    # Changes are reported after the directories stay quiet for this long,
+    # so that an editor writing a file in several steps triggers one reload.
+    delay = 0.1
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.dirs = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, dirs):
+        self.set_dirs(dirs)
+        self._thread = threading.Thread(target=self._run,
+                                        name='snips-watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """Stops the watcher thread, waiting at most `timeout` seconds.
+
+        The resources are released by the thread once it stopped, so that
+        they are never used after being released.
+        """
+        self._stopped.set()
+        self._wake()
+
+        thread = self._thread
+        if thread is None:
+            self.close()
+        elif thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def set_dirs(self, dirs):
+        with self._lock:
+            self.dirs = list(dirs)
+
+    def _run(self):
+        try:
+            self._loop()
+        finally:
+            self.close()
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            try:
+                paths = self.wait()
+            except Exception as e:
+                logger.exception(e)
+                self._stopped.wait(self.delay)
+                continue
+
+            if paths is None or paths:
+                try:
+                    self.callback(paths)
+                except Exception as e:
+                    logger.exception(e)
+
+    def _wake(self):
+        """Wakes the watcher thread up when stopped.
+        """
+
+    def close(self):
+        """Releases the resources of the watcher.
+        """
+
+    def wait(self):
+        """Waits for changes.
+
+        :returns: The changed paths, None when unknown.
+        """
+        self._stopped.wait(self.delay)
+        return []
+
+
+class PollWatcher(Watcher):
+    """Fallback watcher which asks for a refresh at a low frequency.
+    """
+
+    interval = 2.0
+
+    def wait(self):
+        self._stopped.wait(self.interval)
+        return None
+
+
+class InotifyWatcher(Watcher):
+    """Linux inotify based watcher.
+    """
+
+    def __init__(self, callback):
+        Watcher.__init__(self, callback)
+        self._libc = _load_libc()
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(_errno(), 'inotify_init1 failed')
+        self._fd = fd
+        # Written by stop() to wake the thread up from select().
+        self._wakeup = _pipe()
+        # wd -> directory
+        self._wds = {}
+
+    def _wake(self):
+        try:
+            os.write(self._wakeup[1], b'x')
+        except OSError:
+            pass
+
+    def close(self):
+        with self._lock:
+            fds = [self._fd] + list(self._wakeup)
+            self._fd = -1
+            self._wakeup = (-1, -1)
+        for fd in fds:
+            if fd >= 0:
+                os.close(fd)
+
+    def set_dirs(self, dirs):
+        Watcher.set_dirs(self, dirs)
+
+        with self._lock:
+            wanted = set([])
+            for d in self.dirs:
+                wanted.add(os.path.abspath(d))
+                try:
+                    names = os.listdir(d)
+                except OSError:
+                    continue
+                for name in names:
+                    path = os.path.abspath(os.path.join(d, name))
+                    if os.path.isdir(path):
+                        wanted.add(path)
+
+            if self._fd < 0:
+                return
+
+            for wd, d in list(self._wds.items()):
+                if d not in wanted:
+                    self._libc.inotify_rm_watch(self._fd, wd)
+                    self._wds.pop(wd)
+
+            current = set(self._wds.values())
+            for d in wanted - current:
+                self._add_watch(d)
+
+    def _add_watch(self, d):
+        wd = self._libc.inotify_add_watch(
+            self._fd, d.encode('utf-8', 'surrogateescape'), _MASK)
+        if wd < 0:
+            logger.warning("failed to watch %s: %s", d,
+                           os.strerror(_errno()))
+            return
+        self._wds[wd] = d
+
+    def _read(self, timeout):
+        wakeup = self._wakeup[0]
+        r, _, _ = select.select([self._fd, wakeup], [], [], timeout)
+        if not r or wakeup in r:
+            return []
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EBADF):
+                return []
+            raise
+
+        return self._parse_events(data)
+
+    def _parse_events(self, data):
+        paths = []
+        i = 0
+        with self._lock:
+            while i + _EVENT.size <= len(data):
+                wd, mask, _, size = _EVENT.unpack_from(data, i)
+                i += _EVENT.size
+                name = data[i:i+size].rstrip(b'\0')
+                i += size
+
+                d = self._wds.get(wd)
+                if d is None:
+                    continue
+
+                if mask & IN_IGNORED:
+                    self._wds.pop(wd)
+                    continue
+
+                path = d
+                if name:
+                    path = os.path.join(
+                        d, name.decode('utf-8', 'surrogateescape'))
+
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_watch(path)
+
+                paths.append(path)
+        return paths
+
+    def wait(self):
+        paths = []
+        # Wake up periodically to notice stop().
+        while not self._stopped.is_set() and not paths:
+            paths = self._read(1.0)
+
+        # Collect the burst of events belonging to the same change.
+        while not self._stopped.is_set():
+            more = self._read(self.delay)
+            if not more:
+                break
+            paths.extend(more)
+
+        return sorted(set(paths))
+
+
+def create(callback):
+    """Creates the best watcher available on the platform.
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(callback)
+        except Exception as e:
+            logger.info("inotify unavailable, fallback to polling: %s", e)
+    return PollWatcher(callback)
+
+
+def _load_libc():
+    import ctypes
+    import ctypes.util
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                       ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def _pipe():
+    r, w = os.pipe()
+    for fd in (r, w):
+        os.set_blocking(fd, False)
+    return r, w
+
+
+def _errno():
+    import ctypes
+    return ctypes.get_errno()
@@ -1,4 +1,5 @@
 import sys
+import types
 import pytest
 import os
 
@@ -11,3 +12,32 @@ sys.path.append(os.path.join(DIR, 'pythonx'))
 @pytest.fixture(scope='session')
 def current_dir():
     return os.path.join(DIR, 'tests')
+
+
+@pytest.fixture
+def vim(monkeypatch):
+    # The vim module only exists inside Vim.
+    m = types.ModuleType('vim')
+    m.vars = {}
+    monkeypatch.setitem(sys.modules, 'vim', m)
+    return m
+
+
+@pytest.fixture
+def snippets(vim, tmpdir, monkeypatch):
+    from snips import snippets as s
+    from snips import ast
+    from snips.lru import LRUCache
+
+    monkeypatch.setattr(s, 'cache', LRUCache(sizeof=lambda i: i.footprint()))
+    monkeypatch.setattr(s, '_chains', {})
+    monkeypatch.setattr(s, 'overlays', LRUCache(max_entries=32))
+    monkeypatch.setattr(s, '_project_dirs', {})
+    monkeypatch.setattr(s, '_global_namespaces', LRUCache(max_entries=256))
+    monkeypatch.setattr(s, '_global_codes', LRUCache(max_entries=256))
+    monkeypatch.setattr(ast, '_templates', LRUCache(max_entries=512))
+    monkeypatch.setattr(ast, '_rendered', LRUCache(max_entries=256))
+    monkeypatch.setattr(s.g, 'snippets_dirs', [])
+    monkeypatch.setattr(s.g, 'file_cache', None)
+    monkeypatch.setattr(s.g, 'bundle', None)
+    return s
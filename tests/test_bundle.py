@@ -0,0 +1,78 @@
+import pytest
+
+from snips.__main__ import main
+from snips.bundle import Bundle, InvalidBundle
+from snips.ast import Global, Priority
+
+CONTEXT = {
+    'fname': 'a.py',
+    'ftype': 'python',
+    'indent': 0,
+    'tabstop': 4,
+    'expandtab': True,
+}
+
+
+@pytest.fixture
+def bundle(tmpdir):
+    d = tmpdir.mkdir('snippets')
+    d.join('python.snippets').write('\n'.join([
+        'priority 10',
+        'global !p',
+        'def f():',
+        '    return 1',
+        'endglobal',
+        'snippet for "for loop" b',
+        'for ${1:i} in ${2:range(10)}:',
+        '\t$0',
+        'endsnippet',
+        'snippet bad',
+        '${1:oops',
+        'endsnippet',
+    ]))
+    d.mkdir('c').join('loops.snippets').write(
+        'snippet while\nwhile ($1) {}\nendsnippet\n')
+
+    path = str(tmpdir.join('snippets.snipc'))
+    assert main(['compile', str(d), '-o', path]) == 0
+    return Bundle(path)
+
+
+def test_bundle_statements(bundle):
+    assert bundle.filetypes() == ['c', 'python']
+
+    keys = bundle.file_keys('python')
+    assert len(keys) == 1
+
+    p, g, s, _ = bundle.statements(keys[0])
+    assert isinstance(p, Priority) and p.priority == 10
+    assert isinstance(g, Global) and g.body == 'def f():\n    return 1'
+    assert (s.trigger, s.description, s.options) == ('for', 'for loop', 'b')
+    assert s.body == 'for ${1:i} in ${2:range(10)}:\n\t$0'
+
+
+def test_bundle_clone_is_parsed(bundle):
+    stmts = bundle.statements(bundle.file_keys('python')[0])
+    snippet = stmts[2].clone()
+    assert snippet.template.parts
+
+    content, _ = snippet.render({}, dict(CONTEXT))
+    assert content == 'for i in range(10):\n    '
+
+
+def test_invalid_bundle(tmpdir):
+    path = tmpdir.join('invalid.snipc')
+    path.write('not a bundle, not a bundle')
+    with pytest.raises(InvalidBundle):
+        Bundle(str(path))
+
+
+def test_load_bundle(snippets, bundle, tmpdir):
+    d = tmpdir.mkdir('local')
+    d.join('c.snippets').write('snippet while\nlocal\nendsnippet\n')
+
+    snippets.set_bundle(bundle.path)
+    snippets.set_snippets_dirs([str(d)])
+
+    assert [s.trigger for s in snippets.get('python', 'f')] == ['for']
+    assert [s.body for s in snippets.get('c', 'w')] == ['local']
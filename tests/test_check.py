@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from snips.__main__ import main
+from snips.check import check, check_file, find_snippet_files
+
+
+DATA = '\n'.join([
+    'priority x',
+    'snippet ok "fine"',
+    '$1 `!p snip.rv = 1`',
+    'endsnippet',
+    'snippet tab "tabstop"',
+    '${x}',
+    'endsnippet',
+    'global !p',
+    'def f(:',
+    '    pass',
+    'endglobal',
+    'snippet py "python"',
+    'a',
+    '`!p',
+    'x = (`',
+    'endsnippet',
+    'garbage',
+    'snippet last',
+    'x',
+])
+
+
+def test_check_file(tmpdir):
+    path = tmpdir.join('bad.snippets')
+    path.write(DATA)
+
+    problems = check_file(str(path))
+    assert [(p.line, p.message.split(':')[0]) for p in problems] == [
+        (1, 'priority x'),
+        (5, 'invalid tabstop'),
+        (9, 'invalid python'),
+        (15, 'invalid python'),
+        (17, 'unknown syntax'),
+        (18, 'no endsnippet found'),
+    ]
+
+
+def test_check(tmpdir, capsys):
+    d = tmpdir.mkdir('snippets')
+    d.join('good.snippets').write('snippet a\n$1\nendsnippet\n')
+    d.mkdir('python').join('bad.snippets').write('garbage\n')
+
+    problems = check([str(d)])
+    assert [(p.path, p.line) for p in problems] == [
+        (str(d.join('python', 'bad.snippets')), 1)]
+
+    assert main(['check', str(d)]) == 1
+    assert capsys.readouterr().out == \
+        '{}:1: unknown syntax\n'.format(d.join('python', 'bad.snippets'))
+    assert main(['check', str(d.join('good.snippets'))]) == 0
+
+
+def test_check_filetype_dirs(tmpdir):
+    d = tmpdir.mkdir('snippets')
+    ft = d.mkdir('python')
+    ft.join('loops').write('snippet for\n${1\nendsnippet\n')
+    ft.join('good.snippets').write('snippet a\n$1\nendsnippet\n')
+    d.mkdir('.git').join('HEAD').write('ref: refs/heads/master\n')
+
+    # The files the editor loads, whatever their names.
+    assert find_snippet_files([str(d)]) == [
+        str(ft.join('good.snippets')), str(ft.join('loops'))]
+    assert [(p.path, p.line) for p in check([str(d)])] == [
+        (str(ft.join('loops')), 1)]
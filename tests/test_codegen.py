@@ -0,0 +1,225 @@
+import pytest
+
+from snips.ast import Session, Template
+from snips.codegen import generate, interpolation_deps
+
+
+class GenericSession(Session):
+    __slots__ = ()
+
+    _text = Session._render_text
+
+
+CONTEXT = {
+    'fname': 'a.py',
+    'ftype': 'python',
+    'indent': 2,
+    'tabstop': 4,
+    'expandtab': True,
+    'visual': 'sel',
+}
+
+
+def _is_block():
+    return True
+
+
+def _run(cls, template, edits):
+    session = cls(template, _is_block)
+    context = dict(CONTEXT, _prefix='pre ', _suffix=' post')
+    res = [session.render({}, context), session.jump_position()]
+    for e in edits:
+        if e is None:
+            res.append(session.jump('forward'))
+        else:
+            res.append(session.rerender(e))
+            res.append(session.jump_position())
+    return res
+
+
+@pytest.mark.parametrize('body', [
+    '',
+    'plain text\n\tindented',
+    'for (${1:int} ${2:i} = 0; $2 < ${3:n}; $2++) {\n\t${0:/* code */}\n}',
+    'def ${1:f}(${2:a, ${3:b}}):\n\t"""${4:doc of $1}"""\n\t$0',
+    '${1:name} ${1/(\\w+)/\\u$1/} ${2:x\ny} $2',
+    '<${1:div}>${VISUAL}${2:${1/(\\w+)/$1/}}</$1>',
+    '`!p snip.rv = t[1].upper()` ${1:low} ${2:`!p snip.rv = t[1] * 2`}',
+    '\t${1:a}\n\t\t$1 ${2:b}\n${1/(\\w+)/\\u$1/}\n\t`!p snip.rv = t[2]`',
+    # An interpolation reading the attribute assigned by a later one.
+    "`!p snip.rv = getattr(snip, 'z', '?')` ${1:q}\n`!p snip.z = t[1] + '!'`",
+])
+def test_compiled_render(body):
+    template = Template(body)
+    edits = [None, 'q', 'a\nb', None, '', None, 'zed']
+    assert _run(Session, template, edits) == \
+        _run(GenericSession, template, edits)
+
+
+def test_generated_source():
+    template = Template('for ${1:i} in ${2:range(10)}:\n\t$0')
+    source, namespace = generate(template)
+    # The literals are emitted as is, there's no part dispatch left.
+    assert "out.append(':\\n\\t')" in source
+    assert '_render_part' not in source
+    assert namespace['_p0'] is template.placeholders[1]
+
+
+@pytest.mark.parametrize('code,expected', [
+    ('`date`', None),
+    ('!v strftime("%Y")', None),
+    ('!p snip.rv = "x"', ()),
+    ('!p snip.rv = t[1] + t[ 3 ] + t[1]', (1, 3)),
+    ('!p snip.rv = ",".join(t)', None),
+    ('!p snip.rv = t[1] if t else ""', None),
+    ('!p snip.rv = str(len(t[2]))', (2,)),
+    ('!p snip.rv = "".join(c.upper() for c in t[1])', (1,)),
+    # The names assigned by the other interpolations.
+    ('!p x = t[1] + "!"', None),
+    ('!p snip.rv = x', None),
+    ('!p\nif t[1]:\n\tx = 1\nsnip.rv = str(x)', None),
+    # Globals, vim and the mutable snip attributes.
+    ('!p snip.rv = upper(t[1])', None),
+    ('!p snip.rv = vim.eval("&sw")', None),
+    ('!p snip.rv = snip.opt("g:style", t[1])', None),
+    ('!p snip.x = t[1]', None),
+    ('!p import os', None),
+    ('!p snip.rv = (', None),
+])
+def test_interpolation_deps(code, expected):
+    assert interpolation_deps(code) == expected
+
+
+def test_incremental_rerender():
+    calls = []
+
+    def upper(text):
+        calls.append(text)
+        return text.upper()
+
+    template = Template('${1:a} ${2:b} `!p snip.rv = upper(t[2])` $1')
+    session = Session(template, _is_block)
+    assert session.render({'upper': upper}, dict(CONTEXT))[0] == \
+        '  a b B a'
+    assert calls == ['b']
+
+    # The interpolation only reads the second tabstop.
+    assert session.rerender('x')[0] == '  x b B x'
+    assert calls == ['b']
+
+    session.jump('forward')
+    assert session.rerender('y')[0] == '  x y Y x'
+    assert calls == ['b', 'y']
+
+
+def test_plain_rerender(monkeypatch):
+    from snips import ast
+
+    lines = ['\t${{{0}:a{0}}} = ${0}'.format(i) for i in range(1, 100)]
+    template = Template('\n'.join(lines))
+    session = Session(template, _is_block)
+    session.render({}, dict(CONTEXT))
+    session.jump('forward')
+
+    indented = []
+    moved = []
+    indent = ast.tab_indent
+    advance = ast._advance
+
+    def tab_indent(context, line, is_block=None):
+        indented.append(line)
+        return indent(context, line, is_block)
+
+    def _advance(text, line, column):
+        moved.append(text)
+        return advance(text, line, column)
+
+    # Only the units and the lines of the edited tabstop are rendered again.
+    monkeypatch.setattr(ast, 'tab_indent', tab_indent)
+    monkeypatch.setattr(ast, '_advance', _advance)
+    text, end = session.rerender('x\ny')
+    assert indented == ['\tx', 'y = x', 'y']
+    assert moved == []
+    assert text.split('\n')[1:4] == ['      x', '  y = x', '  y']
+    assert session.jump_position() == {
+        'start_line': 1, 'start_column': 6, 'edit_column': 9,
+        'end_line': 2, 'end_column': 3}
+
+
+def test_memoized_interpolations():
+    import os
+
+    calls = []
+
+    def upper(text):
+        calls.append(text)
+        return text.upper()
+
+    def sep(text):
+        calls.append(os.sep)
+        return text
+
+    # Reading `t` through `get` depends on every tabstop when compiling.
+    template = Template('${1:a} ${2:b} `!p snip.rv = upper(t.get(2))` '
+                        '`!p snip.rv = sep(t.get(2))`')
+    session = Session(template, _is_block)
+    g = {'upper': upper, 'sep': sep}
+    assert session.render(g, dict(CONTEXT))[0] == '  a b B b'
+    assert calls == ['b', os.sep]
+
+    # The interpolations reading the other tabstop are reused, the ones
+    # calling into os are always run again.
+    assert session.rerender('x')[0] == '  x b B b'
+    assert calls == ['b', os.sep, os.sep]
+
+    session.jump('forward')
+    assert session.rerender('y')[0] == '  x y Y y'
+    assert calls == ['b', os.sep, os.sep, 'y', os.sep]
+
+
+@pytest.mark.parametrize('body,expected', [
+    # A local assigned by an interpolation read by the next one.
+    ("${1:a} ${2:b} `!p x = t[1] + '!'` `!p snip.rv = x`",
+     'HELLO b  HELLO!'),
+    ("${1:a} `!p x = t[1] + '!'` `!p snip.rv = x + (t.get(5) or '')`",
+     'HELLO  HELLO!'),
+])
+def test_chained_interpolations(body, expected):
+    session = Session(Template(body), _is_block)
+    session.render({}, dict(CONTEXT, indent=0))
+    assert session.rerender('HELLO')[0] == expected
+
+
+def test_impure_interpolations():
+    calls = []
+
+    class Vim(object):
+        def eval(self, expr):
+            calls.append(expr)
+            return str(len(calls))
+
+    template = Template('${1:a} `!p snip.rv = vim.eval("&sw")`')
+    session = Session(template, _is_block)
+    g = {'vim': Vim()}
+    assert session.render(g, dict(CONTEXT, indent=0))[0] == 'a 1'
+    assert session.rerender('b')[0] == 'b 2'
+    assert session.rerender('c')[0] == 'c 3'
+
+
+@pytest.mark.parametrize('helpers,code', [
+    # Builtins imported by name from the impure modules.
+    ('from time import perf_counter_ns as now', 'str(now())'),
+    ('from random import random as rand', 'str(rand())'),
+    # A helper advancing a module level iterator.
+    ('import itertools\n_c = itertools.count()\n'
+     'def tick():\n    return next(_c)', 'str(tick())'),
+])
+def test_impure_helpers(helpers, code):
+    g = {}
+    exec(helpers, g)
+    template = Template('${1:a} `!p snip.rv = ' + code + '`')
+    session = Session(template, _is_block)
+    first = session.render(g, dict(CONTEXT, indent=0))[0]
+    second = session.rerender('b')[0]
+    assert first.startswith('a ') and second.startswith('b ')
+    assert first[2:] != second[2:]
@@ -0,0 +1,49 @@
+import os
+
+from snips.filecache import FileCache, parse_file
+
+SNIPPETS = '''priority -10
+
+snippet for "for loop" b
+for ${1:i} in ${2:range(10)}:
+\t$0
+endsnippet
+'''
+
+
+def _write(path, data):
+    with open(path, 'w') as w:
+        w.write(data)
+
+
+def test_parse_file_cached(tmpdir):
+    path = str(tmpdir.join('python.snippets'))
+    _write(path, SNIPPETS)
+
+    file_cache = FileCache(str(tmpdir.join('cache')))
+    stmts = parse_file(path, file_cache)
+    assert stmts[1].trigger == 'for'
+
+    cached = file_cache.load(path, _sig(path))
+    assert [repr(s) for s in cached] == [repr(s) for s in stmts]
+    assert cached[1].body == stmts[1].body
+
+
+def test_parse_file_invalidated(tmpdir):
+    path = str(tmpdir.join('python.snippets'))
+    _write(path, SNIPPETS)
+
+    file_cache = FileCache(str(tmpdir.join('cache')))
+    parse_file(path, file_cache)
+
+    _write(path, SNIPPETS.replace('for', 'while'))
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    stmts = parse_file(path, file_cache)
+    assert stmts[1].trigger == 'while'
+
+
+def _sig(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
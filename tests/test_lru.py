@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+from snips.lru import LRUCache
+
+
+def test_lru():
+    c = LRUCache(max_entries=2)
+    c.put('a', 1)
+    c.put('b', 2)
+    assert c.lookup('a') == 1
+    c.put('c', 3)
+    assert list(c) == ['a', 'c']
+
+    c.max_entries = 0
+    c.max_size = 4
+    c.sizeof = lambda v: v
+    c['d'] = 4
+    assert c.evict(protected=('a',)) == ['c', 'd']
+    assert list(c) == ['a']
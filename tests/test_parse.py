@@ -1,10 +1,12 @@
+import io
 import pytest
 import os
 import glob
 from subprocess import call
 
-from snips.parser import parse
-from snips.ast import Snippet, parse_snippet_body
+from snips.parser import parse, scan, iter_parse, gen_highlight_groups
+from snips.ast import Snippet, Comment, BaseParseError, VISUAL_NUM, \
+    parse_snippet_body, _SnippetPart, _Transformation, _escape
 
 snippets = 'https://github.com/honza/vim-snippets.git'
 
@@ -60,3 +62,327 @@ write_function_docstring(t, snip) `
     body = 'def ${1:fname}(`!p snip.rv = "self, " if snip.indent else ""`$2):\n\t$0'  # noqa
     d = parse_snippet_body(body)[0]
     assert d[3].literal == '!p snip.rv = "self, " if snip.indent else ""'
+
+
+def test_scan(tmpdir):
+    data = '\n'.join([
+        'priority -50',
+        '',
+        'global !p',
+        'def f():',
+        '    pass',
+        'endglobal',
+        'snippet for "for loop" b',
+        'for ${1:i}:',
+        '\t$0',
+        'endsnippet',
+        'snippet empty',
+        'endsnippet',
+        'extends c',
+        'snippet last',
+        'x',
+        'endsnippet',
+    ])
+    path = tmpdir.join('python.snippets')
+    path.write(data)
+
+    expected = [s for s in parse(data) if not isinstance(s, Comment)]
+    stmts = scan(str(path))
+
+    assert len(stmts) == len(expected)
+    for s, e in zip(stmts, expected):
+        assert isinstance(s, type(e))
+        for attr in ('trigger', 'description', 'options', 'body', 'line',
+                     'priority', 'types'):
+            if hasattr(e, attr):
+                assert getattr(s, attr) == getattr(e, attr)
+
+
+def test_scan_changed_file(tmpdir):
+    data = '\n'.join([
+        'snippet for "first"',
+        'first',
+        'endsnippet',
+        'snippet for "second"',
+        'second',
+        'endsnippet',
+    ])
+    path = tmpdir.join('python.snippets')
+    path.write(data)
+    stmts = scan(str(path))
+
+    # Same lines, new bodies.
+    path.write(data.replace('first', 'one').replace('second', 'two') + '\n')
+    assert stmts[1].body == 'two'
+
+    # The snippets moved, take the same one of the trigger.
+    path.write('\n\n' + data + '\n')
+    assert stmts[0].body == 'first'
+
+
+def _attrs(obj):
+    names = set([])
+    for cls in type(obj).__mro__:
+        names.update(getattr(cls, '__slots__', ()))
+    return dict((n, getattr(obj, n)) for n in names if hasattr(obj, n))
+
+
+def test_iter_parse():
+    data = '\n'.join([
+        '# comment',
+        'priority -50',
+        'global !p',
+        'x = 1',
+        'endglobal',
+        'snippet for "for loop" b',
+        'for ${1:i}:',
+        '\t$0',
+        'endsnippet',
+        'extends c',
+    ])
+
+    stmts = list(iter_parse(io.StringIO(data), filename='a.snippets'))
+    expected = parse(data, filename='a.snippets')
+    assert [type(s) for s in stmts] == [type(s) for s in expected]
+    assert [_attrs(s) for s in stmts] == [_attrs(s) for s in expected]
+
+    def lines():
+        yield 'snippet a\n'
+        yield 'a\n'
+        yield 'endsnippet\n'
+        raise AssertionError('read too far')
+
+    # Statements are yielded before the rest of the file is read.
+    assert next(iter_parse(lines())).trigger == 'a'
+
+
+def test_highlight():
+    lines = [
+        'global !p',
+        'x = 1',
+        'endglobal',
+        'snippet for "for loop" b',
+        'for ${1:i}:',
+        'endsnippet',
+    ]
+
+    assert all(not s.hi_groups for s in parse(lines, is_lines=True))
+
+    groups = [h['group'] for h in gen_highlight_groups(lines)]
+    for group in ('trigger', 'description', 'option', 'placeholder'):
+        assert 'snips_' + group in groups
+
+
+# The character at a time body parser the scanner replaced, the reference of
+# the equivalence tests.
+def _ref_parse_number(data, i):
+    n = ''
+    while i < len(data) and data[i] in '0123456789':
+        n += data[i]
+        i += 1
+    return n, i
+
+
+def _ref_parse_body(body, phs, start=0, in_placeholder=False, nest=0):
+    i = start
+    parts = []
+    current = _SnippetPart()
+    while i < len(body):
+        c = body[i]
+
+        if c == '\\':
+            current.append_literal(_escape(body[i+1]))
+            i += 2
+            continue
+
+        if c == '$' and body[i+1] in '0123456789{':
+            current.end_offset = i
+            parts.append(current)
+
+            p, j = _ref_parse_tabstop(body, phs, i + 1, i, nest)
+
+            if p.transformation is None:
+                exist = phs.get(p.number)
+                if not exist or p.default or exist.nest_level > nest:
+                    phs[p.number] = p
+
+            parts.append(p)
+            current = _SnippetPart(start_offset=j)
+            i = j
+            continue
+
+        if c == '`':
+            current.end_offset = i
+            parts.append(current)
+            current = _SnippetPart(
+                _SnippetPart.INTERPOLATION, start_offset=i)
+
+            j = i + 1
+            matched = False
+            while j < len(body):
+                d = body[j]
+                if d == '\\' and len(body) > j + 1:
+                    current.append_literal(_escape(body[j+1]))
+                    j += 2
+                    continue
+
+                if d == '`':
+                    matched = True
+                    i = current.end_offset = j + 1
+                    parts.append(current)
+                    current = _SnippetPart(start_offset=j+1)
+                    break
+
+                current.append_literal(d)
+                j += 1
+
+            if not matched:
+                current = _SnippetPart(start_offset=i)
+                current.append_literal(c)
+                i += 1
+            continue
+
+        if c == '}' and in_placeholder:
+            current.end_offset = i
+            parts.append(current)
+            return parts, i + 1
+
+        current.append_literal(c)
+        i += 1
+
+    current.end_offset = i
+    parts.append(current)
+    return parts, i
+
+
+def _ref_parse_tabstop(data, phs, i, start, nest):
+    p = _SnippetPart(_SnippetPart.PLACEHOLDER, start_offset=start)
+    p.nest_level = nest
+
+    n, j = _ref_parse_number(data, i)
+    if n:
+        p.number = int(n)
+        p.end_offset = j
+        return p, j
+
+    if data[i] != '{':
+        raise BaseParseError
+
+    i += 1
+
+    if data[i:].startswith('VISUAL'):
+        n = VISUAL_NUM
+        j = i + 6
+    else:
+        n, j = _ref_parse_number(data, i)
+        if not n:
+            raise BaseParseError
+
+    p.number = int(n)
+
+    if data[j] == '}':
+        p.end_offset = j + 1
+        return p, j + 1
+
+    if data[j] == '/':
+        tran, j = _ref_parse_transformation(data, j+1)
+        tran.reference = p.number
+        p.end_offset = j
+        p.transformation = tran
+        return p, j
+
+    if data[j] != ':':
+        raise BaseParseError
+
+    parts, i = _ref_parse_body(data, phs, start=j+1, in_placeholder=True,
+                               nest=nest+1)
+    p.default = parts
+    p.end_offset = i
+    return p, p.end_offset
+
+
+def _ref_parse_transformation(data, i):
+    parts = ['', '', '']
+    current = 0
+
+    while len(data) > i:
+        c = data[i]
+        if c == '\\':
+            n = data[i+1]
+            if n == 'n':
+                n = '\n'
+            parts[current] += c + n
+            i += 2
+            continue
+
+        if c == '/':
+            current += 1
+            if current > 3:
+                raise BaseParseError
+            i += 1
+            continue
+
+        if current == 2 and c == '}':
+            return _Transformation(*parts), i+1
+
+        parts[current] += c
+        i += 1
+
+    raise BaseParseError
+
+
+def _tree(parts):
+    return [(p.type, p.start_offset, p.end_offset, p.literal, p.number,
+             p.nest_level, p.transformation and _attrs(p.transformation),
+             _tree(p.default)) for p in parts]
+
+
+def _parse_both(body):
+    result = []
+    for parse_body in (parse_snippet_body, _ref_parse_body):
+        phs = {}
+        try:
+            parts, i = parse_body(body, phs)
+        except Exception as e:
+            result.append(type(e))
+            continue
+        result.append((_tree(parts), i, sorted(
+            (n, p.start_offset) for n, p in phs.items())))
+    return result
+
+
+def _bodies(snippets_dir):
+    for item in glob.glob(os.path.join(snippets_dir, '*.snippets')):
+        with open(item) as f:
+            for s in parse(f.read(), filename=item):
+                if isinstance(s, Snippet):
+                    yield s.body
+
+
+def test_body_scanner():
+    bodies = [
+        '',
+        'plain text',
+        'a $1 b ${2} c ${3:x ${4:y} z} $0',
+        '${VISUAL}${VISUAL:default}',
+        r'\$1 \`x\` \\ \n \}',
+        '`!p snip.rv = "a"` `!v expand("%")` `date`',
+        r'`!p snip.rv = \`x\``',
+        '`unclosed',
+        'unclosed \\`',
+        '${1:a}} $',
+        '${1/(\\w+)/\\u$1/g} ${2/a\\/b/(?1:x:y)/}',
+        '${1:${2:${3:deep}}}',
+        '$',
+        '${x}',
+        '${1',
+    ]
+    for body in bodies:
+        new, ref = _parse_both(body)
+        assert new == ref, body
+
+
+def test_body_scanner_corpus(snippets_dir):
+    for body in _bodies(snippets_dir):
+        new, ref = _parse_both(body)
+        assert new == ref, body
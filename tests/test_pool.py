@@ -0,0 +1,42 @@
+import pytest
+
+from snips import pool
+from snips.filecache import parse_file
+
+
+def test_parse_files_order(tmpdir):
+    paths = []
+    for i in range(10):
+        p = tmpdir.join('ft{}.snippets'.format(i))
+        p.write('snippet t{}\nbody {}\nendsnippet\n'.format(i, i))
+        paths.append(str(p))
+
+    serial = [parse_file(p) for p in paths]
+    parallel = pool.parse_files(paths, workers=2, force=True)
+
+    assert [[s.trigger for s in stmts] for stmts in parallel] == \
+        [[s.trigger for s in stmts] for stmts in serial]
+    assert [stmts[0].body for stmts in parallel] == \
+        ['body {}'.format(i) for i in range(10)]
+
+
+def test_small_input_is_serial(tmpdir):
+    p = tmpdir.join('python.snippets')
+    p.write('snippet for\nfor\nendsnippet\n')
+    assert not pool.should_parallelize([str(p)])
+
+
+def test_serial_unless_parallel(tmpdir, monkeypatch):
+    p = tmpdir.join('python.snippets')
+    p.write('snippet for\nfor\nendsnippet\n')
+
+    def fail(workers=None):
+        raise AssertionError('forked')
+    monkeypatch.setattr(pool, 'should_parallelize', lambda paths: True)
+    monkeypatch.setattr(pool, 'create_executor', fail)
+
+    # Loads of the editor threads never fork.
+    stmts = pool.parse_files([str(p)] * 10)
+    assert [s[0].trigger for s in stmts] == ['for'] * 10
+    with pytest.raises(AssertionError):
+        pool.parse_files([str(p)] * 10, parallel=True)
@@ -0,0 +1,539 @@
+import os
+import sys
+import time
+
+import pytest
+
+
+def _write(path, data, mtime=None):
+    with open(str(path), 'w') as w:
+        w.write(data)
+    if mtime is not None:
+        os.utime(str(path), ns=(mtime, mtime))
+
+
+def _snippet(trigger, body, priority=None):
+    data = ''
+    if priority is not None:
+        data += 'priority {}\n'.format(priority)
+    return data + 'snippet {}\n{}\nendsnippet\n'.format(trigger, body)
+
+
+def _body(snippets, ft, trigger):
+    _, s = snippets.cache[ft].get(trigger)
+    return s and s.body
+
+
+def test_reload_changed_file(snippets, tmpdir):
+    d = tmpdir.mkdir('a')
+    _write(d.join('python.snippets'), _snippet('for', 'v1'), 10**9)
+    _write(d.join('python_x.snippets'), _snippet('if', 'if'), 10**9)
+    snippets.set_snippets_dirs([str(d)])
+
+    snippets.get('python', 'f')
+    info = snippets.cache['python']
+    other = info.files[str(d.join('python_x.snippets'))]
+
+    _write(d.join('python.snippets'), _snippet('for', 'v2'), 2 * 10**9)
+    snippets.get('python', 'f')
+
+    assert snippets.cache['python'] is info
+    assert _body(snippets, 'python', 'for') == 'v2'
+    assert info.files[str(d.join('python_x.snippets'))] is other
+
+
+def test_reload_added_and_deleted_file(snippets, tmpdir):
+    d = tmpdir.mkdir('a')
+    _write(d.join('python.snippets'), _snippet('for', 'for'))
+    snippets.set_snippets_dirs([str(d)])
+    snippets.get('python', 'f')
+
+    _write(d.join('python_x.snippets'), _snippet('if', 'if'))
+    assert [s.trigger for s in snippets.get('python', 'i')] == ['if']
+
+    d.join('python.snippets').remove()
+    assert snippets.get('python', 'fo') == []
+
+
+def test_reload_priority(snippets, tmpdir):
+    d = tmpdir.mkdir('a')
+    _write(d.join('python.snippets'), _snippet('for', 'high', 10))
+    _write(d.join('python_x.snippets'), _snippet('for', 'low', 0), 10**9)
+    snippets.set_snippets_dirs([str(d)])
+    snippets.get('python', 'f')
+    assert _body(snippets, 'python', 'for') == 'high'
+
+    _write(d.join('python_x.snippets'), _snippet('for', 'low2', 0),
+           2 * 10**9)
+    snippets.get('python', 'f')
+    assert _body(snippets, 'python', 'for') == 'high'
+
+
+def test_change_snippets_dirs(snippets, tmpdir):
+    a = tmpdir.mkdir('a')
+    b = tmpdir.mkdir('b')
+    _write(a.join('python.snippets'), _snippet('for', 'a'))
+    _write(b.join('python.snippets'), _snippet('while', 'b'))
+
+    snippets.set_snippets_dirs([str(a)])
+    snippets.get('python', 'f')
+    entry = snippets.cache['python'].files[str(a.join('python.snippets'))]
+
+    snippets.set_snippets_dirs([str(a), str(b)])
+    triggers = [s.trigger for s in snippets.get('python', '')]
+    assert triggers == ['for', 'while']
+    files = snippets.cache['python'].files
+    assert files[str(a.join('python.snippets'))] is entry
+
+    snippets.set_snippets_dirs([str(b)])
+    assert [s.trigger for s in snippets.get('python', '')] == ['while']
+
+
+def test_prewarm(snippets, tmpdir, monkeypatch):
+    d = tmpdir.mkdir('a')
+    _write(d.join('python.snippets'), _snippet('for', 'for'))
+    snippets.set_snippets_dirs([str(d)])
+
+    loaded = []
+    load = snippets.SnipInfo.load
+
+    def slow_load(self, ft, dirs):
+        loaded.append(ft)
+        time.sleep(0.1)
+        load(self, ft, dirs)
+
+    monkeypatch.setattr(snippets.SnipInfo, 'load', slow_load)
+
+    snippets.prewarm('python')
+    assert [s.trigger for s in snippets.get('python', 'f')] == ['for']
+    snippets.prewarm('python')
+    assert sorted(loaded) == ['all', 'python']
+
+
+def test_preload_all(snippets, tmpdir):
+    d = tmpdir.mkdir('a')
+    _write(d.join('python.snippets'), _snippet('for', 'for'))
+    _write(d.join('python_x.snippets'), _snippet('if', 'if'))
+    _write(d.join('all.snippets'), _snippet('date', 'date'))
+    d.mkdir('c')
+    _write(d.join('c', 'loops.snippets'), _snippet('while', 'while'))
+    snippets.set_snippets_dirs([str(d)])
+
+    assert snippets.preload_all() == ['all', 'c', 'python']
+    assert sorted(snippets.cache['python'].snippets) == ['for', 'if']
+    assert sorted(snippets.cache['c'].snippets) == ['while']
+
+
+def _triggers(snippets, ft, token=''):
+    return [(s.trigger, s.body) for s in snippets.get(ft, token)]
+
+
+def test_extends(snippets, tmpdir):
+    d = tmpdir.mkdir('a')
+    _write(d.join('c.snippets'), _snippet('inc', 'c') + _snippet('main', 'c'))
+    _write(d.join('cpp.snippets'),
+           'extends c\n' + _snippet('main', 'cpp') + _snippet('cls', 'cpp'))
+    _write(d.join('all.snippets'), _snippet('date', 'all'))
+    snippets.set_snippets_dirs([str(d)])
+
+    assert _triggers(snippets, 'cpp') == [
+        ('cls', 'cpp'), ('date', 'all'), ('inc', 'c'), ('main', 'cpp')]
+    assert snippets._chains['cpp'] == ['cpp', 'c', 'all']
+    # The tables of the extended filetypes are shared, not copied.
+    assert sorted(snippets.cache['cpp'].snippets) == ['cls', 'main']
+
+
+def test_extends_cycle(snippets, tmpdir):
+    d = tmpdir.mkdir('a')
+    _write(d.join('a.snippets'), 'extends b\n' + _snippet('x', 'a'))
+    _write(d.join('b.snippets'), 'extends a\n' + _snippet('y', 'b'))
+    snippets.set_snippets_dirs([str(d)])
+
+    assert _triggers(snippets, 'a') == [('x', 'a'), ('y', 'b')]
+    assert _triggers(snippets, 'b') == [('x', 'a'), ('y', 'b')]
+
+
+def test_compound_filetype(snippets, tmpdir):
+    d = tmpdir.mkdir('a')
+    _write(d.join('javascript.snippets'),
+           _snippet('fn', 'js') + _snippet('cl', 'js'))
+    _write(d.join('jsx.snippets'), _snippet('comp', 'jsx') +
+           _snippet('cl', 'jsx'))
+    snippets.set_snippets_dirs([str(d)])
+
+    assert _triggers(snippets, 'javascript.jsx') == [
+        ('cl', 'js'), ('comp', 'jsx'), ('fn', 'js')]
+
+
+def test_extends_reload(snippets, tmpdir):
+    d = tmpdir.mkdir('a')
+    _write(d.join('c.snippets'), _snippet('inc', 'c'))
+    _write(d.join('cpp.snippets'), _snippet('cls', 'cpp'), 10**9)
+    snippets.set_snippets_dirs([str(d)])
+    assert _triggers(snippets, 'cpp') == [('cls', 'cpp')]
+
+    _write(d.join('cpp.snippets'), 'extends c\n' + _snippet('cls', 'cpp'),
+           2 * 10**9)
+    assert _triggers(snippets, 'cpp') == [('cls', 'cpp'), ('inc', 'c')]
+
+
+def test_project_overlay(snippets, tmpdir):
+    d = tmpdir.mkdir('global')
+    _write(d.join('python.snippets'), _snippet('for', 'global') +
+           _snippet('if', 'global'))
+    snippets.set_snippets_dirs([str(d)])
+
+    project = tmpdir.mkdir('repo')
+    _write(project.mkdir('.snippets').join('python.snippets'),
+           _snippet('for', 'project'))
+    path = str(project.mkdir('src').join('main.py'))
+
+    assert _triggers(snippets, 'python') == [
+        ('for', 'global'), ('if', 'global')]
+    assert [(s.trigger, s.body) for s in snippets.get('python', '', path)] \
+        == [('for', 'project'), ('if', 'global')]
+
+    base = snippets.cache['python']
+    other = str(tmpdir.mkdir('other').join('main.py'))
+    assert [s.body for s in snippets.get('python', 'for', other)] == \
+        ['global']
+    assert snippets.cache['python'] is base
+    assert snippets._project_dirs[str(project)][1] == \
+        str(project.join('.snippets'))
+    assert snippets._project_dirs[str(project.join('src'))][1] is None
+
+
+def test_project_dir_changes(snippets, tmpdir):
+    d = tmpdir.mkdir('global')
+    _write(d.join('python.snippets'), _snippet('for', 'global'))
+    snippets.set_snippets_dirs([str(d)])
+
+    project = tmpdir.mkdir('repo')
+    path = str(project.join('main.py'))
+    assert [s.body for s in snippets.get('python', 'for', path)] == \
+        ['global']
+
+    local = project.mkdir('.snippets')
+    _write(local.join('python.snippets'), _snippet('for', 'project'))
+    os.utime(str(project), ns=(2 * 10**9, 2 * 10**9))
+    assert [s.body for s in snippets.get('python', 'for', path)] == \
+        ['project']
+
+    local.remove()
+    assert [s.body for s in snippets.get('python', 'for', path)] == \
+        ['global']
+
+
+def test_project_dir_created_above(snippets, tmpdir):
+    d = tmpdir.mkdir('global')
+    _write(d.join('python.snippets'), _snippet('for', 'global'))
+    snippets.set_snippets_dirs([str(d)])
+
+    project = tmpdir.mkdir('repo')
+    path = str(project.mkdir('src').mkdir('pkg').join('a.py'))
+    assert [s.body for s in snippets.get('python', 'for', path)] == \
+        ['global']
+
+    # Only the mtime of the project root changes.
+    local = project.mkdir('.snippets')
+    _write(local.join('python.snippets'), _snippet('for', 'project'))
+    os.utime(str(project), ns=(2 * 10**9, 2 * 10**9))
+    assert [s.body for s in snippets.get('python', 'for', path)] == \
+        ['project']
+
+
+def test_overlays_bounded(snippets, tmpdir):
+    for i in range(snippets.overlays.max_entries + 8):
+        local = tmpdir.mkdir('local{}'.format(i))
+        _write(local.join('all.snippets'), _snippet('for', str(i)))
+        snippets.get('python', 'for', local_dirs=[str(local)])
+    assert len(snippets.overlays) == snippets.overlays.max_entries
+
+
+def test_buffer_overlay(snippets, tmpdir):
+    d = tmpdir.mkdir('global')
+    _write(d.join('python.snippets'), _snippet('for', 'global'))
+    local = tmpdir.mkdir('local')
+    _write(local.join('all.snippets'), _snippet('for', 'local'))
+    snippets.set_snippets_dirs([str(d)])
+
+    items = snippets.get('python', 'for', local_dirs=[str(local).encode()])
+    assert [s.body for s in items] == ['local']
+
+
+def test_cache_limit(snippets, tmpdir):
+    d = tmpdir.mkdir('snippets')
+    for ft in ('all', 'c', 'go', 'python'):
+        _write(d.join(ft + '.snippets'), _snippet('x' + ft, ft))
+    snippets.set_snippets_dirs([str(d)])
+    snippets.set_cache_limit(max_filetypes=2)
+
+    _triggers(snippets, 'c')
+    _triggers(snippets, 'go')
+    assert sorted(snippets.cache) == ['all', 'go']
+
+    assert _triggers(snippets, 'c') == [('xall', 'all'), ('xc', 'c')]
+    assert sorted(snippets.cache) == ['all', 'c']
+    assert snippets.cache['all'].globals['__builtins__'] is \
+        snippets.cache['c'].globals['__builtins__']
+
+    stats = snippets.stats()
+    assert stats['c']['snippets'] == 1
+    assert stats['c']['files'] == 1
+    assert stats['c']['bytes'] > 0
+
+    snippets.set_cache_limit(max_bytes=1)
+    _triggers(snippets, 'python')
+    assert sorted(snippets.cache) == ['all', 'python']
+
+
+def test_shared_globals(snippets, tmpdir):
+    d = tmpdir.mkdir('snippets')
+    helper = 'global !p\nimport itertools\ncounter = itertools.count()\n' \
+        'endglobal\n'
+    _write(d.join('c.snippets'), helper + _snippet('for', 'c'))
+    _write(d.join('go.snippets'), helper + _snippet('for', 'go'))
+    snippets.set_snippets_dirs([str(d)])
+
+    _triggers(snippets, 'c')
+    _triggers(snippets, 'go')
+    c = snippets.cache['c']
+    go = snippets.cache['go']
+    assert 'counter' not in c.globals
+
+    c.eval_pending_globals()
+    go.eval_pending_globals()
+    assert next(c.globals['counter']) == 0
+    assert c.globals['counter'] is go.globals['counter']
+    assert next(go.globals['counter']) == 1
+
+
+def test_global_dependencies(snippets, tmpdir):
+    d = tmpdir.mkdir('snippets')
+    helper = 'global !p\ndef join(a, b):\n\treturn a + sep + b\n' \
+        'endglobal\n'
+    counter = 'global !p\nimport itertools\ncounter = itertools.count()\n' \
+        'endglobal\n'
+    _write(d.join('c.snippets'), counter +
+           'global !p\nsep = "-"\nendglobal\n' + helper)
+    _write(d.join('go.snippets'), counter +
+           'global !p\nsep = "+"\nendglobal\n' + helper)
+    snippets.set_snippets_dirs([str(d)])
+
+    _triggers(snippets, 'c')
+    _triggers(snippets, 'go')
+    c = snippets.cache['c']
+    go = snippets.cache['go']
+    c.eval_pending_globals()
+    go.eval_pending_globals()
+
+    # The same body is evaluated again when the globals before it differ.
+    assert c.globals['join']('a', 'b') == 'a-b'
+    assert go.globals['join']('a', 'b') == 'a+b'
+    assert c.globals['counter'] is not go.globals['counter']
+
+
+def test_global_later_names(snippets, tmpdir):
+    d = tmpdir.mkdir('snippets')
+    _write(d.join('python.snippets'),
+           'global !p\ndef a():\n\treturn b()\nendglobal\n'
+           'global !p\ndef b():\n\treturn 1\nendglobal\n' +
+           _snippet('one', '`!p snip.rv = str(a())`'))
+    snippets.set_snippets_dirs([str(d)])
+    _triggers(snippets, 'python')
+    info = snippets.cache['python']
+    info.eval_pending_globals()
+
+    context = {'fname': 'a.py', 'ftype': 'python', 'indent': 0,
+               'tabstop': 4, 'expandtab': True}
+    s = info.get('one')[1].clone()
+    assert s.render(info.globals, dict(context))[0] == '1'
+
+
+def test_dedup_strings(snippets, tmpdir):
+    d = tmpdir.mkdir('snippets')
+    body = 'for (${1:int} ${2:i} = 0; $2 < ${3:n}; $2++) {\n\t$0\n}'
+    for ft in ('c', 'cpp'):
+        _write(d.join(ft + '.snippets'),
+               'snippet {} "for loop" b\n{}\nendsnippet\n'.format(ft, body))
+    snippets.set_snippets_dirs([str(d)])
+
+    _triggers(snippets, 'c')
+    _triggers(snippets, 'cpp')
+    c = snippets.cache['c'].get('c')[1]
+    cpp = snippets.cache['cpp'].get('cpp')[1]
+    assert c.body is cpp.body
+    assert c.description is cpp.description
+
+    stats = snippets.stats()
+    assert stats['c']['shared_bytes'] + stats['cpp']['shared_bytes'] >= \
+        sys.getsizeof(body)
+
+
+def test_shared_template(snippets, tmpdir, monkeypatch):
+    from snips import ast
+
+    d = tmpdir.mkdir('snippets')
+    _write(d.join('python.snippets'),
+           _snippet('def', 'def ${1:f}(${2}):\n\t${3:pass}'))
+    snippets.set_snippets_dirs([str(d)])
+    _triggers(snippets, 'python')
+    s = snippets.cache['python'].get('def')[1]
+
+    calls = []
+    compile_body = ast.Template
+
+    def counted(body):
+        calls.append(body)
+        return compile_body(body)
+    monkeypatch.setattr(ast, 'Template', counted)
+
+    context = {'indent': 0, 'tabstop': 4, 'expandtab': True}
+    first = s.clone()
+    second = s.clone()
+    assert first.render({}, dict(context))[0] == 'def f():\n    pass'
+    assert second.render({}, dict(context))[0] == 'def f():\n    pass'
+    assert len(calls) == 1
+    assert first.session.template is second.session.template
+
+    # Editing an expansion never changes the other ones.
+    assert first.rerender('main')[0] == 'def main():\n    pass'
+    assert second.rerender('g')[0] == 'def g():\n    pass'
+    assert s.clone().render({}, dict(context))[0] == 'def f():\n    pass'
+    assert len(calls) == 1
+
+
+def test_static_render_cache(monkeypatch):
+    from snips import ast
+
+    renders = []
+    render = ast.Session.render
+
+    def counted(self, g, context):
+        renders.append(self)
+        return render(self, g, context)
+    monkeypatch.setattr(ast.Session, 'render', counted)
+
+    def expand(options, **context):
+        snippet = ast.Snippet('for', '', options,
+                              'for ${1:i} in ${2:range(10)}:\n\t$0')
+        context.update(indent=4, tabstop=4, expandtab=True)
+        return snippet, snippet.render({}, context)
+
+    first, res = expand('b')
+    assert res == ('    for i in range(10):\n        ', 8)
+    second, res = expand('b')
+    assert res == ('    for i in range(10):\n        ', 8)
+    assert len(renders) == 1
+    assert second.jump_position()['start_column'] == 8
+
+    # Each expansion is edited on its own.
+    assert first.rerender('k')[0] == '    for k in range(10):\n        '
+    assert second.rerender('j')[0] == '    for j in range(10):\n        '
+
+    # Inline expansions only add their prefix and suffix.
+    expand('w', _prefix='', _suffix='')
+    snippet, res = expand('w', _prefix='x = ', _suffix=' # end')
+    assert res == ('x = for i in range(10):\n\t # end', 1)
+    assert len(renders) == 2
+    assert snippet.jump_position()['start_column'] == 8
+    assert snippet.rerender('n')[0] == 'x = for n in range(10):\n\t # end'
+
+    # Interpolations are always rendered.
+    context = {'fname': 'a.py', 'ftype': 'python', 'indent': 0,
+               'tabstop': 4, 'expandtab': True}
+    snippet = ast.Snippet('d', '', 'b', '`!p snip.rv = "d"`')
+    snippet.render({}, dict(context))
+    snippet.clone().render({}, dict(context))
+    assert len(renders) == 4
+
+
+def test_interpolation_code(snippets, tmpdir):
+    import traceback
+
+    d = tmpdir.mkdir('snippets')
+    path = d.join('python.snippets')
+    _write(path, 'global !p\ndef half(n):\n\treturn 1 / n\nendglobal\n' +
+           _snippet('half', '${1:2}\n`!p\nsnip.rv = str(half(int(t[1])))`'))
+    snippets.set_snippets_dirs([str(d)])
+    _triggers(snippets, 'python')
+    info = snippets.cache['python']
+    info.eval_pending_globals()
+
+    context = {'fname': 'a.py', 'ftype': 'python', 'indent': 0,
+               'tabstop': 4, 'expandtab': True}
+    s = info.get('half')[1].clone()
+    assert s.render(info.globals, dict(context))[0] == '2\n0.5'
+
+    # The code is compiled once for every expansion.
+    interp = s.session.template.interpolation(
+        s.session.template.parts[-1])
+    code = interp.code
+    assert s.rerender('4')[0] == '4\n0.25'
+    other = info.get('half')[1].clone()
+    other.render(info.globals, dict(context))
+    assert other.session.template.interpolation(
+        other.session.template.parts[-1]).code is code
+
+    # The tracebacks give the lines of the snippets file.
+    with pytest.raises(ZeroDivisionError) as e:
+        s.rerender('0')
+    frames = traceback.extract_tb(e.value.__traceback__)[-2:]
+    assert [(f[0], f[1]) for f in frames] == [(str(path), 8),
+                                              (str(path), 3)]
+
+
+@pytest.mark.parametrize('old,new,keep,expected', [
+    (['a'], ['a'], None, (1, 1, [])),
+    (['a'], ['a'], 0, (0, 1, ['a'])),
+    (['a', 'b', 'c'], ['a', 'x', 'c'], None, (1, 2, ['x'])),
+    (['a', 'b', 'c'], ['a', 'b', 'x', 'c'], None, (2, 2, ['x'])),
+    (['a', 'b', 'c'], ['a', 'c'], None, (1, 2, [])),
+    (['a', 'b', 'c'], ['a', 'x', 'c'], 2, (1, 3, ['x', 'c'])),
+    (['t'], ['x', 'y'], 0, (0, 1, ['x', 'y'])),
+])
+def test_diff_lines(snippets, old, new, keep, expected):
+    assert snippets.diff_lines(old, new, keep) == expected
+
+
+def test_render_diff(snippets, tmpdir):
+    d = tmpdir.mkdir('snippets')
+    _write(d.join('python.snippets'),
+           'snippet cls "class" b\nclass ${1:Name}(object):\n'
+           '\tdef __init__(self):\n\t\tsuper($1, self).__init__()\n'
+           'endsnippet\n'
+           'snippet pair "pair" b\n${1:a}\nfixed\n${2:b}\nendsnippet\n')
+    snippets.set_snippets_dirs([str(d)])
+
+    context = {
+        b'text': b'cls', b'column': 3, b'lnum': 0, b'ftype': b'python',
+        b'fname': b'a.py', b'fpath': b'a.py', b'indent': 0, b'tabstop': 4,
+        b'expandtab': 1, b'shiftwidth': 4, b'visual': b'',
+    }
+    res = snippets.expand(context)
+    assert (res['first_line'], res['last_line']) == (0, 1)
+    assert res['replacement_lines'] == [
+        'class Name(object):',
+        '    def __init__(self):',
+        '        super(Name, self).__init__()',
+    ]
+    assert res['line_count'] == 3
+    assert res['pos']['start_line'] == 0
+
+    # From the edited line to the mirror line.
+    res = snippets.rerender('Foo')
+    assert (res['first_line'], res['last_line']) == (0, 3)
+    assert res['replacement_lines'] == [
+        'class Foo(object):',
+        '    def __init__(self):',
+        '        super(Foo, self).__init__()',
+    ]
+
+    snippets.reset_jump('python')
+    context[b'text'] = b'pair'
+    context[b'column'] = 4
+    snippets.expand(context)
+    res = snippets.rerender('x')
+    assert (res['first_line'], res['last_line']) == (0, 1)
+    assert res['replacement_lines'] == ['x']
+    assert res['line_count'] == 3
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from snips import watcher
+
+
+def _write(path, data):
+    with open(str(path), 'w') as w:
+        w.write(data)
+
+
+def _wait_for(cond, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def watched(snippets):
+    yield snippets
+    snippets.stop_watcher()
+
+
+@pytest.mark.parametrize('cls', [watcher.InotifyWatcher, watcher.PollWatcher])
+def test_watcher_reload(watched, tmpdir, monkeypatch, cls):
+    if cls is watcher.PollWatcher:
+        monkeypatch.setattr(cls, 'interval', 0.05)
+    monkeypatch.setattr(watcher, 'create', cls)
+
+    d = tmpdir.mkdir('a')
+    _write(d.join('python.snippets'), 'snippet for\nv1\nendsnippet\n')
+    watched.set_snippets_dirs([str(d)])
+    watched.start_watcher()
+
+    watched.get('python', 'f')
+    info = watched.cache['python']
+
+    _write(d.join('python_x.snippets'), 'snippet if\nif\nendsnippet\n')
+    assert _wait_for(lambda: watched.cache['python'] is not info)
+
+    new = watched.cache['python']
+    assert sorted(new.snippets) == ['for', 'if']
+    assert sorted(info.snippets) == ['for']
+
+
+@pytest.mark.parametrize('cls', [watcher.Watcher, watcher.InotifyWatcher])
+def test_watcher_stop(tmpdir, cls):
+    changes = []
+    w = cls(changes.append)
+    w.start([str(tmpdir)])
+    w.stop()
+
+    # The thread released the resources before stop returned.
+    assert not w._thread.is_alive()
+    assert getattr(w, '_fd', -1) == -1
+    assert changes == []